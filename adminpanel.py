@@ -1,8 +1,6 @@
 from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel, QPushButton
 
-from productmanagementapp import ProductManagementApp
-from salesmanagementapp import SalesManagementApp
-from usermanagementapp import UserManagementApp
+# The management screens (and matplotlib, for sales) are imported when first opened
 
 
 class AdminPanel(QDialog):
@@ -26,14 +24,19 @@ class AdminPanel(QDialog):
         sales_management_button.clicked.connect(self.open_sales_management)
         main_layout.addWidget(sales_management_button)
 
+        performance_button = QPushButton('Performance', self)
+        performance_button.clicked.connect(self.open_performance_view)
+        main_layout.addWidget(performance_button)
 
         self.product_management_app = None
         self.sales_management_app = None
+        self.performance_view = None
 
 
     def open_sales_management(self):
         # Create UserManagementApp if it doesn't exist
         if not self.sales_management_app:
+            from salesmanagementapp import SalesManagementApp
             self.sales_management_app = SalesManagementApp()
 
         # Show UserManagementApp
@@ -42,7 +45,15 @@ class AdminPanel(QDialog):
     def open_product_management(self):
         # Create ProductManagementApp if it doesn't exist
         if not self.product_management_app:
+            from productmanagementapp import ProductManagementApp
             self.product_management_app = ProductManagementApp()
 
         # Show ProductManagementApp
-        self.product_management_app.show()
\ No newline at end of file
+        self.product_management_app.show()
+
+    def open_performance_view(self):
+        if not self.performance_view:
+            from performanceview import PerformanceView
+            self.performance_view = PerformanceView()
+
+        self.performance_view.show()
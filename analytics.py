@@ -0,0 +1,235 @@
+"""Columnar sales and stock analytics on NumPy arrays.
+
+Result sets are streamed out of PostgreSQL with COPY straight into arrays, so no
+per-row Python objects are created, and money is kept as integer cents so sums
+stay exact. Products are identified by a code indexing into a labels array.
+Days are counted from 1970-01-01 (see to_day/from_day).
+"""
+import io
+import re
+from datetime import date, timedelta
+
+import numpy as np
+
+EPOCH = date(1970, 1, 1)
+
+# Backslash escapes used by COPY's text format
+COPY_TEXT_ESCAPE = re.compile(r'\\(.)')
+COPY_TEXT_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+
+
+class SalesColumns:
+    """Sales as parallel arrays, one entry per sale or per (product, day) from the rollup."""
+
+    __slots__ = ('labels', 'product', 'day', 'quantity', 'total_cents')
+
+    def __init__(self, labels, product, day, quantity, total_cents):
+        self.labels = labels
+        self.product = product
+        self.day = day
+        self.quantity = quantity
+        self.total_cents = total_cents
+
+    def __len__(self):
+        return len(self.product)
+
+
+class StockColumns:
+    """Current stock as parallel arrays, one entry per product."""
+
+    __slots__ = ('labels', 'quantity', 'price_cents')
+
+    def __init__(self, labels, quantity, price_cents):
+        self.labels = labels
+        self.quantity = quantity
+        self.price_cents = price_cents
+
+    @property
+    def value_cents(self):
+        return self.quantity * self.price_cents
+
+
+def to_day(value):
+    return (value - EPOCH).days
+
+
+def from_day(day):
+    return EPOCH + timedelta(days=int(day))
+
+
+def days_to_dates(days):
+    """Convert an array of day numbers to datetime64 dates, which matplotlib plots directly."""
+    return np.asarray(days).astype('datetime64[D]')
+
+
+def cents_to_amount(cents):
+    """Convert cents to currency units as floats, for plotting."""
+    return np.asarray(cents) / 100.0
+
+
+def fetch_columns(conn, query, params=None, count=None):
+    """Run a query returning only integer columns and return one int64 array per column.
+
+    count is the number of columns, needed to shape an empty result.
+    """
+    cursor = conn.cursor()
+    if params is not None:
+        query = cursor.mogrify(query, params).decode()
+
+    buffer = io.StringIO()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", buffer)
+    buffer.seek(0)
+
+    if not buffer.getvalue():
+        return [np.zeros(0, dtype=np.int64) for _ in range(count or 0)]
+    table = np.loadtxt(buffer, delimiter=',', dtype=np.int64, ndmin=2)
+    return [table[:, column] for column in range(table.shape[1])]
+
+
+def fetch_labels(conn, query, params=None):
+    """Run a query returning a single text column and return it as an object array."""
+    cursor = conn.cursor()
+    if params is not None:
+        query = cursor.mogrify(query, params).decode()
+
+    buffer = io.StringIO()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT", buffer)
+    lines = buffer.getvalue().split('\n')[:-1]
+    if any('\\' in line for line in lines):
+        lines = [_unescape_copy_text(line) for line in lines]
+    return np.array(lines, dtype=object)
+
+
+def _unescape_copy_text(value):
+    if value == '\\N':
+        return None
+    return COPY_TEXT_ESCAPE.sub(lambda match: COPY_TEXT_ESCAPES.get(match.group(1), match.group(1)), value)
+
+
+def _date_range_condition(column, start_date, end_date):
+    conditions = ['TRUE']
+    params = []
+    if start_date is not None:
+        conditions.append(f"{column} >= %s")
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append(f"{column} <= %s")
+        params.append(end_date)
+    return ' AND '.join(conditions), params
+
+
+def _sales_labels(conn, start_date, end_date):
+    # Every product name in the sales history also appears in the (much smaller) rollup
+    condition, params = _date_range_condition('sales_date', start_date, end_date)
+    return fetch_labels(conn, "SELECT DISTINCT product_name FROM sales_daily_rollup "
+                              f"WHERE {condition} ORDER BY product_name", params)
+
+
+def _load_sales(conn, table, day_expression, date_column, start_date, end_date):
+    labels = _sales_labels(conn, start_date, end_date)
+    condition, params = _date_range_condition(date_column, start_date, end_date)
+
+    # Names that appeared after the labels were read get no code and are left out
+    product, day, quantity, total_cents = fetch_columns(
+        conn,
+        f"SELECT labels.code - 1, {day_expression} - DATE '1970-01-01', quantity, ROUND(total * 100)::bigint "
+        f"FROM {table} JOIN unnest(%s::text[]) WITH ORDINALITY AS labels (name, code) "
+        f"ON labels.name = product_name WHERE {condition}",
+        [list(labels)] + params, count=4)
+    return SalesColumns(labels, product, day, quantity, total_cents)
+
+
+def load_daily_sales(conn, start_date=None, end_date=None):
+    """Load per-product, per-day sales from the rollup table."""
+    return _load_sales(conn, 'sales_daily_rollup', 'sales_date', 'sales_date', start_date, end_date)
+
+
+def load_sales_history(conn, start_date=None, end_date=None):
+    """Load every individual sale, for analyses the daily rollup cannot answer."""
+    return _load_sales(conn, 'sales_history', 'timestamp::date', 'timestamp::date', start_date, end_date)
+
+
+def load_sales_by_product(conn, start_date=None, end_date=None):
+    """Return (labels, quantity, total_cents) per product, summed by the database from the rollup."""
+    labels = _sales_labels(conn, start_date, end_date)
+    condition, params = _date_range_condition('sales_date', start_date, end_date)
+
+    product, quantity, total_cents = fetch_columns(
+        conn,
+        "SELECT labels.code - 1, SUM(quantity)::bigint, SUM(ROUND(total * 100))::bigint "
+        "FROM sales_daily_rollup JOIN unnest(%s::text[]) WITH ORDINALITY AS labels (name, code) "
+        f"ON labels.name = product_name WHERE {condition} GROUP BY labels.code",
+        [list(labels)] + params, count=3)
+    size = len(labels)
+    return labels, group_sum(product, quantity, size), group_sum(product, total_cents, size)
+
+
+def fetch_product_names(conn, product_ids):
+    """Return the names of the given products, aligned with product_ids even if some were deleted since."""
+    return fetch_labels(conn, "SELECT COALESCE(products.name, '') "
+                              "FROM unnest(%s::int[]) WITH ORDINALITY AS ids (product_id, position) "
+                              "LEFT JOIN products USING (product_id) ORDER BY ids.position",
+                        (product_ids.tolist(),))
+
+
+def load_stock(conn):
+    """Load every product's quantity and price."""
+    product_ids, quantity, price_cents = fetch_columns(
+        conn, "SELECT product_id, quantity, ROUND(price * 100)::bigint FROM products ORDER BY product_id", count=3)
+    return StockColumns(fetch_product_names(conn, product_ids), quantity, price_cents)
+
+
+def group_sum(codes, values, size):
+    """Sum values per code (0 <= code < size), exactly for totals below 2**53."""
+    if not len(codes):
+        return np.zeros(size, dtype=np.int64)
+    return np.rint(np.bincount(codes, weights=values, minlength=size)).astype(np.int64)
+
+
+def sales_by_product(sales):
+    """Return (labels, quantity, total_cents) summed per product."""
+    size = len(sales.labels)
+    return (sales.labels, group_sum(sales.product, sales.quantity, size),
+            group_sum(sales.product, sales.total_cents, size))
+
+
+def daily_series(sales, values, first_day=None, last_day=None):
+    """Sum values per day into a dense series, returning (days, sums) with missing days as zero."""
+    if first_day is None:
+        first_day = int(sales.day.min()) if len(sales) else 0
+    if last_day is None:
+        last_day = int(sales.day.max()) if len(sales) else first_day - 1
+
+    in_range = (sales.day >= first_day) & (sales.day <= last_day)
+    sums = group_sum(sales.day[in_range] - first_day, values[in_range], last_day - first_day + 1)
+    return np.arange(first_day, last_day + 1), sums
+
+
+def moving_average(values, window):
+    """Trailing moving average; the first window - 1 entries average over what is available."""
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return values
+
+    sums = np.cumsum(values)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return sums / counts
+
+
+def percentiles(values, q=(50, 90, 99)):
+    """Return the given percentiles of values, or NaNs when there are none."""
+    if not len(values):
+        return np.full(len(q), np.nan)
+    return np.percentile(values, q)
+
+
+def top_n(labels, values, n):
+    """Return (labels, values) of the n largest values, largest first."""
+    values = np.asarray(values)
+    if n < len(values):
+        indices = np.argpartition(values, -n)[-n:]
+    else:
+        indices = np.arange(len(values))
+    indices = indices[np.argsort(values[indices], kind='stable')[::-1]]
+    return labels[indices], values[indices]
@@ -0,0 +1,494 @@
+"""Asyncio HTTP/1.1 JSON API for POS terminals and integrations.
+
+Endpoints:
+    GET  /products/{id}                     one product
+    GET  /products?ids=1,2,3                several products in one lookup
+    POST /sell        {product_id, quantity}
+    POST /sell/batch  {"sales": [{product_id, quantity}, ...]}
+    POST /restock     {"product_ids": [...]}  (optional; every low product by default)
+    POST /stock/batch {"changes": [{product_id, quantity}, ...]}
+    GET  /sales?after=ORDER_ID&limit=N       sales history, one keyset page at a time
+    GET  /reports/{sales|stock|profitability|daily}?start=YYYY-MM-DD&end=YYYY-MM-DD
+
+The POST routes change stock, so they require HTTP Basic credentials of a user
+in the users table; the GET routes are open. The server listens on localhost
+unless another host is given.
+
+Connections are kept alive and pipelined requests are handled concurrently, with
+responses written back in request order. Database work runs on the existing
+connection pool through AsyncConnectionPool, and single sales arriving at the
+same time are combined into one sell_many statement.
+
+Usage: python apiserver.py [HOST] [PORT]
+"""
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from urllib.parse import parse_qs, urlsplit
+
+from database import POOL_MAX_SIZE, close_pool
+from inventoryservice import get_inventory_service
+from reportcache import get_report_cache
+
+API_HOST = '127.0.0.1'
+API_PORT = 8080
+
+MAX_HEADER_SIZE = 16 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+MAX_PIPELINED_REQUESTS = 32  # Requests read ahead on one connection before waiting for responses
+KEEP_ALIVE_TIMEOUT = 30  # Seconds an idle connection is kept open
+
+SALES_PAGE_SIZE = 100
+MAX_SALES_PAGE_SIZE = 1000
+MAX_BATCH_SIZE = 1000
+
+# Single sales are held this long to be combined with sales from other terminals
+SALE_BATCH_DELAY = 0.002  # 2 ms
+SALE_BATCH_SIZE = 200
+
+# Credentials that authenticated are trusted for this long before being checked again
+AUTH_CACHE_SECONDS = 60
+
+STATUS_REASONS = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found', 405: 'Method Not Allowed',
+                  409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class AsyncConnectionPool:
+    """Runs blocking service operations on pooled connections without blocking the event loop.
+
+    At most max_size operations run at once, one per pooled connection; the rest wait
+    in the executor's queue instead of in the connection pool.
+    """
+
+    def __init__(self, max_size=POOL_MAX_SIZE):
+        self.service = get_inventory_service()
+        self._executor = ThreadPoolExecutor(max_size, thread_name_prefix='api-database')
+
+    async def run(self, operation, *args):
+        """Run operation(conn, *args) in its own transaction and return its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.service.run, operation, *args)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class SaleBatcher:
+    """Combines single sales made at about the same time into one sell_many call.
+
+    Each sale still gets its own result; sell_many applies them in arrival order.
+    """
+
+    def __init__(self, pool, delay=SALE_BATCH_DELAY, batch_size=SALE_BATCH_SIZE):
+        self.pool = pool
+        self.delay = delay
+        self.batch_size = batch_size
+        self._pending = []
+        self._flush_handle = None
+
+    async def sell(self, product_id, quantity):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((product_id, quantity, future))
+
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._sell(batch))
+
+    async def _sell(self, batch):
+        try:
+            sales = await self.pool.run(self.pool.service.sell_many,
+                                        [(product_id, quantity) for product_id, quantity, _ in batch])
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), sale in zip(batch, sales):
+            if not future.done():
+                future.set_result(sale)
+
+
+def to_json(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if hasattr(value, 'tolist'):
+        # NumPy arrays and scalars from the report operations
+        return value.tolist()
+    if hasattr(value, '__slots__'):
+        return {name: getattr(value, name) for name in value.__slots__}
+    if hasattr(value, '__dict__'):
+        return vars(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def product_json(product):
+    return {'product_id': product.product_id, 'name': product.name, 'description': product.description,
+            'price': product.price, 'quantity': product.quantity}
+
+
+def sale_json(sale):
+    if sale is None:
+        return {'sold': False, 'error': 'Insufficient stock or unknown product'}
+    return {'sold': True, 'product_id': sale.product_id, 'quantity': sale.quantity,
+            'new_quantity': sale.new_quantity, 'total': sale.total}
+
+
+def positive_int(value, name):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise HttpError(400, f'{name} must be an integer')
+    if number <= 0:
+        raise HttpError(400, f'{name} must be positive')
+    return number
+
+
+def query_date(query, name):
+    values = query.get(name)
+    if not values:
+        return None
+    try:
+        return date.fromisoformat(values[0])
+    except ValueError:
+        raise HttpError(400, f'{name} must be a YYYY-MM-DD date')
+
+
+def basic_credentials(authorization):
+    """Return (username, password) from a Basic Authorization header, or None."""
+    scheme, _, encoded = (authorization or '').partition(' ')
+    if scheme.lower() != 'basic':
+        return None
+    try:
+        username, separator, password = base64.b64decode(encoded.strip(), validate=True).decode().partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return (username, password) if separator else None
+
+
+def batch_items(body, key, fields):
+    """Return the items of body[key] as tuples of integers, given (field, minimum) pairs."""
+    items = body.get(key) if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        raise HttpError(400, f'{key} must be a non-empty list')
+    if len(items) > MAX_BATCH_SIZE:
+        raise HttpError(413, f'At most {MAX_BATCH_SIZE} {key} per request')
+
+    try:
+        rows = [tuple(int(item[field]) for field, _ in fields) for item in items]
+    except (TypeError, KeyError, ValueError):
+        raise HttpError(400, f'Every item in {key} needs integer {", ".join(field for field, _ in fields)}')
+
+    for row in rows:
+        for value, (field, minimum) in zip(row, fields):
+            if value < minimum:
+                raise HttpError(400, f'Every {field} in {key} must be at least {minimum}')
+    return rows
+
+
+class InventoryApi:
+    """Request routing and handlers; each handler returns a JSON-serializable value."""
+
+    REPORTS = {
+        'sales': 'sales_report',
+        'stock': 'stock_report',
+        'profitability': 'profitability_report',
+        'daily': 'daily_sales_report',
+    }
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.service = pool.service
+        self.sales = SaleBatcher(pool)
+        self.report_cache = get_report_cache()
+        self._authenticated = {}  # Authorization header -> time its credentials are checked again
+        # (method, path, handler, whether the caller must log in)
+        self.routes = [
+            ('GET', re.compile(r'/products/(\d+)'), self.get_product, False),
+            ('GET', re.compile(r'/products'), self.get_products, False),
+            ('POST', re.compile(r'/sell'), self.sell, True),
+            ('POST', re.compile(r'/sell/batch'), self.sell_batch, True),
+            ('POST', re.compile(r'/restock'), self.restock, True),
+            ('POST', re.compile(r'/stock/batch'), self.set_stock_batch, True),
+            ('GET', re.compile(r'/sales'), self.sales_page, False),
+            ('GET', re.compile(r'/reports/(\w+)'), self.report, False),
+        ]
+
+    async def handle(self, method, target, body, authorization=None):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        path_matched = False
+        for route_method, pattern, handler, requires_login in self.routes:
+            match = pattern.fullmatch(url.path)
+            if not match:
+                continue
+            path_matched = True
+            if route_method == method:
+                if requires_login:
+                    await self.authenticate(authorization)
+                return await handler(query, body, *match.groups())
+
+        raise HttpError(405 if path_matched else 404, f'No route for {method} {url.path}')
+
+    async def authenticate(self, authorization):
+        """Check Basic credentials against the users table, raising a 401 HttpError if they fail."""
+        now = time.monotonic()
+        if self._authenticated.get(authorization, 0) > now:
+            return
+
+        credentials = basic_credentials(authorization)
+        if credentials is None:
+            raise HttpError(401, 'Login required')
+        if await self.pool.run(self.service.authenticate, *credentials) is None:
+            raise HttpError(401, 'Invalid username or password')
+
+        # Expired entries are dropped whenever one is added, so the table stays small
+        self._authenticated = {header: expiry for header, expiry in self._authenticated.items() if expiry > now}
+        self._authenticated[authorization] = now + AUTH_CACHE_SECONDS
+
+    async def get_product(self, query, body, product_id):
+        products = await self.pool.run(self.service.get_products, [int(product_id)])
+        if not products:
+            raise HttpError(404, f'Unknown product {product_id}')
+        return product_json(products[0])
+
+    async def get_products(self, query, body):
+        try:
+            product_ids = [int(value) for value in ','.join(query.get('ids', [])).split(',') if value]
+        except ValueError:
+            raise HttpError(400, 'ids must be a comma-separated list of integers')
+        if not product_ids or len(product_ids) > MAX_BATCH_SIZE:
+            raise HttpError(400, f'Pass between 1 and {MAX_BATCH_SIZE} ids')
+
+        products = await self.pool.run(self.service.get_products, product_ids)
+        return {'products': [product_json(product) for product in products]}
+
+    async def sell(self, query, body, *groups):
+        if not isinstance(body, dict):
+            raise HttpError(400, 'Expected a JSON object')
+        product_id = positive_int(body.get('product_id'), 'product_id')
+        quantity = positive_int(body.get('quantity'), 'quantity')
+
+        sale = await self.sales.sell(product_id, quantity)
+        if sale is None:
+            raise HttpError(409, 'Insufficient stock or unknown product')
+        return sale_json(sale)
+
+    async def sell_batch(self, query, body):
+        sales = batch_items(body, 'sales', (('product_id', 1), ('quantity', 1)))
+        results = await self.pool.run(self.service.sell_many, sales)
+        return {'sales': [sale_json(sale) for sale in results]}
+
+    async def restock(self, query, body):
+        product_ids = body.get('product_ids') if isinstance(body, dict) else None
+        if product_ids is not None and (
+                not isinstance(product_ids, list)
+                or not all(isinstance(product_id, int) and not isinstance(product_id, bool)
+                           for product_id in product_ids)):
+            raise HttpError(400, 'product_ids must be a list of integers')
+        if product_ids is not None and len(product_ids) > MAX_BATCH_SIZE:
+            raise HttpError(413, f'At most {MAX_BATCH_SIZE} product_ids per request')
+
+        restocks = await self.pool.run(self.service.restock_low_stock, product_ids)
+        return {'restocks': restocks}
+
+    async def set_stock_batch(self, query, body):
+        changes = batch_items(body, 'changes', (('product_id', 1), ('quantity', 0)))
+        updated = await self.pool.run(self.service.set_stock_many, changes)
+        return {'updated': updated}
+
+    async def sales_page(self, query, body):
+        try:
+            after = max(int(query.get('after', ['0'])[0] or 0), 0)
+        except ValueError:
+            raise HttpError(400, 'after must be an integer')
+        limit = min(positive_int(query.get('limit', [SALES_PAGE_SIZE])[0], 'limit'), MAX_SALES_PAGE_SIZE)
+
+        rows = await self.pool.run(self.service.sales_page, after, limit)
+        sales = [{'order_id': row[0], 'product_id': row[1], 'product_name': row[2], 'quantity': row[3],
+                  'total': row[4], 'timestamp': row[5], 'status': row[6]} for row in rows]
+        return {'sales': sales, 'next_after': sales[-1]['order_id'] if len(sales) == limit else None}
+
+    async def report(self, query, body, report_type):
+        operation_name = self.REPORTS.get(report_type)
+        if operation_name is None:
+            raise HttpError(404, f'Unknown report {report_type}')
+
+        operation = getattr(self.service, operation_name)
+        params = () if report_type == 'stock' else (query_date(query, 'start'), query_date(query, 'end'))
+        result = await self.pool.run(self.report_cache.get, report_type, operation, *params)
+        return {'report': report_type, 'columns': result}
+
+
+class HttpConnection:
+    """One keep-alive client connection; pipelined requests run concurrently but answer in order."""
+
+    def __init__(self, api, reader, writer):
+        self.api = api
+        self.reader = reader
+        self.writer = writer
+        self.responses = asyncio.Queue(MAX_PIPELINED_REQUESTS)
+
+    async def serve(self):
+        sender = asyncio.ensure_future(self.send_responses())
+        try:
+            while True:
+                request = await self.read_request()
+                if request is None:
+                    break
+
+                method, target, body, authorization, keep_alive = request
+                await self.responses.put((asyncio.ensure_future(self.respond(method, target, body, authorization)),
+                                          keep_alive))
+                if not keep_alive:
+                    break
+        except HttpError as e:
+            await self.responses.put((self.error_response(e), False))
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            await self.responses.put(None)
+            await sender
+            self.writer.close()
+
+    async def read_request(self):
+        try:
+            head = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise HttpError(400, 'Incomplete request')
+            return None
+        except asyncio.LimitOverrunError:
+            raise HttpError(413, 'Request headers too large')
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise HttpError(400, 'Malformed request line')
+
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HttpError(400, 'Chunked request bodies are not supported')
+        try:
+            length = int(headers.get('content-length', 0) or 0)
+        except ValueError:
+            raise HttpError(400, 'Invalid Content-Length')
+        if length > MAX_BODY_SIZE:
+            raise HttpError(413, 'Request body too large')
+        body = await self.reader.readexactly(length) if length else b''
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        return method.upper(), target, body, headers.get('authorization'), keep_alive
+
+    async def respond(self, method, target, body, authorization=None):
+        started = time.perf_counter()
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            return self.error_response(HttpError(400, 'Body is not valid JSON'))
+
+        try:
+            status, result = 200, await self.api.handle(method, target, payload, authorization)
+        except HttpError as e:
+            return self.error_response(e)
+        except Exception as e:
+            logging.error(f'Error handling {method} {target}: {e}')
+            status, result = 500, {'error': 'Internal server error'}
+
+        logging.debug(f'{method} {target} {status} in {(time.perf_counter() - started) * 1000:.1f} ms')
+        return status, json.dumps(result, default=to_json).encode()
+
+    @staticmethod
+    def error_response(error):
+        return error.status, json.dumps({'error': str(error)}).encode()
+
+    async def send_responses(self):
+        disconnected = False
+        while True:
+            item = await self.responses.get()
+            if item is None:
+                return
+
+            response, keep_alive = item
+            status, payload = await response if asyncio.isfuture(response) else response
+            if disconnected:
+                # Keep draining so the reading side never blocks on a full queue
+                continue
+
+            self.writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                              b'%sConnection: %s\r\n\r\n' % (
+                                  status, STATUS_REASONS.get(status, '').encode(), len(payload),
+                                  b'WWW-Authenticate: Basic realm="IMS"\r\n' if status == 401 else b'',
+                                  b'keep-alive' if keep_alive else b'close'))
+            self.writer.write(payload)
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                disconnected = True
+
+
+async def serve(host=API_HOST, port=API_PORT):
+    pool = AsyncConnectionPool()
+    api = InventoryApi(pool)
+
+    async def on_connection(reader, writer):
+        await HttpConnection(api, reader, writer).serve()
+
+    server = await asyncio.start_server(on_connection, host, port, limit=MAX_HEADER_SIZE)
+    logging.info(f'Inventory API listening on http://{host}:{port}')
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        pool.close()
+        close_pool()
+
+
+def main(argv):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    host = argv[1] if len(argv) > 1 else API_HOST
+    port = int(argv[2]) if len(argv) > 2 else API_PORT
+    try:
+        asyncio.run(serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,118 @@
+"""Load test a running apiserver.py.
+
+Opens CONNECTIONS keep-alive connections and sends REQUESTS requests on each,
+PIPELINE at a time without waiting for the responses in between. Each request
+is a product lookup or, with probability SELL_SHARE, a sale of one unit of a
+random product from 1..PRODUCTS. Sales log in as the user given by the
+IMS_API_USER and IMS_API_PASSWORD environment variables. Prints throughput and
+latency percentiles as JSON.
+
+Usage: python benchmarks/api_load.py [HOST] [PORT] [CONNECTIONS] [REQUESTS] [PIPELINE]
+"""
+import asyncio
+import base64
+import json
+import os
+import random
+import sys
+import time
+
+API_HOST = '127.0.0.1'
+API_PORT = 8080
+
+CONNECTIONS = 50
+REQUESTS = 1000  # Per connection
+PIPELINE = 8
+PRODUCTS = 1000
+SELL_SHARE = 0.3
+
+API_CREDENTIALS = base64.b64encode(
+    f"{os.environ.get('IMS_API_USER', 'admin')}:{os.environ.get('IMS_API_PASSWORD', '')}".encode())
+
+
+def build_request(host, rng):
+    product_id = rng.randint(1, PRODUCTS)
+    if rng.random() < SELL_SHARE:
+        body = json.dumps({'product_id': product_id, 'quantity': 1}).encode()
+        return (b'POST /sell HTTP/1.1\r\nHost: %s\r\nAuthorization: Basic %s\r\nContent-Type: application/json\r\n'
+                b'Content-Length: %d\r\n\r\n%s' % (host.encode(), API_CREDENTIALS, len(body), body))
+    return b'GET /products/%d HTTP/1.1\r\nHost: %s\r\n\r\n' % (product_id, host.encode())
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = 0
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        if name.strip().lower() == b'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def run_connection(host, port, requests, pipeline, seed, latencies, statuses):
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    sent_at = []
+    window = asyncio.Semaphore(pipeline)
+
+    async def send():
+        for _ in range(requests):
+            await window.acquire()
+            sent_at.append(time.perf_counter())
+            writer.write(build_request(host, rng))
+            await writer.drain()
+
+    sender = asyncio.ensure_future(send())
+    for index in range(requests):
+        status = await read_response(reader)
+        latencies.append(time.perf_counter() - sent_at[index])
+        statuses[status] = statuses.get(status, 0) + 1
+        window.release()
+
+    await sender
+    writer.close()
+    await writer.wait_closed()
+
+
+def percentile(sorted_values, share):
+    return sorted_values[min(int(len(sorted_values) * share), len(sorted_values) - 1)]
+
+
+async def run(host, port, connections, requests, pipeline):
+    latencies = []
+    statuses = {}
+    started = time.perf_counter()
+    await asyncio.gather(*(run_connection(host, port, requests, pipeline, seed, latencies, statuses)
+                           for seed in range(connections)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'benchmark': 'api_load',
+        'connections': connections,
+        'requests_per_connection': requests,
+        'pipeline': pipeline,
+        'requests': len(latencies),
+        'seconds': round(elapsed, 4),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'latency_ms': {name: round(percentile(latencies, share) * 1000, 3)
+                       for name, share in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))},
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def main(argv):
+    host = argv[1] if len(argv) > 1 else API_HOST
+    port = int(argv[2]) if len(argv) > 2 else API_PORT
+    connections = int(argv[3]) if len(argv) > 3 else CONNECTIONS
+    requests = int(argv[4]) if len(argv) > 4 else REQUESTS
+    pipeline = int(argv[5]) if len(argv) > 5 else PIPELINE
+
+    print(json.dumps(asyncio.run(run(host, port, connections, requests, pipeline)), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
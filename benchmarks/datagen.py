@@ -0,0 +1,88 @@
+"""Synthetic products, sales and inventory history for the benchmark suite.
+
+Rows are generated lazily from a seeded random generator, so the same scale and
+seed always give the same data and even the largest scale never has to fit in
+memory. Sales are spread over the last HISTORY_DAYS days and skewed towards a
+minority of popular products; a small share of products starts below its low
+stock threshold.
+"""
+import random
+from datetime import datetime, timedelta
+
+# Products per scale; sales and inventory history grow in proportion
+SCALES = {
+    '1k': 1000,
+    '100k': 100000,
+    '1m': 1000000,
+}
+
+SALES_PER_PRODUCT = 5
+HISTORY_PER_PRODUCT = 5
+HISTORY_DAYS = 365
+
+LOW_STOCK_THRESHOLD = 10
+RESTOCK_QUANTITY = 10
+LOW_STOCK_SHARE = 0.02
+SALE_STATUS = 'sold'
+
+
+class Dataset:
+    """Generates the rows for one scale; every generator can be iterated more than once."""
+
+    def __init__(self, scale, seed=0, now=None):
+        if scale not in SCALES:
+            raise ValueError(f'Unknown scale {scale!r}, expected one of {", ".join(SCALES)}')
+
+        self.scale = scale
+        self.seed = seed
+        self.product_count = SCALES[scale]
+        self.sale_count = self.product_count * SALES_PER_PRODUCT
+        self.history_count = self.product_count * HISTORY_PER_PRODUCT
+        # Whole seconds, so every backend stores exactly the same timestamps
+        self.now = (now or datetime.now()).replace(microsecond=0)
+        self.start = self.now - timedelta(days=HISTORY_DAYS)
+
+    def price_cents(self, product_id):
+        # Spread over 1.00 to 500.00 without keeping a price per product in memory
+        return 100 + (product_id * 7919 + self.seed) % 49901
+
+    def product_name(self, product_id):
+        return f'Product {product_id:07d}'
+
+    def products(self):
+        """Yield (product_id, name, description, price_cents, quantity, low_stock_threshold, restock_quantity)."""
+        rng = random.Random(self.seed)
+        for product_id in range(1, self.product_count + 1):
+            if rng.random() < LOW_STOCK_SHARE:
+                quantity = rng.randint(0, LOW_STOCK_THRESHOLD - 1)
+            else:
+                quantity = rng.randint(LOW_STOCK_THRESHOLD, 500)
+            yield (product_id, self.product_name(product_id), f'Synthetic product {product_id}',
+                   self.price_cents(product_id), quantity, LOW_STOCK_THRESHOLD, RESTOCK_QUANTITY)
+
+    def sales(self):
+        """Yield (product_id, product_name, quantity, total_cents, timestamp, status), oldest first."""
+        rng = random.Random(self.seed + 1)
+        seconds = HISTORY_DAYS * 86400
+        step = seconds / self.sale_count
+        for index in range(self.sale_count):
+            product_id = self._popular_product(rng)
+            quantity = rng.randint(1, 5)
+            timestamp = self.start + timedelta(seconds=int(index * step))
+            yield (product_id, self.product_name(product_id), quantity, self.price_cents(product_id) * quantity,
+                   timestamp, SALE_STATUS)
+
+    def inventory_history(self):
+        """Yield (product_id, timestamp, new_quantity), oldest first."""
+        rng = random.Random(self.seed + 2)
+        seconds = HISTORY_DAYS * 86400
+        step = seconds / self.history_count
+        for index in range(self.history_count):
+            timestamp = self.start + timedelta(seconds=int(index * step))
+            yield rng.randint(1, self.product_count), timestamp, rng.randint(0, 500)
+
+    def _popular_product(self, rng):
+        # Roughly 80% of sales go to the first 20% of products
+        if rng.random() < 0.8:
+            return rng.randint(1, max(self.product_count // 5, 1))
+        return rng.randint(1, self.product_count)
@@ -0,0 +1,69 @@
+"""Benchmark the restock forecast over a synthetic catalog.
+
+Generates daily demand for 100k products over a year (each product sells on a
+random share of the days) and times forecast.compute_forecast on it.
+
+Usage: python benchmarks/restock_forecast.py [PRODUCTS] [DAYS]
+"""
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from forecast import compute_forecast  # noqa: E402
+
+PRODUCTS = 100000
+DAYS = 365
+SALE_DAY_SHARE = 0.2
+REPEATS = 5
+
+
+def generate(products, days, seed=0):
+    rng = np.random.default_rng(seed)
+    product_ids = np.arange(1, products + 1, dtype=np.int64)
+    quantities = rng.integers(0, 200, products)
+
+    # One record per product and selling day, like the GROUP BY in forecast_restock: draw
+    # (product, day) cells with replacement and keep the distinct ones; this many draws
+    # leaves SALE_DAY_SHARE of all cells on average
+    draws = int(-np.log1p(-SALE_DAY_SHARE) * products * days)
+    cells = np.unique(rng.integers(0, products * days, draws))
+    sale_product_ids = cells // days + 1
+    sale_days = cells % days
+    sale_quantities = rng.poisson(rng.gamma(1.5, 2.0, products)[sale_product_ids - 1]) + 1
+    return product_ids, quantities, sale_product_ids, sale_days, sale_quantities
+
+
+def main(argv):
+    products = int(argv[1]) if len(argv) > 1 else PRODUCTS
+    days = int(argv[2]) if len(argv) > 2 else DAYS
+
+    started = time.perf_counter()
+    data = generate(products, days)
+    generated = time.perf_counter() - started
+
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        velocity, std, reorder_point, order_up_to, order_quantity = compute_forecast(*data, days)
+        timings.append(time.perf_counter() - started)
+
+    print(json.dumps({
+        'benchmark': 'restock_forecast',
+        'products': products,
+        'days': days,
+        'sale_records': len(data[2]),
+        'generate_seconds': round(generated, 3),
+        'forecast_seconds_best': round(min(timings), 4),
+        'forecast_seconds_median': round(sorted(timings)[len(timings) // 2], 4),
+        'products_to_reorder': int((order_quantity > 0).sum()),
+    }, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,103 @@
+"""Benchmark login screen cold start.
+
+Measures the import cost of main.py with -X importtime and the wall-clock time
+from launching the interpreter until the login window has been shown and the
+event loop has processed it. Qt runs offscreen unless QT_QPA_PLATFORM is set.
+Exits with status 1 when the median time to first window exceeds the target.
+
+Usage: python benchmarks/startup.py [TARGET_SECONDS]
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_TARGET_SECONDS = 1.0
+RUNS = 5
+SLOWEST_IMPORTS = 15
+
+# Heavy modules that must not be loaded before login
+DEFERRED_MODULES = ('matplotlib', 'numpy', 'salesmanagementapp', 'productmanagementapp', 'adminpanel')
+
+FIRST_WINDOW_SCRIPT = """
+import sys, time
+from PyQt5.QtCore import QTimer
+import main
+app, window = main.create_application(sys.argv)
+window.show()
+def shown():
+    print(repr(time.time()))
+    print(','.join(name for name in {deferred!r} if name in sys.modules))
+    app.quit()
+QTimer.singleShot(0, shown)
+app.exec_()
+"""
+
+IMPORT_TIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def environment():
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    return env
+
+
+def import_times():
+    """Return (total_seconds, [(cumulative_seconds, module), ...]) for importing main."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=ROOT, env=environment(),
+                            capture_output=True, text=True, check=True)
+
+    modules = []
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative = int(match.group(2)) / 1e6
+        modules.append((cumulative, match.group(4)))
+        # Top-level imports (one leading space) add up to the total
+        if len(match.group(3)) == 1:
+            total += cumulative
+
+    modules.sort(reverse=True)
+    return total, modules[:SLOWEST_IMPORTS]
+
+
+def time_to_first_window():
+    """Return (seconds, deferred modules that were loaded anyway) for one cold start."""
+    script = FIRST_WINDOW_SCRIPT.format(deferred=DEFERRED_MODULES)
+    started = time.time()
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=environment(),
+                            capture_output=True, text=True, check=True)
+    lines = result.stdout.strip().splitlines()
+    loaded = lines[1].split(',') if len(lines) > 1 and lines[1] else []
+    return float(lines[0]) - started, loaded
+
+
+def main(argv):
+    target = float(argv[1]) if len(argv) > 1 else STARTUP_TARGET_SECONDS
+
+    total_import, slowest = import_times()
+    runs = [time_to_first_window() for _ in range(RUNS)]
+    timings = sorted(seconds for seconds, _ in runs)
+    median = timings[len(timings) // 2]
+    loaded = sorted(set(name for _, names in runs for name in names))
+
+    print(json.dumps({
+        'benchmark': 'startup',
+        'import_main_seconds': round(total_import, 4),
+        'slowest_imports': [{'module': name, 'cumulative_seconds': round(seconds, 4)} for seconds, name in slowest],
+        'first_window_seconds_best': round(timings[0], 4),
+        'first_window_seconds_median': round(median, 4),
+        'target_seconds': target,
+        'deferred_modules_loaded': loaded,
+    }, indent=2))
+    return 0 if median <= target and not loaded else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,368 @@
+"""IMS performance benchmark suite.
+
+Loads synthetic data (see datagen.py) at the chosen scale into a throwaway
+database and times the operations the application depends on: the full product
+load, populating the product table's catalog, single and batched sales, the low
+stock check and restock, sales history paging and every report. Each benchmark
+runs several times and its timings are summarised in a JSON document; with
+--baseline the results are compared against an earlier run of the same backend
+and scale, and the exit status is 1 when any benchmark got slower than the
+tolerance allows.
+
+Backends:
+    sqlite    the embedded SQLite backend (storage.py) on a database file in a
+              temporary directory
+    postgres  a local throwaway PostgreSQL database with the IMS schema applied,
+              given by --dsn; its tables are TRUNCATED before loading, so the
+              application's own database is refused
+
+Usage: python benchmarks/suite.py [--backend sqlite|postgres] [--scale 1k|100k|1m] [--dsn DSN]
+                                  [--repeats N] [--output FILE] [--baseline FILE] [--tolerance 0.2]
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from datagen import SCALES, Dataset  # noqa: E402
+from product import Product  # noqa: E402
+from productcatalog import ProductCatalog  # noqa: E402
+
+REPEATS = 5
+SELL_REPEATS = 200  # Single sales are cheap, so they are timed many more times
+SELL_BATCH_SIZE = 100
+SALES_PAGE_SIZE = 100
+PATCH_SHARE = 0.01  # Share of products changed for the incremental table update
+
+# A benchmark counts as a regression when its median is this much slower than the baseline's
+# and by at least REGRESSION_MIN_SECONDS, so sub-millisecond noise is not reported
+REGRESSION_TOLERANCE = 0.2
+REGRESSION_MIN_SECONDS = 0.001
+
+COPY_CHUNK_ROWS = 100000
+
+
+class Timings:
+    def __init__(self):
+        self.seconds = []
+        self.rows = None
+
+    def summary(self):
+        seconds = sorted(self.seconds)
+        return {
+            'repeats': len(seconds),
+            'min_seconds': round(seconds[0], 6),
+            'median_seconds': round(seconds[len(seconds) // 2], 6),
+            'p95_seconds': round(seconds[min(int(len(seconds) * 0.95), len(seconds) - 1)], 6),
+            'max_seconds': round(seconds[-1], 6),
+            'rows': self.rows,
+        }
+
+
+def row_count(result):
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and hasattr(result[0], '__len__'):
+        # Reports return parallel columns
+        return len(result[0])
+    return None
+
+
+def measure(repeats, fn, *args):
+    """Time fn(*args) after one untimed warm-up call, recording how many rows it returned."""
+    timings = Timings()
+    fn(*args)
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn(*args)
+        timings.seconds.append(time.perf_counter() - started)
+        timings.rows = row_count(result)
+    return timings
+
+
+class SQLiteTarget:
+    name = 'sqlite'
+
+    def __init__(self, args):
+        from database import SQLITE_PRAGMAS, SQLITE_STATEMENT_CACHE_SIZE
+        from sqliteservice import SQLiteInventoryService
+        from storage import SQLiteBackend
+
+        self.directory = tempfile.mkdtemp(prefix='ims-benchmark-')
+        backend = SQLiteBackend(os.path.join(self.directory, 'ims.db'), SQLITE_PRAGMAS, SQLITE_STATEMENT_CACHE_SIZE)
+        self.conn = backend.connect()
+        self.service = SQLiteInventoryService()
+
+    def load(self, dataset):
+        # The triggers keep change sequence values and the daily rollup current while loading
+        self.conn.executemany("INSERT INTO products (product_id, name, description, price, quantity, "
+                              "low_stock_threshold, restock_quantity) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                              ((product_id, name, description, _money(price_cents), quantity, threshold, restock)
+                               for product_id, name, description, price_cents, quantity, threshold, restock
+                               in dataset.products()))
+        self.conn.executemany("INSERT INTO sales_history (product_id, product_name, quantity, total, timestamp, "
+                              "status) VALUES (%s, %s, %s, %s, %s, %s)",
+                              ((product_id, name, quantity, _money(total_cents), timestamp, status)
+                               for product_id, name, quantity, total_cents, timestamp, status in dataset.sales()))
+        self.conn.executemany("INSERT INTO inventory_history (product_id, timestamp, new_quantity) "
+                              "VALUES (%s, %s, %s)", dataset.inventory_history())
+        self.conn.commit()
+        self.conn.execute("ANALYZE")
+
+    def close(self):
+        self.conn.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class PostgresTarget:
+    name = 'postgres'
+
+    RESET = ("TRUNCATE products, product_tombstones, inventory_history, inventory_snapshots, sales_history, "
+             "sales_daily_rollup RESTART IDENTITY CASCADE")
+
+    def __init__(self, args):
+        import psycopg2
+        from psycopg2.extensions import parse_dsn
+
+        from database import DB_CONFIG
+        from inventoryservice import get_inventory_service
+
+        if not args.dsn:
+            raise SystemExit('The postgres backend needs --dsn for a throwaway database')
+        if parse_dsn(args.dsn).get('dbname') == DB_CONFIG['dbname']:
+            raise SystemExit(f'Refusing to truncate the application database {DB_CONFIG["dbname"]!r}')
+
+        self.conn = psycopg2.connect(args.dsn)
+        self.service = get_inventory_service()
+
+    def load(self, dataset):
+        cursor = self.conn.cursor()
+        cursor.execute(self.RESET)
+        # Monthly partitions for the whole generated history, so no row lands in the default partition
+        cursor.execute("SELECT create_inventory_history_partition(month::date) "
+                       "FROM generate_series(date_trunc('month', %s::timestamp), CURRENT_TIMESTAMP, "
+                       "INTERVAL '1 month') AS month", (dataset.start,))
+        cursor.execute("SELECT ensure_inventory_history_partitions()")
+
+        self._copy(cursor, "products (product_id, name, description, price, quantity, low_stock_threshold, "
+                           "restock_quantity)",
+                   ((product_id, name, description, _money(price_cents), quantity, threshold, restock)
+                    for product_id, name, description, price_cents, quantity, threshold, restock
+                    in dataset.products()))
+        cursor.execute("SELECT setval('products_product_id_seq', %s)", (dataset.product_count,))
+        # The rollup trigger folds each COPY batch into sales_daily_rollup
+        self._copy(cursor, "sales_history (product_id, product_name, quantity, total, timestamp, status)",
+                   ((product_id, name, quantity, _money(total_cents), timestamp, status)
+                    for product_id, name, quantity, total_cents, timestamp, status in dataset.sales()))
+        self._copy(cursor, "inventory_history (product_id, timestamp, new_quantity)", dataset.inventory_history())
+        self.conn.commit()
+
+        self.conn.autocommit = True
+        cursor.execute("VACUUM ANALYZE")
+        self.conn.autocommit = False
+
+    @staticmethod
+    def _copy(cursor, table, rows):
+        buffer = io.StringIO()
+        count = 0
+        for row in rows:
+            buffer.write('\t'.join(str(value) for value in row))
+            buffer.write('\n')
+            count += 1
+            if count % COPY_CHUNK_ROWS == 0:
+                buffer.seek(0)
+                cursor.copy_expert(f"COPY {table} FROM STDIN", buffer)
+                buffer = io.StringIO()
+        if buffer.tell():
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {table} FROM STDIN", buffer)
+
+    def close(self):
+        self.conn.close()
+
+
+def _money(cents):
+    return f'{cents // 100}.{cents % 100:02d}'
+
+
+def run_benchmarks(target, dataset, repeats):
+    conn = target.conn
+    service = target.service
+    results = {}
+
+    def committed(fn):
+        def run(*args):
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+        return run
+
+    def rolled_back(fn):
+        # Mutations that would change the data for the next repeat are undone
+        def run(*args):
+            result = fn(conn, *args)
+            conn.rollback()
+            return result
+        return run
+
+    def load_products(conn):
+        return service.product_changes(conn).rows
+
+    results['load_products'] = measure(repeats, rolled_back(load_products))
+
+    rows = load_products(conn)
+    conn.rollback()
+
+    def populate_table():
+        catalog = ProductCatalog()
+        catalog.replace([Product(*row) for row in rows])
+        return catalog.records
+
+    results['populate_table'] = measure(repeats, populate_table)
+
+    step = max(int(1 / PATCH_SHARE), 1)
+    changed_rows = [tuple(row[:4]) + (row[4] + 1,) for row in rows[::step]]
+
+    # Only the patch itself is timed, not building the fresh catalog it is applied to
+    patch = Timings()
+    for _ in range(repeats):
+        catalog = ProductCatalog()
+        catalog.replace([Product(*row) for row in rows])
+        started = time.perf_counter()
+        changed_positions, _ = catalog.patch(changed_rows)
+        patch.seconds.append(time.perf_counter() - started)
+        patch.rows = len(changed_positions)
+    results['update_table_incremental'] = patch
+
+    # Popular products, so sales succeed; each sale is its own transaction like a terminal's
+    popular = max(dataset.product_count // 5, 1)
+    sell = committed(service.sell)
+    product_ids = itertools.cycle(range(1, popular + 1))
+    results['sell_product'] = measure(SELL_REPEATS, lambda: sell(next(product_ids), 1))
+    batch = [(product_id, 1) for product_id in range(1, min(SELL_BATCH_SIZE, popular) + 1)]
+    results['sell_batch'] = measure(repeats, committed(service.sell_many), batch)
+
+    def check_low_stock_levels(conn):
+        service.low_stock(conn)
+        return service.restock_low_stock(conn)
+
+    results['find_low_stock'] = measure(repeats, rolled_back(service.low_stock))
+    results['check_low_stock_levels'] = measure(repeats, rolled_back(check_low_stock_levels))
+
+    middle_order_id = dataset.sale_count // 2
+    results['sales_history_page'] = measure(repeats, rolled_back(service.sales_page), middle_order_id, SALES_PAGE_SIZE)
+    # The history view scrolls newest first; start halfway down, for all sales and for one popular product
+    middle_sale = rolled_back(service.sales_page)(middle_order_id - 1, 1)[0]
+    middle_key = (middle_sale[5], middle_sale[0])
+    results['sales_history_keyset_page'] = measure(repeats, rolled_back(service.sales_history_page), middle_key,
+                                                   SALES_PAGE_SIZE)
+    results['sales_history_product_page'] = measure(
+        repeats, rolled_back(lambda conn: service.sales_history_page(conn, middle_key, SALES_PAGE_SIZE, product_id=1)))
+
+    last_30_days = (date.today() - timedelta(days=30), date.today())
+    reports = {
+        'report_sales': service.sales_report,
+        'report_stock': service.stock_report,
+        'report_profitability': service.profitability_report,
+        'report_daily_sales': service.daily_sales_report,
+        'restock_forecast': service.restock_forecast,
+    }
+    for name, operation in reports.items():
+        results[name] = measure(repeats, rolled_back(operation))
+        if name in ('report_sales', 'report_daily_sales'):
+            results[f'{name}_last_30_days'] = measure(repeats, rolled_back(operation), *last_30_days)
+
+    return {name: timings.summary() for name, timings in results.items()}
+
+
+def compare(results, baseline, tolerance):
+    """Return {benchmark: {...}} for every benchmark in both runs, and the names that regressed."""
+    comparison = {}
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        previous = baseline['benchmarks'].get(name)
+        if not previous:
+            continue
+
+        median, previous_median = result['median_seconds'], previous['median_seconds']
+        ratio = median / previous_median if previous_median else None
+        regressed = (ratio is not None and ratio > 1 + tolerance
+                     and median - previous_median >= REGRESSION_MIN_SECONDS)
+        comparison[name] = {'median_seconds': median, 'baseline_median_seconds': previous_median,
+                            'ratio': round(ratio, 3) if ratio is not None else None, 'regressed': regressed}
+        if regressed:
+            regressions.append(name)
+    return comparison, regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='IMS performance benchmark suite')
+    parser.add_argument('--backend', choices=('sqlite', 'postgres'), default='sqlite')
+    parser.add_argument('--scale', choices=tuple(SCALES), default='1k')
+    parser.add_argument('--dsn', help='Throwaway PostgreSQL database for the postgres backend')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--output', help='Also write the results to this file')
+    parser.add_argument('--baseline', help='Earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    return parser.parse_args(argv[1:])
+
+
+def main(argv):
+    args = parse_args(argv)
+    dataset = Dataset(args.scale, args.seed)
+    target = (PostgresTarget if args.backend == 'postgres' else SQLiteTarget)(args)
+
+    try:
+        started = time.perf_counter()
+        target.load(dataset)
+        load_seconds = time.perf_counter() - started
+
+        results = {
+            'suite': 'ims',
+            'backend': target.name,
+            'scale': args.scale,
+            'seed': args.seed,
+            'products': dataset.product_count,
+            'sales': dataset.sale_count,
+            'inventory_history': dataset.history_count,
+            'load_seconds': round(load_seconds, 3),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'benchmarks': run_benchmarks(target, dataset, args.repeats),
+        }
+    finally:
+        target.close()
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if (baseline.get('backend'), baseline.get('scale')) != (results['backend'], results['scale']):
+            raise SystemExit(f'Baseline is for {baseline.get("backend")}/{baseline.get("scale")}, '
+                             f'not {results["backend"]}/{results["scale"]}')
+        results['comparison'], results['regressions'] = compare(results, baseline, args.tolerance)
+        status = 1 if results['regressions'] else 0
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
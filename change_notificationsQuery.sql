@@ -0,0 +1,25 @@
+-- Push notifications for data changes.
+-- Each statement that modifies one of these tables sends a NOTIFY on the ims_changes
+-- channel with the table name as payload; PostgreSQL folds identical notifications
+-- within a transaction into one, so bulk changes produce a single message per table.
+CREATE OR REPLACE FUNCTION notify_ims_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('ims_changes', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_notify_change
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON products
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_ims_change();
+
+CREATE TRIGGER inventory_history_notify_change
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON inventory_history
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_ims_change();
+
+CREATE TRIGGER sales_history_notify_change
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON sales_history
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_ims_change();
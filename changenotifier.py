@@ -0,0 +1,90 @@
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from database import create_change_listener
+
+
+class ChangeNotifier(QObject):
+    """Turns database change notifications into Qt signals delivered on the GUI thread."""
+
+    table_changed = pyqtSignal(str)
+    products_changed = pyqtSignal()
+    inventory_history_changed = pyqtSignal()
+    sales_history_changed = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.listener = None
+
+    def start(self):
+        if self.listener is None:
+            self.listener = create_change_listener(self.on_notification)
+            self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def on_notification(self, table):
+        # Called on the listener thread; emitting queues the signal to the receivers' thread
+        self.table_changed.emit(table)
+        if table == 'products':
+            self.products_changed.emit()
+        elif table == 'inventory_history':
+            self.inventory_history_changed.emit()
+        elif table == 'sales_history':
+            self.sales_history_changed.emit()
+
+
+_notifier = None
+
+
+def get_change_notifier():
+    """Return the process-wide change notifier, starting its listener on first use."""
+    global _notifier
+
+    if _notifier is None:
+        _notifier = ChangeNotifier()
+        _notifier.start()
+    return _notifier
+
+
+def stop_change_notifier():
+    if _notifier is not None:
+        _notifier.stop()
+
+
+class JournalNotifier(QObject):
+    """Turns journal replay events from the local replica (see localreplica.py) into Qt signals."""
+
+    journal_replayed = pyqtSignal(object)  # [(JournalEntry, result), ...]
+    connectivity_changed = pyqtSignal(bool)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.replayer = None
+
+    def start(self):
+        if self.replayer is None:
+            from localreplica import start_journal_replayer
+            self.replayer = start_journal_replayer(on_replayed=self.journal_replayed.emit,
+                                                   on_connectivity=self.connectivity_changed.emit)
+
+    def wake(self):
+        if self.replayer is not None:
+            self.replayer.wake()
+
+
+_journal_notifier = None
+
+
+def get_journal_notifier():
+    """Return the process-wide journal notifier, starting the journal replayer on first use."""
+    global _journal_notifier
+
+    if _journal_notifier is None:
+        _journal_notifier = JournalNotifier()
+        _journal_notifier.start()
+    return _journal_notifier
@@ -0,0 +1,148 @@
+"""Embedded report charts that reuse one figure and redraw only what changed.
+
+Time series are downsampled to at most CHART_MAX_POINTS points before plotting
+and bar charts show the largest CHART_MAX_BARS values with the rest summed into
+an 'Other' bar, so chart cost stays flat however much data a report returns.
+"""
+import matplotlib.dates as mdates
+import numpy as np
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.figure import Figure
+
+import analytics
+
+CHART_MAX_POINTS = 2000
+CHART_MAX_BARS = 30
+OTHER_LABEL = 'Other'
+
+
+def lttb(x, y, threshold):
+    """Downsample a series with Largest-Triangle-Three-Buckets, keeping its visual shape."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if threshold >= len(x) or threshold < 3:
+        return x, y
+
+    # The first and last points are kept; the rest is split into threshold - 2 buckets
+    edges = np.linspace(1, len(x) - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = len(x) - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = end, edges[bucket + 2]
+        else:
+            next_start, next_end = len(x) - 1, len(x)
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        # Pick the point forming the largest triangle with the previous pick and the next bucket's mean
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+
+    return x[selected], y[selected]
+
+
+def min_max_downsample(x, y, threshold):
+    """Keep the minimum and maximum of each bucket, so no spike or dip disappears."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    buckets = threshold // 2
+    if threshold >= len(x) or buckets < 1:
+        return x, y
+
+    bucket_size = len(x) // buckets
+    usable = buckets * bucket_size
+    windows = y[:usable].reshape(buckets, bucket_size)
+    offsets = np.arange(buckets) * bucket_size
+    indices = np.concatenate([offsets + windows.argmin(axis=1), offsets + windows.argmax(axis=1),
+                              np.arange(usable, len(x))])
+    indices = np.unique(indices)
+    return x[indices], y[indices]
+
+
+def top_n_with_other(labels, values, n=CHART_MAX_BARS):
+    """Return the n largest (labels, values) with everything else summed into an 'Other' entry."""
+    values = np.asarray(values)
+    if len(values) <= n:
+        return np.asarray(labels), values
+
+    top_labels, top_values = analytics.top_n(np.asarray(labels), values, n)
+    other = values.sum() - top_values.sum()
+    return np.append(top_labels, OTHER_LABEL), np.append(top_values, other)
+
+
+class ChartView:
+    """A persistent embedded figure; repeated charts of the same kind update their artists in place."""
+
+    def __init__(self, parent=None):
+        self.figure = Figure()
+        self.canvas = FigureCanvas(self.figure)
+        self.canvas.setParent(parent)
+        self.ax = self.figure.add_subplot()
+
+        self._kind = None
+        self._bars = None
+        self._points = None
+        self._line = None
+
+    def show_bars(self, labels, values, title, xlabel, ylabel, color):
+        labels, values = top_n_with_other(labels, values)
+        positions = np.arange(len(values))
+        self._use('bars')
+
+        if self._bars is not None and len(self._bars.patches) == len(values):
+            for bar, value in zip(self._bars.patches, values):
+                bar.set_height(value)
+                bar.set_color(color)
+        else:
+            if self._bars is not None:
+                self._bars.remove()
+            self._bars = self.ax.bar(positions, values, color=color)
+
+        self.ax.set_xticks(positions)
+        self.ax.set_xticklabels([str(label) for label in labels], rotation=45, ha='right')
+        self._finish(title, xlabel, ylabel)
+
+    def show_series(self, dates, values, trend, title, xlabel, ylabel, label, trend_label):
+        """Plot values as points and trend as a line over the same dates."""
+        x = mdates.date2num(np.asarray(dates))
+        points_x, points_y = min_max_downsample(x, values, CHART_MAX_POINTS)
+        line_x, line_y = lttb(x, trend, CHART_MAX_POINTS)
+        self._use('series')
+
+        if self._points is None:
+            self._points = self.ax.scatter(points_x, points_y, color='red', s=8, label=label)
+            (self._line,) = self.ax.plot(line_x, line_y, color='black', label=trend_label)
+            self.ax.xaxis_date()
+            self.ax.legend()
+        else:
+            self._points.set_offsets(np.column_stack([points_x, points_y]))
+            self._line.set_data(line_x, line_y)
+
+        self._finish(title, xlabel, ylabel, points=self._points.get_offsets())
+
+    def _use(self, kind):
+        # Axes set up for one kind of chart (tick labels, date axis) are reset when switching
+        if kind != self._kind:
+            self.ax.clear()
+            self._kind = kind
+            self._bars = self._points = self._line = None
+
+    def _finish(self, title, xlabel, ylabel, points=None):
+        self.ax.set_title(title)
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel(ylabel)
+
+        # relim() only covers lines and patches, so scatter points are added explicitly
+        self.ax.relim()
+        if points is not None and len(points):
+            self.ax.update_datalim(points)
+        self.ax.autoscale_view()
+        self.figure.tight_layout()
+        self.canvas.draw_idle()
@@ -1,27 +1,599 @@
-import psycopg2
+import logging
+import os
+import re
+import select
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from querystats import get_query_stats, normalize_sql
+from storage import PostgresBackend, SQLiteBackend
+
+# Storage backend: 'postgres' for the central server, or 'sqlite' for an embedded
+# database file, e.g. for a small shop or a branch office without a server
+DB_BACKEND = os.environ.get('IMS_DB_BACKEND', 'postgres')
+
+# Replace these with your PostgreSQL database information
+DB_CONFIG = {
+    'dbname': 'Ims',
+    'user': 'postgres',
+    'password': '8516',
+    'host': 'localhost',
+    'port': '5432',
+}
+
+SQLITE_PATH = os.environ.get('IMS_SQLITE_PATH', 'ims.db')
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # Readers and the writer do not block each other
+    'synchronous': 'NORMAL',  # Durable across application crashes; fsync only at WAL checkpoints
+    'busy_timeout': 5000,  # Milliseconds to wait for another connection's write to finish
+    'foreign_keys': 'ON',
+    'cache_size': -64000,  # 64 MB page cache per connection
+    'temp_store': 'MEMORY',
+    'mmap_size': 256 * 1024 * 1024,
+}
+SQLITE_STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection
+
+# Connection pool settings
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+POOL_IDLE_TIMEOUT = 300  # Seconds an idle connection above min size is kept open
+POOL_HEALTH_CHECK_INTERVAL = 30  # Seconds idle before a connection is pinged on checkout
+POOL_CHECKOUT_TIMEOUT = 10  # Seconds to wait for a free connection when the pool is full
+
+# Change notification settings, see change_notificationsQuery.sql
+CHANGE_CHANNEL = 'ims_changes'
+WATCHED_TABLES = ('products', 'inventory_history', 'sales_history')
+LISTENER_RECONNECT_DELAY = 5  # Seconds between attempts to re-open the listening connection
+SQLITE_CHANGE_POLL_INTERVAL = 1  # Seconds between checks for commits to the SQLite database
+
+# Query instrumentation, see querystats.py
+QUERY_STATS_ENABLED = os.environ.get('IMS_QUERY_STATS', '1') != '0'
+SLOW_QUERY_THRESHOLD = float(os.environ.get('IMS_SLOW_QUERY_MS', '500')) / 1000  # Seconds
+SLOW_QUERY_EXPLAIN = True  # Capture the plan of slow statements
+SLOW_QUERY_EXPLAIN_INTERVAL = 600  # Seconds before the same statement's plan is captured again
+EXPLAINABLE_STATEMENTS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+# On PostgreSQL, reads are run again under EXPLAIN ANALYZE for their actual row counts and
+# timings; anything that writes, locks rows or calls a function that writes (see the *Query.sql
+# functions) is only planned with EXPLAIN, so capturing a plan never repeats its side effects
+ANALYZABLE_STATEMENTS = ('SELECT', 'WITH')
+WRITING_SQL = re.compile(
+    r"\b(?:INSERT|UPDATE|DELETE|MERGE|TRUNCATE|nextval|setval|pg_notify|sell_product|rebuild_sales_rollup"
+    r"|take_inventory_snapshot|compact_inventory_history|create_inventory_history_partition"
+    r"|ensure_inventory_history_partitions)\b|\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY\s+SHARE)\b",
+    re.IGNORECASE)
 
-def create_connection():
-    # Replace these with your PostgreSQL database information
-    db_name = 'Ims'
-    db_user = 'postgres'
-    db_password = '8516'
-    db_host = 'localhost'
-    db_port = '5432'
 
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the configured storage backend."""
+    global _backend
+
+    with _backend_lock:
+        if _backend is None:
+            if DB_BACKEND == 'sqlite':
+                _backend = SQLiteBackend(SQLITE_PATH, SQLITE_PRAGMAS, SQLITE_STATEMENT_CACHE_SIZE)
+            elif DB_BACKEND == 'postgres':
+                _backend = PostgresBackend(DB_CONFIG)
+            else:
+                raise ValueError(f'Unknown database backend {DB_BACKEND!r}')
+        return _backend
+
+
+def create_connection():
+    backend = get_backend()
     try:
-        conn = psycopg2.connect(
-            dbname=db_name,
-            user=db_user,
-            password=db_password,
-            host=db_host,
-            port=db_port
-        )
-        return conn
+        conn = backend.connect()
+        return InstrumentedConnection(conn, backend) if QUERY_STATS_ENABLED else conn
 
-    except (Exception, psycopg2.Error) as error:
-        print(f"Error connecting to PostgreSQL: {error}")
+    except Exception as error:
+        logging.error(f"Error connecting to the {backend.name} database: {error}")
         return None
 
+
 def close_connection(conn):
     if conn:
         conn.close()
+
+
+_explained_at = {}  # Normalized statement -> time its plan was last captured
+_explained_lock = threading.Lock()
+
+
+class InstrumentedCursor:
+    """Cursor wrapper that reports every statement's latency, rows and errors to querystats.
+
+    Everything else, including attribute assignments such as itersize, goes to the
+    wrapped cursor. Rows of a result set are counted as they are fetched.
+    """
+
+    def __init__(self, cursor, connection):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_connection', connection)
+        object.__setattr__(self, '_statement', None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        rows = 0
+        try:
+            for row in self._cursor:
+                rows += 1
+                yield row
+        finally:
+            self._add_rows(rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cursor.close()
+
+    def execute(self, query, *args):
+        self._timed(query, args, self._cursor.execute, explain=True)
+        return self
+
+    def executemany(self, query, *args):
+        self._timed(query, args, self._cursor.executemany)
+        return self
+
+    def copy_expert(self, query, *args):
+        self._timed(query, args, self._cursor.copy_expert)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._add_rows(1)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._add_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._add_rows(len(rows))
+        return rows
+
+    def _timed(self, query, args, method, explain=False):
+        statement = normalize_sql(query)
+        object.__setattr__(self, '_statement', statement)
+        on_gui_thread = threading.current_thread() is threading.main_thread()
+        started = time.perf_counter()
+        try:
+            method(query, *args)
+        except Exception:
+            get_query_stats().record_statement(statement, time.perf_counter() - started, failed=True,
+                                               on_gui_thread=on_gui_thread)
+            raise
+
+        elapsed = time.perf_counter() - started
+        # Statements without a result set report the rows they affected; result sets are counted as fetched
+        rows = max(self._cursor.rowcount, 0) if self._cursor.description is None else 0
+        get_query_stats().record_statement(statement, elapsed, rows, on_gui_thread=on_gui_thread)
+        if elapsed >= SLOW_QUERY_THRESHOLD:
+            self._connection.record_slow_query(statement, query, args if explain else None, elapsed)
+
+    def _add_rows(self, rows):
+        if rows and self._statement is not None:
+            get_query_stats().add_rows(self._statement, rows)
+
+
+class InstrumentedConnection:
+    """Connection wrapper whose cursors are InstrumentedCursors; see create_connection()."""
+
+    def __init__(self, conn, backend):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_backend', backend)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs), self)
+
+    def execute(self, query, *args):
+        # Shortcut offered by SQLite connections
+        return self.cursor().execute(query, *args)
+
+    def executemany(self, query, *args):
+        return self.cursor().executemany(query, *args)
+
+    def record_slow_query(self, statement, query, args, elapsed):
+        """Log a slow statement, with its plan if none was captured for it recently.
+
+        args is None for statements that cannot be explained (batches and COPY).
+        """
+        plan = None
+        if SLOW_QUERY_EXPLAIN and args is not None:
+            now = time.monotonic()
+            with _explained_lock:
+                due = now - _explained_at.get(statement, -SLOW_QUERY_EXPLAIN_INTERVAL) >= SLOW_QUERY_EXPLAIN_INTERVAL
+                if due:
+                    _explained_at[statement] = now
+            if due:
+                plan = self._explain(query, args)
+
+        get_query_stats().record_slow_query(statement, _to_text(query), elapsed, plan)
+        if plan is not None:
+            logging.warning(f'Slow query took {elapsed * 1000:.0f} ms: {statement}',
+                            extra={'statement': statement, 'duration_ms': round(elapsed * 1000, 1), 'plan': plan})
+
+    def _explain(self, query, args):
+        text = _to_text(query)
+        if self._backend.name == 'sqlite':
+            # Only plans the statement, so it is safe for writes too
+            try:
+                rows = self._conn.cursor().execute('EXPLAIN QUERY PLAN ' + text, *args).fetchall()
+                return '\n'.join(row[-1] for row in rows)
+            except self._backend.Error as error:
+                logging.warning(f'Could not explain slow query: {error}')
+                return None
+
+        first_word = text.split(None, 1)[0].upper() if text.strip() else ''
+        if first_word not in EXPLAINABLE_STATEMENTS:
+            return None
+        analyze = first_word in ANALYZABLE_STATEMENTS and not WRITING_SQL.search(text)
+        explain = ('EXPLAIN ANALYZE ' if analyze else 'EXPLAIN ') + text
+        cursor = self._conn.cursor()
+        try:
+            if self._conn.autocommit:
+                cursor.execute(explain, *args)
+                return '\n'.join(row[0] for row in cursor.fetchall())
+            # In a savepoint that is rolled back, so neither an error nor a repeated read affects the transaction
+            cursor.execute('SAVEPOINT ims_explain')
+            try:
+                cursor.execute(explain, *args)
+                return '\n'.join(row[0] for row in cursor.fetchall())
+            finally:
+                cursor.execute('ROLLBACK TO SAVEPOINT ims_explain')
+                cursor.execute('RELEASE SAVEPOINT ims_explain')
+        except self._backend.Error as error:
+            logging.warning(f'Could not explain slow query: {error}')
+            return None
+        finally:
+            cursor.close()
+
+
+def _to_text(query):
+    return query.decode('utf-8', 'replace') if isinstance(query, bytes) else query
+
+
+class PoolError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Thread-safe pool of reusable database connections."""
+
+    def __init__(self, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 health_check_interval=POOL_HEALTH_CHECK_INTERVAL, checkout_timeout=POOL_CHECKOUT_TIMEOUT):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f'Invalid pool size: min={min_size}, max={max_size}')
+
+        self.backend = get_backend()
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+
+        self._idle = deque()  # (conn, last_used) pairs, most recently used on the right
+        self._in_use = set()
+        self._closed = False
+        self._lock = threading.Condition()
+
+        for _ in range(min_size):
+            conn = create_connection()
+            if conn:
+                self._idle.append((conn, time.monotonic()))
+
+    @property
+    def size(self):
+        """Total number of open connections owned by the pool."""
+        with self._lock:
+            return len(self._idle) + len(self._in_use)
+
+    def getconn(self):
+        """Check out a healthy connection, opening a new one if the pool is not full."""
+        started = time.perf_counter()
+        try:
+            conn = self._checkout()
+        except PoolError:
+            get_query_stats().record_acquire(time.perf_counter() - started, failed=True)
+            raise
+        get_query_stats().record_acquire(time.perf_counter() - started)
+        return conn
+
+    def _checkout(self):
+        deadline = time.monotonic() + self.checkout_timeout
+
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise PoolError('Connection pool is closed')
+
+                self._evict_idle_locked()
+
+                while self._idle:
+                    conn, last_used = self._idle.pop()
+                    if self._is_healthy(conn, last_used):
+                        self._in_use.add(conn)
+                        return conn
+                    close_connection(conn)
+
+                if len(self._in_use) < self.max_size:
+                    # Reserve the slot while connecting outside the lock
+                    placeholder = object()
+                    self._in_use.add(placeholder)
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolError(f'No free connection after {self.checkout_timeout} seconds')
+                self._lock.wait(remaining)
+
+        conn = create_connection()
+
+        with self._lock:
+            self._in_use.discard(placeholder)
+            if conn:
+                self._in_use.add(conn)
+            self._lock.notify()
+
+        if not conn:
+            raise PoolError('Could not open a new database connection')
+        return conn
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, closing it if it is broken or the pool is closed."""
+        if not discard and not self.backend.is_closed(conn):
+            try:
+                # Never hand out a connection with an open or failed transaction
+                self.backend.reset(conn)
+            except self.backend.Error:
+                discard = True
+
+        with self._lock:
+            self._in_use.discard(conn)
+            if discard or self.backend.is_closed(conn) or self._closed:
+                close_connection(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    def evict_idle(self):
+        """Close connections that have been idle longer than the idle timeout."""
+        with self._lock:
+            self._evict_idle_locked()
+
+    def closeall(self):
+        """Close every idle connection; checked-out ones are closed when returned."""
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                close_connection(conn)
+            self._lock.notify_all()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a with-block."""
+        conn = self.getconn()
+        try:
+            yield conn
+        except Exception:
+            if not self.backend.is_closed(conn):
+                conn.rollback()
+            raise
+        finally:
+            self.putconn(conn)
+
+    def _evict_idle_locked(self):
+        now = time.monotonic()
+        # Oldest connections sit on the left of the deque
+        while self._idle and len(self._idle) + len(self._in_use) > self.min_size:
+            conn, last_used = self._idle[0]
+            if now - last_used < self.idle_timeout:
+                break
+            self._idle.popleft()
+            close_connection(conn)
+
+    def _is_healthy(self, conn, last_used):
+        if self.backend.is_closed(conn):
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+
+        try:
+            self.backend.ping(conn)
+            return True
+        except self.backend.Error as error:
+            logging.warning(f'Discarding unhealthy pooled connection: {error}')
+            return False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use."""
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+
+def close_pool():
+    """Close the process-wide connection pool."""
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+@contextmanager
+def pooled_connection():
+    """Check out a pooled connection, yielding None if the database is unreachable."""
+    pool = get_pool()
+    try:
+        conn = pool.getconn()
+    except PoolError as error:
+        logging.error(f'Error getting a pooled connection: {error}')
+        conn = None
+
+    if conn is None:
+        yield None
+        return
+
+    try:
+        yield conn
+    except Exception:
+        if not pool.backend.is_closed(conn):
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+class ChangeListener(threading.Thread):
+    """Background thread that LISTENs for table change notifications.
+
+    callback(table_name) is called on the listener thread once per table for each
+    batch of notifications. After reconnecting it is called for every watched table,
+    since notifications sent while disconnected are lost.
+    """
+
+    def __init__(self, callback, channel=CHANGE_CHANNEL, reconnect_delay=LISTENER_RECONNECT_DELAY):
+        super().__init__(name='ChangeListener', daemon=True)
+
+        self.callback = callback
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        connected_before = False
+
+        while not self._stop_event.is_set():
+            # A dedicated connection: LISTEN needs autocommit and must not go back to the pool
+            conn = create_connection()
+            if not conn:
+                self._stop_event.wait(self.reconnect_delay)
+                continue
+
+            try:
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f'LISTEN {self.channel}')
+                logging.info(f'Listening for changes on channel {self.channel}', extra={'rate_limit': True})
+
+                if connected_before:
+                    self._dispatch(WATCHED_TABLES)
+                connected_before = True
+
+                self._listen(conn)
+
+            except (get_backend().Error, OSError) as error:
+                logging.error(f'Change listener lost its connection: {error}')
+                self._stop_event.wait(self.reconnect_delay)
+
+            finally:
+                close_connection(conn)
+
+    def _listen(self, conn):
+        while not self._stop_event.is_set():
+            # Wake up at least once a second to notice stop requests
+            if select.select([conn], [], [], 1.0) == ([], [], []):
+                continue
+
+            conn.poll()
+            tables = []
+            while conn.notifies:
+                table = conn.notifies.pop(0).payload
+                if table not in tables:
+                    tables.append(table)
+            self._dispatch(tables)
+
+    def _dispatch(self, tables):
+        for table in tables:
+            try:
+                self.callback(table)
+            except Exception as e:
+                logging.error(f'Error handling change notification for {table}: {e}')
+
+
+class SQLiteChangeListener(threading.Thread):
+    """Background thread that notices commits to the embedded SQLite database.
+
+    SQLite has no notifications, but PRAGMA data_version changes whenever another
+    connection commits and is cheap to poll. It does not tell which table changed,
+    so callback(table_name) is called for every watched table.
+    """
+
+    def __init__(self, callback, poll_interval=SQLITE_CHANGE_POLL_INTERVAL):
+        super().__init__(name='SQLiteChangeListener', daemon=True)
+
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        conn = None
+        version = None
+
+        while not self._stop_event.is_set():
+            try:
+                if conn is None:
+                    conn = create_connection()
+                if conn:
+                    current = conn.execute('PRAGMA data_version').fetchone()[0]
+                    if version is not None and current != version:
+                        self._dispatch(WATCHED_TABLES)
+                    version = current
+
+            except get_backend().Error as error:
+                logging.error(f'Change listener lost its connection: {error}')
+                close_connection(conn)
+                conn = None
+
+            self._stop_event.wait(self.poll_interval)
+
+        close_connection(conn)
+
+    def _dispatch(self, tables):
+        for table in tables:
+            try:
+                self.callback(table)
+            except Exception as e:
+                logging.error(f'Error handling change notification for {table}: {e}')
+
+
+def create_change_listener(callback):
+    """Return an unstarted listener thread that calls callback(table_name) when a watched table changes."""
+    if get_backend().supports_notifications:
+        return ChangeListener(callback)
+    return SQLiteChangeListener(callback)
@@ -0,0 +1,120 @@
+"""Demand-based restock forecasting for the whole catalog in one pass.
+
+Daily demand per product is summed from sales_history by the database and
+streamed into arrays; velocity (mean daily demand) and its standard deviation
+are then computed for every product at once with bincount. Reorder points and
+order quantities follow the usual safety stock model:
+
+    reorder point = velocity * lead time + z * std * sqrt(lead time)
+    order up to   = velocity * (lead time + review period) + z * std * sqrt(lead time + review period)
+"""
+from datetime import date, timedelta
+
+import numpy as np
+
+import analytics
+from inventoryservice import get_inventory_service
+
+LOOKBACK_DAYS = 90
+LEAD_TIME_DAYS = 7
+REVIEW_PERIOD_DAYS = 14
+SERVICE_LEVEL_Z = 1.65  # About 95% of lead times without a stockout
+
+
+class RestockForecast:
+    """Per-product forecast as parallel arrays, ordered by product_id."""
+
+    __slots__ = ('product_id', 'labels', 'quantity', 'velocity', 'std', 'reorder_point', 'order_up_to',
+                 'order_quantity')
+
+    def __init__(self, product_id, labels, quantity, velocity, std, reorder_point, order_up_to, order_quantity):
+        self.product_id = product_id
+        self.labels = labels
+        self.quantity = quantity
+        self.velocity = velocity
+        self.std = std
+        self.reorder_point = reorder_point
+        self.order_up_to = order_up_to
+        self.order_quantity = order_quantity
+
+    def __len__(self):
+        return len(self.product_id)
+
+    def suggestions(self, limit=None):
+        """Return (name, quantity, velocity, order_quantity) for products to reorder, fastest sellers first."""
+        indices = np.flatnonzero(self.order_quantity > 0)
+        indices = indices[np.argsort(-self.velocity[indices], kind='stable')][:limit]
+        return [(self.labels[i], int(self.quantity[i]), float(self.velocity[i]), int(self.order_quantity[i]))
+                for i in indices]
+
+
+def compute_forecast(product_ids, quantities, sale_product_ids, sale_days, sale_quantities, days,
+                     lead_time=LEAD_TIME_DAYS, review_period=REVIEW_PERIOD_DAYS, z=SERVICE_LEVEL_Z):
+    """Forecast every product from daily demand records.
+
+    product_ids must be sorted. Each sale record is one product's total demand on one
+    day (0 <= day < days); days without a record count as zero demand. Returns
+    (velocity, std, reorder_point, order_up_to, order_quantity) arrays aligned with product_ids.
+    """
+    size = len(product_ids)
+    if not size:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty.astype(np.float64), empty.astype(np.float64), empty, empty, empty
+
+    # Sales of products that no longer exist are ignored
+    index = np.minimum(np.searchsorted(product_ids, sale_product_ids), size - 1)
+    known = (product_ids[index] == sale_product_ids) & (sale_days >= 0) & (sale_days < days)
+    index = index[known]
+    demand = sale_quantities[known].astype(np.float64)
+
+    # Mean and sample variance over all days, counting days without sales as zero
+    totals = np.bincount(index, weights=demand, minlength=size)
+    squares = np.bincount(index, weights=demand * demand, minlength=size)
+    velocity = totals / days
+    variance = (squares - days * velocity * velocity) / max(days - 1, 1)
+    std = np.sqrt(np.maximum(variance, 0))
+
+    reorder_point = np.ceil(velocity * lead_time + z * std * np.sqrt(lead_time)).astype(np.int64)
+    cover = lead_time + review_period
+    order_up_to = np.ceil(velocity * cover + z * std * np.sqrt(cover)).astype(np.int64)
+
+    quantities = np.asarray(quantities, dtype=np.int64)
+    order_quantity = np.where((quantities <= reorder_point) & (velocity > 0),
+                              np.maximum(order_up_to - quantities, 0), 0)
+    return velocity, std, reorder_point, order_up_to, order_quantity
+
+
+def forecast_restock(conn, lookback_days=LOOKBACK_DAYS, lead_time=LEAD_TIME_DAYS,
+                     review_period=REVIEW_PERIOD_DAYS, z=SERVICE_LEVEL_Z, today=None):
+    """Forecast the whole catalog from the last lookback_days full days of sales."""
+    today = today or date.today()
+    first_day = today - timedelta(days=lookback_days)
+
+    product_ids, quantities = analytics.fetch_columns(
+        conn, "SELECT product_id, quantity FROM products ORDER BY product_id", count=2)
+    labels = analytics.fetch_product_names(conn, product_ids)
+    sale_product_ids, sale_days, sale_quantities = analytics.fetch_columns(
+        conn,
+        "SELECT product_id, timestamp::date - %s, SUM(quantity)::bigint FROM sales_history "
+        "WHERE product_id IS NOT NULL AND timestamp >= %s AND timestamp < %s GROUP BY 1, 2",
+        (first_day, first_day, today), count=3)
+
+    velocity, std, reorder_point, order_up_to, order_quantity = compute_forecast(
+        product_ids, quantities, sale_product_ids, sale_days, sale_quantities, lookback_days,
+        lead_time, review_period, z)
+    return RestockForecast(product_ids, labels, quantities, velocity, std, reorder_point, order_up_to,
+                           order_quantity)
+
+
+def apply_forecast(conn, forecast):
+    """Store the forecast reorder points and order quantities as the products' low stock settings.
+
+    Products without demand keep their current settings. The forecast reorders at or below the
+    reorder point but stock is low strictly below the threshold, so the threshold is one above it.
+    """
+    selling = np.flatnonzero(forecast.velocity > 0)
+    restock = np.maximum(forecast.order_up_to[selling] - forecast.reorder_point[selling], 1)
+    get_inventory_service().set_low_stock_thresholds(conn, zip(forecast.product_id[selling].tolist(),
+                                                               (forecast.reorder_point[selling] + 1).tolist(),
+                                                               restock.tolist()))
+    return len(selling)
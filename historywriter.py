@@ -0,0 +1,212 @@
+import atexit
+import csv
+import io
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from database import get_backend, pooled_connection
+
+# Flush when this many events are queued or the oldest has waited this long
+FLUSH_BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0  # Seconds
+
+# Batches at least this large are written with COPY instead of a multi-row INSERT
+# on PostgreSQL; the embedded SQLite backend always uses one prepared INSERT
+COPY_THRESHOLD = 5000
+
+# Events already queued when a flush starts go with it, up to this many, so a bulk
+# stock edit or import is written in COPY-sized batches
+MAX_FLUSH_EVENTS = 20000
+
+MAX_QUEUED_EVENTS = 50000
+BACKPRESSURE_RATIO = 0.8  # Report backpressure once the queue is this full
+ENQUEUE_TIMEOUT = 2.0  # Seconds a caller waits for room before the event is dropped
+RETRY_DELAY = 2.0  # Seconds before retrying a batch that failed to write
+
+INVENTORY_HISTORY = ('inventory_history', ('product_id', 'timestamp', 'new_quantity'))
+SALES_HISTORY = ('sales_history', ('product_id', 'product_name', 'quantity', 'total', 'timestamp', 'status'))
+
+
+class HistoryWriter(threading.Thread):
+    """Background writer that appends inventory and sales history rows in batches.
+
+    Events are queued by the caller without touching the database and written by
+    this thread with one INSERT (or COPY, for large batches) per table per flush.
+    on_backpressure(is_backpressured) is called whenever the queue crosses the
+    backpressure threshold in either direction.
+    """
+
+    def __init__(self, batch_size=FLUSH_BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 max_queued=MAX_QUEUED_EVENTS, on_backpressure=None):
+        super().__init__(name='HistoryWriter', daemon=True)
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_backpressure = on_backpressure
+
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._backpressure_level = int(max_queued * BACKPRESSURE_RATIO)
+        self._backpressured = False
+        self._closing = threading.Event()
+        self.dropped_events = 0
+
+    @property
+    def pending(self):
+        """Approximate number of events waiting to be written."""
+        return self._queue.qsize()
+
+    def log_inventory_change(self, product_id, new_quantity, timestamp=None):
+        return self._enqueue(INVENTORY_HISTORY, (product_id, timestamp or datetime.now(), new_quantity))
+
+    def log_inventory_changes(self, changes):
+        """Queue (product_id, new_quantity) pairs, e.g. from a bulk stock edit."""
+        timestamp = datetime.now()
+        return all([self.log_inventory_change(product_id, new_quantity, timestamp)
+                    for product_id, new_quantity in changes])
+
+    def log_sales_order(self, product_id, product_name, quantity, total, status, timestamp=None):
+        return self._enqueue(SALES_HISTORY,
+                             (product_id, product_name, quantity, total, timestamp or datetime.now(), status))
+
+    def close(self, timeout=10):
+        """Flush every queued event and stop the writer thread."""
+        self._closing.set()
+        if self.is_alive():
+            self.join(timeout)
+        if self.pending:
+            logging.error(f'History writer stopped with {self.pending} events not written')
+
+    def run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write_with_retry(batch)
+            elif self._closing.is_set():
+                return
+
+    def _enqueue(self, table, row):
+        if self._closing.is_set():
+            logging.error(f'History writer is closed, dropping {table[0]} event {row}')
+            return False
+
+        try:
+            self._queue.put((table, row), timeout=ENQUEUE_TIMEOUT)
+        except queue.Full:
+            self.dropped_events += 1
+            logging.error(f'History queue full, dropping {table[0]} event {row}')
+            return False
+
+        self._update_backpressure()
+        return True
+
+    def _next_batch(self):
+        """Wait for the first event, then collect more until the batch is full or the interval passes."""
+        try:
+            batch = [self._queue.get(timeout=0.2)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + (0 if self._closing.is_set() else self.flush_interval)
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        while len(batch) < MAX_FLUSH_EVENTS:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        self._update_backpressure()
+        return batch
+
+    def _write_with_retry(self, batch):
+        while True:
+            try:
+                self._write(batch)
+                return
+            except Exception as e:
+                if self._closing.is_set():
+                    logging.error(f'Error writing {len(batch)} history events during shutdown, dropping them: {e}')
+                    return
+                logging.error(f'Error writing {len(batch)} history events, retrying: {e}')
+                time.sleep(RETRY_DELAY)
+
+    def _write(self, batch):
+        rows_by_table = {}
+        for table, row in batch:
+            rows_by_table.setdefault(table, []).append(row)
+
+        with pooled_connection() as conn:
+            if not conn:
+                raise ConnectionError('Error connecting to the database')
+
+            cursor = conn.cursor()
+            for (table_name, columns), rows in rows_by_table.items():
+                if not get_backend().supports_copy:
+                    cursor.executemany(f"INSERT INTO {table_name} ({', '.join(columns)}) "
+                                       f"VALUES ({', '.join(['%s'] * len(columns))})", rows)
+                elif len(rows) >= COPY_THRESHOLD:
+                    self._copy_rows(cursor, table_name, columns, rows)
+                else:
+                    from psycopg2.extras import execute_values
+                    execute_values(cursor, f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES %s", rows,
+                                   page_size=len(rows))
+            conn.commit()
+
+    @staticmethod
+    def _copy_rows(cursor, table_name, columns, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(['' if value is None else value for value in row])
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    def _update_backpressure(self):
+        backpressured = self._queue.qsize() >= self._backpressure_level
+        if backpressured == self._backpressured:
+            return
+
+        self._backpressured = backpressured
+        if backpressured:
+            logging.warning(f'History writer is falling behind: {self._queue.qsize()} events queued')
+        else:
+            logging.info('History writer caught up')
+        if self.on_backpressure:
+            self.on_backpressure(backpressured)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_history_writer():
+    """Return the process-wide history writer, starting it on first use.
+
+    The writer is flushed and stopped by close_history_writer() or at exit.
+    """
+    global _writer
+
+    with _writer_lock:
+        if _writer is None:
+            _writer = HistoryWriter()
+            _writer.start()
+            atexit.register(close_history_writer)
+        return _writer
+
+
+def close_history_writer():
+    """Flush and stop the process-wide history writer."""
+    global _writer
+
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
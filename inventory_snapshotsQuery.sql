@@ -0,0 +1,163 @@
+-- Point-in-time stock queries over inventory_history.
+-- inventory_history is partitioned by month and indexed on (product_id, timestamp), so
+-- the stock of one product at a given time is a single index lookup. Periodic snapshots
+-- of every product's stock bound how much history a whole-catalog query has to read,
+-- and let months older than the retention period be dropped without losing the
+-- ability to answer as-of queries for them (at snapshot granularity).
+
+-- Monthly partitions, created ahead of time; rows outside every partition land in the
+-- default partition and are moved out when their month's partition is created
+CREATE OR REPLACE FUNCTION create_inventory_history_partition(p_month DATE) RETURNS void AS $$
+DECLARE
+    v_start TIMESTAMP := date_trunc('month', p_month);
+    v_end TIMESTAMP := date_trunc('month', p_month) + INTERVAL '1 month';
+    v_name TEXT := format('inventory_history_y%sm%s', to_char(v_start, 'YYYY'), to_char(v_start, 'MM'));
+BEGIN
+    IF to_regclass(v_name) IS NOT NULL THEN
+        RETURN;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE inventory_history INCLUDING DEFAULTS)', v_name);
+    EXECUTE format('WITH moved AS (DELETE FROM inventory_history_default WHERE timestamp >= %L AND timestamp < %L '
+                   'RETURNING *) INSERT INTO %I SELECT * FROM moved', v_start, v_end, v_name);
+    EXECUTE format('ALTER TABLE inventory_history ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                   v_name, v_start, v_end);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ensure_inventory_history_partitions(p_months_ahead INT DEFAULT 2) RETURNS void AS $$
+    SELECT create_inventory_history_partition(month::date)
+    FROM generate_series(date_trunc('month', CURRENT_TIMESTAMP),
+                         date_trunc('month', CURRENT_TIMESTAMP) + p_months_ahead * INTERVAL '1 month',
+                         INTERVAL '1 month') AS month;
+$$ LANGUAGE sql;
+
+-- Rebuild inventory_history as a partitioned table, keeping its rows and ID sequence
+ALTER TABLE inventory_history RENAME TO inventory_history_unpartitioned;
+DROP TRIGGER IF EXISTS inventory_history_notify_change ON inventory_history_unpartitioned;
+
+CREATE TABLE inventory_history (
+    id INT NOT NULL DEFAULT nextval('inventory_history_id_seq'),
+    product_id INT REFERENCES products(product_id),
+    timestamp TIMESTAMP NOT NULL,
+    new_quantity INT NOT NULL,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+ALTER SEQUENCE inventory_history_id_seq OWNED BY inventory_history.id;
+
+CREATE TABLE inventory_history_default PARTITION OF inventory_history DEFAULT;
+
+CREATE INDEX inventory_history_product_time_idx ON inventory_history (product_id, timestamp);
+
+SELECT create_inventory_history_partition(month::date)
+FROM generate_series(date_trunc('month', COALESCE((SELECT MIN(timestamp) FROM inventory_history_unpartitioned),
+                                                  CURRENT_TIMESTAMP)),
+                     date_trunc('month', CURRENT_TIMESTAMP) + INTERVAL '2 months',
+                     INTERVAL '1 month') AS month;
+
+INSERT INTO inventory_history (id, product_id, timestamp, new_quantity)
+SELECT id, product_id, timestamp, new_quantity FROM inventory_history_unpartitioned;
+
+DROP TABLE inventory_history_unpartitioned;
+
+CREATE TRIGGER inventory_history_notify_change
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON inventory_history
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_ims_change();
+
+-- Every product's stock at snapshot_at
+CREATE TABLE inventory_snapshots (
+    snapshot_at TIMESTAMP NOT NULL,
+    product_id INT NOT NULL,
+    quantity INT NOT NULL,
+    PRIMARY KEY (product_id, snapshot_at)
+);
+
+CREATE INDEX inventory_snapshots_time_idx ON inventory_snapshots (snapshot_at);
+
+-- Stock of one product at p_at: its latest history row, or the latest snapshot when
+-- that part of the history has been compacted away
+CREATE OR REPLACE FUNCTION stock_as_of(p_product_id INT, p_at TIMESTAMP) RETURNS INT AS $$
+    SELECT COALESCE(
+        (SELECT new_quantity FROM inventory_history
+         WHERE product_id = p_product_id AND timestamp <= p_at
+         ORDER BY timestamp DESC, id DESC LIMIT 1),
+        (SELECT quantity FROM inventory_snapshots
+         WHERE product_id = p_product_id AND snapshot_at <= p_at
+         ORDER BY snapshot_at DESC LIMIT 1));
+$$ LANGUAGE sql STABLE;
+
+-- Stock of every product at p_at: the latest snapshot before it, overlaid with the
+-- history written between that snapshot and p_at
+CREATE OR REPLACE FUNCTION inventory_as_of(p_at TIMESTAMP)
+RETURNS TABLE (product_id INT, quantity INT) AS $$
+#variable_conflict use_column
+DECLARE
+    v_since TIMESTAMP := (SELECT MAX(snapshot_at) FROM inventory_snapshots WHERE snapshot_at <= p_at);
+BEGIN
+    RETURN QUERY
+    WITH changed AS (
+        SELECT DISTINCT ON (h.product_id) h.product_id, h.new_quantity
+        FROM inventory_history h
+        WHERE h.timestamp <= p_at AND h.timestamp > COALESCE(v_since, '-infinity'::timestamp)
+        ORDER BY h.product_id, h.timestamp DESC, h.id DESC
+    )
+    SELECT changed.product_id, changed.new_quantity FROM changed
+    UNION ALL
+    SELECT s.product_id, s.quantity FROM inventory_snapshots s
+    WHERE s.snapshot_at = v_since
+      AND NOT EXISTS (SELECT 1 FROM changed WHERE changed.product_id = s.product_id);
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+CREATE OR REPLACE FUNCTION take_inventory_snapshot(p_at TIMESTAMP) RETURNS INT AS $$
+DECLARE
+    v_count INT;
+BEGIN
+    INSERT INTO inventory_snapshots (snapshot_at, product_id, quantity)
+    SELECT p_at, product_id, quantity FROM inventory_as_of(p_at)
+    ON CONFLICT (product_id, snapshot_at) DO UPDATE SET quantity = EXCLUDED.quantity;
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Snapshot every month boundary up to the retention cutoff, then drop the monthly
+-- partitions before it and thin out older snapshots to one per month. Returns the
+-- number of partitions dropped.
+CREATE OR REPLACE FUNCTION compact_inventory_history(p_keep_months INT DEFAULT 12) RETURNS INT AS $$
+DECLARE
+    v_cutoff TIMESTAMP := date_trunc('month', CURRENT_TIMESTAMP) - p_keep_months * INTERVAL '1 month';
+    v_partition RECORD;
+    v_dropped INT := 0;
+BEGIN
+    FOR v_partition IN
+        SELECT child.relname AS name,
+               to_date(replace(substring(child.relname FROM '\d{4}m\d{2}$'), 'm', ''), 'YYYYMM')::timestamp AS month
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'inventory_history' AND child.relname ~ '^inventory_history_y\d{4}m\d{2}$'
+        ORDER BY month
+    LOOP
+        EXIT WHEN v_partition.month + INTERVAL '1 month' > v_cutoff;
+
+        -- The snapshot at the end of the month keeps its final stock once the rows are gone
+        PERFORM take_inventory_snapshot(v_partition.month + INTERVAL '1 month');
+        EXECUTE format('DROP TABLE %I', v_partition.name);
+        v_dropped := v_dropped + 1;
+    END LOOP;
+
+    -- Old rows that ended up in the default partition are covered by a snapshot at the cutoff
+    IF EXISTS (SELECT 1 FROM inventory_history_default WHERE timestamp < v_cutoff) THEN
+        PERFORM take_inventory_snapshot(v_cutoff);
+        DELETE FROM inventory_history_default WHERE timestamp < v_cutoff;
+    END IF;
+
+    -- Before the cutoff only the month boundary snapshots are kept
+    DELETE FROM inventory_snapshots
+    WHERE snapshot_at < v_cutoff AND snapshot_at <> date_trunc('month', snapshot_at);
+    RETURN v_dropped;
+END;
+$$ LANGUAGE plpgsql;
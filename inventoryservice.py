@@ -0,0 +1,433 @@
+"""Headless business operations on products, sales, inventory, reports and users.
+
+Every operation takes the connection to run on as its first argument and works
+inside the caller's transaction, so the same call can be submitted to a
+DatabaseWorker by a Qt view (which commits on success) or run from a script
+through InventoryService.run(). Each mutating operation has a batched variant
+that handles many items in one statement.
+
+The NumPy based report and history modules are imported by the operations that
+use them, so the login screen can use this service without loading them.
+
+This class runs on PostgreSQL; get_inventory_service() returns the
+SQLiteInventoryService subclass (see sqliteservice.py) when the embedded SQLite
+backend is configured.
+"""
+import itertools
+from datetime import timedelta
+
+import lowstock
+from database import get_backend, pooled_connection
+from historywriter import get_history_writer
+from product import Product
+
+PRODUCT_COLUMNS = "product_id, name, description, price, quantity"
+
+DEFAULT_SALE_STATUS = 'sold'
+
+SALES_HISTORY_PAGE_SIZE = 200
+
+# Kinds of entries in a terminal's local journal (see localreplica.py)
+JOURNAL_SALE = 'sale'
+JOURNAL_STOCK = 'stock'
+
+
+class ProductChanges:
+    """Products changed since a watermark (or all of them, for a full load) and IDs deleted since."""
+
+    __slots__ = ('rows', 'deleted_ids', 'watermark', 'is_full_load')
+
+    def __init__(self, rows, deleted_ids, watermark, is_full_load):
+        self.rows = rows
+        self.deleted_ids = deleted_ids
+        self.watermark = watermark
+        self.is_full_load = is_full_load
+
+
+class Sale:
+    __slots__ = ('product_id', 'quantity', 'new_quantity', 'total')
+
+    def __init__(self, product_id, quantity, new_quantity, total):
+        self.product_id = product_id
+        self.quantity = quantity
+        self.new_quantity = new_quantity
+        self.total = total
+
+
+class User:
+    def __init__(self, user_id, username, password_hash, role):
+        self.user_id = user_id
+        self.username = username
+        self.password_hash = password_hash
+        self.role = role
+
+
+class InventoryService:
+    def run(self, operation, *args):
+        """Run operation(conn, *args) on a pooled connection and commit, for use outside the GUI."""
+        with pooled_connection() as conn:
+            if not conn:
+                raise ConnectionError('Error connecting to the database')
+
+            try:
+                result = operation(conn, *args)
+                conn.commit()
+                return result
+            except Exception:
+                conn.rollback()
+                raise
+
+    # Products
+
+    def list_products(self, conn):
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {PRODUCT_COLUMNS} FROM products ORDER BY product_id")
+        return [Product(*row) for row in cursor.fetchall()]
+
+    def get_products(self, conn, product_ids):
+        """Return the products with the given IDs, ordered by ID; unknown IDs are left out."""
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE product_id = ANY(%s) ORDER BY product_id",
+                       (list(product_ids),))
+        return [Product(*row) for row in cursor.fetchall()]
+
+    def product_changes(self, conn, watermark=None):
+        """Return the ProductChanges since the watermark, or every product if it is None.
+
+        Rows are (product_id, name, description, price, quantity) tuples. The watermark is
+        the oldest transaction still running when the changes were read: every change the
+        read could not see was made by that transaction or a later one, so the next refresh
+        re-reads everything stamped from it on and never misses a late commit (see
+        products_change_visibilityQuery.sql).
+        """
+        cursor = conn.cursor()
+        # Taken before the reads, so it is no later than the xmin of the snapshots they use
+        cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+        new_watermark = cursor.fetchone()[0]
+
+        if watermark is None:
+            cursor.execute(f"SELECT {PRODUCT_COLUMNS} FROM products ORDER BY product_id")
+            rows = cursor.fetchall()
+            deleted_ids = []
+        else:
+            cursor.execute(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE change_xid >= %s::text::xid8 "
+                           f"ORDER BY product_id", (watermark,))
+            rows = cursor.fetchall()
+            cursor.execute("SELECT product_id FROM product_tombstones WHERE change_xid >= %s::text::xid8",
+                           (watermark,))
+            deleted_ids = [row[0] for row in cursor.fetchall()]
+
+        return ProductChanges(rows, deleted_ids, new_watermark, watermark is None)
+
+    def add_product(self, conn, name, description, price, quantity):
+        """Add a product with its initial inventory record, returning its ID."""
+        return self.add_products(conn, [(name, description, price, quantity)])[0]
+
+    def add_products(self, conn, products):
+        """Add (name, description, price, quantity) products, returning their IDs in input order."""
+        products = list(products)
+        if not products:
+            return []
+
+        from psycopg2.extras import execute_values
+        rows = execute_values(
+            conn.cursor(),
+            "WITH added AS ("
+            "    INSERT INTO products (name, description, price, quantity) VALUES %s"
+            "    RETURNING product_id, quantity"
+            "), inventory_change AS ("
+            "    INSERT INTO inventory_history (product_id, timestamp, new_quantity)"
+            "    SELECT product_id, CURRENT_TIMESTAMP, quantity FROM added"
+            ") SELECT product_id FROM added",
+            products, page_size=len(products), fetch=True)
+        return [row[0] for row in rows]
+
+    def update_product(self, conn, product_id, name, description, price, quantity):
+        """Update a product and log its inventory change, returning False if it does not exist."""
+        return bool(self.update_products(conn, [(product_id, name, description, price, quantity)]))
+
+    def update_products(self, conn, products):
+        """Update (product_id, name, description, price, quantity) products, returning the IDs updated.
+
+        Their inventory changes are queued on the history writer, like every stock edit.
+        """
+        products = list(products)
+        if not products:
+            return []
+
+        from psycopg2.extras import execute_values
+        rows = execute_values(
+            conn.cursor(),
+            "UPDATE products SET name = t.name, description = t.description, price = t.price, quantity = t.quantity "
+            "FROM (VALUES %s) AS t (product_id, name, description, price, quantity) "
+            "WHERE products.product_id = t.product_id AND t.quantity >= 0 "
+            "RETURNING products.product_id, products.quantity",
+            products, page_size=len(products), fetch=True)
+        get_history_writer().log_inventory_changes(rows)
+        return [row[0] for row in rows]
+
+    def delete_product(self, conn, product_id):
+        """Delete a product and its inventory history, returning False if it did not exist."""
+        return bool(self.delete_products(conn, [product_id]))
+
+    def delete_products(self, conn, product_ids):
+        """Delete products and their inventory history, returning the IDs deleted."""
+        product_ids = list(product_ids)
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM inventory_history WHERE product_id = ANY(%s)", (product_ids,))
+        cursor.execute("DELETE FROM products WHERE product_id = ANY(%s) RETURNING product_id", (product_ids,))
+        return [row[0] for row in cursor.fetchall()]
+
+    # Sales
+
+    def sell(self, conn, product_id, quantity, status=DEFAULT_SALE_STATUS):
+        """Sell a product, returning the Sale, or None if there was not enough stock.
+
+        The guarded stock decrement, inventory history and sales history are written by
+        one statement (see sell_productQuery.sql), so terminals never oversell.
+        """
+        return self.sell_many(conn, [(product_id, quantity)], status)[0]
+
+    def sell_many(self, conn, sales, status=DEFAULT_SALE_STATUS):
+        """Sell (product_id, quantity) pairs in order, returning a Sale or None for each.
+
+        A sale is refused (None) if the product is unknown, its stock is insufficient or the
+        quantity is not positive.
+        """
+        sales = list(sales)
+        if not sales:
+            return []
+
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT requested.quantity, sold.product_id, sold.new_quantity, sold.total "
+            "FROM unnest(%s::int[], %s::int[]) WITH ORDINALITY AS requested (product_id, quantity, position) "
+            "LEFT JOIN LATERAL sell_product(requested.product_id, requested.quantity, %s) AS sold ON TRUE "
+            "ORDER BY requested.position",
+            ([product_id for product_id, _ in sales], [quantity for _, quantity in sales], status))
+        return [Sale(product_id, quantity, new_quantity, total) if product_id is not None else None
+                for quantity, product_id, new_quantity, total in cursor.fetchall()]
+
+    def sales_history(self, conn):
+        """Return (order_id, quantity, total, product_id, product_name, price) for every sale."""
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT sales_history.order_id, sales_history.quantity, sales_history.total, "
+            "products.product_id, products.name, products.price "
+            "FROM sales_history "
+            "JOIN products ON sales_history.product_id = products.product_id"
+        )
+        return cursor.fetchall()
+
+    def sales_page(self, conn, after_order_id=0, limit=100):
+        """Return up to limit sales with an order_id above after_order_id, oldest first.
+
+        Rows are (order_id, product_id, product_name, quantity, total, timestamp, status);
+        pass the last order_id of a page to get the next one.
+        """
+        cursor = conn.cursor()
+        cursor.execute("SELECT order_id, product_id, product_name, quantity, total, timestamp, status "
+                       "FROM sales_history WHERE order_id > %s ORDER BY order_id LIMIT %s",
+                       (after_order_id, limit))
+        return cursor.fetchall()
+
+    def sales_history_page(self, conn, before=None, limit=SALES_HISTORY_PAGE_SIZE, start_date=None, end_date=None,
+                           product_id=None, after=None):
+        """Return up to limit sales, newest first, optionally within dates (inclusive) and for one product.
+
+        Rows are (order_id, timestamp, product_id, product_name, quantity, total). Pages are
+        keyset paginated on (timestamp, order_id): pass that key of a page's last row as before
+        to get the next, older page, or the key of the newest row seen as after to get the
+        sales made since. Every filter is served by an index (see sales_history_pagingQuery.sql).
+        Each page is its own short query, so no transaction or server-side cursor is held open
+        on a pooled connection while the user scrolls.
+        """
+        conditions = []
+        params = []
+        if before is not None:
+            conditions.append("(timestamp, order_id) < (%s, %s)")
+            params.extend(before)
+        if after is not None:
+            conditions.append("(timestamp, order_id) > (%s, %s)")
+            params.extend(after)
+        if start_date is not None:
+            conditions.append("timestamp >= %s")
+            params.append(start_date)
+        if end_date is not None:
+            conditions.append("timestamp < %s")
+            params.append(end_date + timedelta(days=1))
+        if product_id is not None:
+            conditions.append("product_id = %s")
+            params.append(product_id)
+
+        cursor = conn.cursor()
+        cursor.execute("SELECT order_id, timestamp, product_id, product_name, quantity, total FROM sales_history "
+                       f"WHERE {' AND '.join(conditions) or 'TRUE'} "
+                       "ORDER BY timestamp DESC, order_id DESC LIMIT %s", params + [limit])
+        return cursor.fetchall()
+
+    # Inventory
+
+    def set_stock(self, conn, product_id, quantity):
+        """Set a product's stock and log the change, returning False if it does not exist."""
+        return bool(self.set_stock_many(conn, [(product_id, quantity)]))
+
+    def set_stock_many(self, conn, changes):
+        """Set (product_id, quantity) stock levels and log the changes, returning the IDs updated.
+
+        Negative stock levels are not applied. The history rows are queued on the history
+        writer (see historywriter.py), so bulk edits are logged in batches off this transaction.
+        """
+        changes = list(changes)
+        if not changes:
+            return []
+
+        from psycopg2.extras import execute_values
+        rows = execute_values(
+            conn.cursor(),
+            "UPDATE products SET quantity = t.quantity "
+            "FROM (VALUES %s) AS t (product_id, quantity) "
+            "WHERE products.product_id = t.product_id AND t.quantity >= 0 "
+            "RETURNING products.product_id, products.quantity",
+            changes, page_size=len(changes), fetch=True)
+        get_history_writer().log_inventory_changes(rows)
+        return [row[0] for row in rows]
+
+    # Terminal journals
+
+    def claim_journal_entries(self, conn, terminal_id, entry_ids):
+        """Mark a terminal's journal entries as replayed, returning the IDs not replayed before."""
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO replayed_journal_entries (terminal_id, entry_id) "
+                       "SELECT %s, unnest(%s::bigint[]) ON CONFLICT DO NOTHING RETURNING entry_id",
+                       (terminal_id, list(entry_ids)))
+        return {row[0] for row in cursor.fetchall()}
+
+    def replay_journal(self, conn, terminal_id, entries):
+        """Apply (entry_id, kind, product_id, quantity) entries from a terminal's journal, in order.
+
+        Entries already replayed by an earlier call are skipped, so a batch can be retried
+        safely. Sales are guarded decrements like any other sale, so one that the stock
+        no longer covers is rejected instead of overselling. Returns (entry_id, kind, result)
+        for every entry applied: a Sale or None for sales, True or False for stock changes.
+        """
+        entries = list(entries)
+        if not entries:
+            return []
+
+        claimed = self.claim_journal_entries(conn, terminal_id, [entry[0] for entry in entries])
+        results = []
+        for kind, run in itertools.groupby([entry for entry in entries if entry[0] in claimed],
+                                           key=lambda entry: entry[1]):
+            run = list(run)
+            if kind == JOURNAL_SALE:
+                outcomes = self.sell_many(conn, [(product_id, quantity) for _, _, product_id, quantity in run])
+            else:
+                # The last of several changes to the same product wins, as it would have one by one
+                updated = set(self.set_stock_many(
+                    conn, dict((product_id, quantity) for _, _, product_id, quantity in run).items()))
+                outcomes = [product_id in updated for _, _, product_id, _ in run]
+            results.extend((entry[0], kind, outcome) for entry, outcome in zip(run, outcomes))
+        return results
+
+    def low_stock(self, conn):
+        return lowstock.find_low_stock(conn)
+
+    def restock_low_stock(self, conn, product_ids=None):
+        """Restock every low product (or only the given ones), returning the Restocks applied."""
+        return lowstock.restock_low_stock(conn, product_ids)
+
+    def set_low_stock_thresholds(self, conn, thresholds):
+        lowstock.set_thresholds(conn, thresholds)
+
+    def stock_as_of(self, conn, product_id, at):
+        import stockhistory
+        return stockhistory.stock_as_of(conn, product_id, at)
+
+    def catalog_as_of(self, conn, at):
+        import stockhistory
+        return stockhistory.catalog_as_of(conn, at)
+
+    # Reports
+
+    def sales_report(self, conn, start_date=None, end_date=None):
+        """Return (labels, quantities) sold per product."""
+        import analytics
+        labels, quantities, _ = analytics.load_sales_by_product(conn, start_date, end_date)
+        return labels, quantities
+
+    def stock_report(self, conn):
+        """Return (labels, quantities) in stock per product."""
+        import analytics
+        stock = analytics.load_stock(conn)
+        return stock.labels, stock.quantity
+
+    def profitability_report(self, conn, start_date=None, end_date=None):
+        """Return (labels, amounts) of sales per product."""
+        import analytics
+        labels, _, total_cents = analytics.load_sales_by_product(conn, start_date, end_date)
+        return labels, analytics.cents_to_amount(total_cents)
+
+    def daily_sales_report(self, conn, start_date=None, end_date=None, window=7):
+        """Return (dates, daily totals, trailing moving average of the totals)."""
+        import analytics
+        sales = analytics.load_daily_sales(conn, start_date, end_date)
+        days, total_cents = analytics.daily_series(sales, sales.total_cents)
+        totals = analytics.cents_to_amount(total_cents)
+        return analytics.days_to_dates(days), totals, analytics.moving_average(totals, window)
+
+    def restock_forecast(self, conn):
+        import forecast
+        return forecast.forecast_restock(conn)
+
+    def rebuild_sales_rollup(self, conn, since=None):
+        """Recompute the daily sales rollup from sales history, from the given date on or entirely.
+
+        Maintenance only: the rollup is kept current by a trigger, so this backfills it or
+        repairs it after sales history was edited by hand (see sales_daily_rollupQuery.sql).
+        """
+        cursor = conn.cursor()
+        cursor.execute("SELECT rebuild_sales_rollup(%s)", (since,))
+
+    # Users
+
+    def register_user(self, conn, username, password, role):
+        """Register a user, returning False if the username is taken."""
+        return bool(self.register_users(conn, [(username, password, role)]))
+
+    def register_users(self, conn, users):
+        """Register (username, password, role) users, returning the usernames that were not taken."""
+        users = list(users)
+        if not users:
+            return []
+
+        from psycopg2.extras import execute_values
+        rows = execute_values(conn.cursor(),
+                              "INSERT INTO users (username, password_hash, role) VALUES %s "
+                              "ON CONFLICT (username) DO NOTHING RETURNING username",
+                              users, page_size=len(users), fetch=True)
+        return [row[0] for row in rows]
+
+    def authenticate(self, conn, username, password):
+        """Return the User with these credentials, or None."""
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_id, username, password_hash, role FROM users "
+                       "WHERE username = %s AND password_hash = %s", (username, password))
+        row = cursor.fetchone()
+        return User(*row) if row else None
+
+
+_service = None
+
+
+def get_inventory_service():
+    """Return the process-wide service for the configured storage backend."""
+    global _service
+
+    if _service is None:
+        if get_backend().name == 'sqlite':
+            from sqliteservice import SQLiteInventoryService
+            _service = SQLiteInventoryService()
+        else:
+            _service = InventoryService()
+    return _service
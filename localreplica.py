@@ -0,0 +1,373 @@
+"""Offline-first catalog snapshot and sale journal for terminals.
+
+Each terminal keeps a small SQLite file next to its report cache holding the
+last product catalog it loaded and an append-only journal of the sales and
+stock changes made on it. Sales are checked against the local snapshot and
+written to the journal before the GUI moves on, so selling never waits for
+the central database; a JournalReplayer thread replays the journal in
+batches, straight away while the database is reachable and after a retry
+delay while it is not.
+
+The central database remains the authority: a replayed sale is a guarded
+decrement like any other (see sell_productQuery.sql) and is rejected if
+another terminal sold the stock first. Replays are idempotent, since every
+entry is claimed in replayed_journal_entries (see terminal_journalQuery.sql)
+in the same transaction that applies it.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from decimal import Decimal
+
+from inventoryservice import JOURNAL_SALE, JOURNAL_STOCK, get_inventory_service
+
+LOCAL_REPLICA_PATH = os.environ.get(
+    'IMS_LOCAL_REPLICA_PATH', os.path.join(os.path.expanduser('~'), '.cache', 'ims', 'replica.db'))
+
+# replica_state key of the product_changes watermark the snapshot was taken at; snapshots saved
+# under an older key held change sequence values, which are not comparable, so they load in full
+WATERMARK_KEY = 'change_watermark'
+
+REPLAY_BATCH_SIZE = 500
+REPLAY_RETRY_DELAY = 5.0  # Seconds between replay attempts while the database is unreachable
+
+LOCAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog (
+    product_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    price TEXT NOT NULL,
+    quantity INTEGER NOT NULL  -- As last loaded from the central database
+);
+
+-- AUTOINCREMENT: entry IDs identify entries centrally, so they are never reused
+CREATE TABLE IF NOT EXISTS journal (
+    entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS replica_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class JournalEntry:
+    __slots__ = ('entry_id', 'kind', 'product_id', 'quantity', 'created_at')
+
+    def __init__(self, entry_id, kind, product_id, quantity, created_at):
+        self.entry_id = entry_id
+        self.kind = kind
+        self.product_id = product_id
+        self.quantity = quantity
+        self.created_at = created_at
+
+
+class LocalReplica:
+    """The on-disk catalog snapshot and journal of one terminal.
+
+    Catalog rows are stored as last loaded; everything handed back to callers has
+    the pending journal applied on top, so the terminal shows the stock it has
+    sold even before the sales reach the database. Every journal write is synced
+    to disk before it returns. Safe to use from several threads.
+    """
+
+    def __init__(self, path=LOCAL_REPLICA_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Bumped by every mark_replayed(); product_id -> generation its quantity was last confirmed in
+        self.replay_generation = 0
+        self._confirmed_generations = {}
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = FULL')  # A recorded sale survives a power cut
+        self._conn.executescript(LOCAL_SCHEMA)
+        self.terminal_id = self._state('terminal_id')
+        if self.terminal_id is None:
+            self.terminal_id = str(uuid.uuid4())
+            self._set_state('terminal_id', self.terminal_id)
+
+    # Catalog
+
+    def load_catalog(self):
+        """Return (rows, watermark) from the snapshot, or ([], None) if there is none yet.
+
+        Rows are (product_id, name, description, price, quantity) tuples with the pending
+        journal applied; the watermark is the product_changes watermark the snapshot was taken at.
+        """
+        with self._lock:
+            watermark = self._state(WATERMARK_KEY)
+            rows = self._conn.execute("SELECT product_id, name, description, price, quantity "
+                                      "FROM catalog ORDER BY product_id").fetchall()
+            rows = self._project([(product_id, name, description, Decimal(price), quantity)
+                                  for product_id, name, description, price, quantity in rows])
+        return rows, int(watermark) if watermark is not None else None
+
+    def save_changes(self, changes, generation=None):
+        """Store ProductChanges loaded from the database and return their rows with the pending journal applied.
+
+        generation is the replay_generation read before the changes were loaded: products whose
+        quantity a replay confirmed since then keep the confirmed quantity, which is newer than
+        the loaded one. The stored watermark never moves backwards.
+        """
+        with self._lock:
+            rows = changes.rows
+            if generation is not None:
+                stale_ids = [row[0] for row in rows if self._confirmed_generations.get(row[0], -1) > generation]
+                if stale_ids:
+                    confirmed = dict(self._conn.execute(
+                        'SELECT product_id, quantity FROM catalog WHERE product_id IN (%s)'
+                        % ','.join('?' * len(stale_ids)), stale_ids).fetchall())
+                    rows = [row[:4] + (confirmed.get(row[0], row[4]),) for row in rows]
+
+            stored_watermark = self._state(WATERMARK_KEY)
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                if changes.is_full_load:
+                    self._conn.execute('DELETE FROM catalog')
+                else:
+                    self._conn.executemany('DELETE FROM catalog WHERE product_id = ?',
+                                           [(product_id,) for product_id in changes.deleted_ids])
+                self._conn.executemany("INSERT OR REPLACE INTO catalog "
+                                       "(product_id, name, description, price, quantity) VALUES (?, ?, ?, ?, ?)",
+                                       [(product_id, name, description, str(price), quantity)
+                                        for product_id, name, description, price, quantity in rows])
+                if stored_watermark is None or changes.watermark > int(stored_watermark):
+                    self._set_state(WATERMARK_KEY, str(changes.watermark))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            return self._project(rows)
+
+    # Journal
+
+    def record_sale(self, product_id, quantity):
+        """Journal a sale if the local stock covers it, returning the product's new local quantity or None."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                available = self._local_quantity(product_id)
+                if available is None or available < quantity:
+                    self._conn.execute('ROLLBACK')
+                    return None
+                self._append(JOURNAL_SALE, product_id, quantity)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return available - quantity
+
+    def record_stock_change(self, product_id, quantity):
+        """Journal setting a product's stock to quantity."""
+        with self._lock:
+            self._append(JOURNAL_STOCK, product_id, quantity)
+
+    def pending(self, limit=REPLAY_BATCH_SIZE):
+        """Return the oldest journal entries not yet replayed."""
+        with self._lock:
+            rows = self._conn.execute("SELECT entry_id, kind, product_id, quantity, created_at FROM journal "
+                                      "ORDER BY entry_id LIMIT ?", (limit,)).fetchall()
+        return [JournalEntry(*row) for row in rows]
+
+    @property
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM journal').fetchone()[0]
+
+    def mark_replayed(self, entry_ids, confirmed_quantities=()):
+        """Remove replayed entries, storing the (product_id, quantity) levels the database confirmed."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany('DELETE FROM journal WHERE entry_id = ?',
+                                       [(entry_id,) for entry_id in entry_ids])
+                self._conn.executemany('UPDATE catalog SET quantity = ? WHERE product_id = ?',
+                                       [(quantity, product_id) for product_id, quantity in confirmed_quantities])
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            self.replay_generation += 1
+            for product_id, _ in confirmed_quantities:
+                self._confirmed_generations[product_id] = self.replay_generation
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _append(self, kind, product_id, quantity):
+        self._conn.execute("INSERT INTO journal (kind, product_id, quantity, created_at) VALUES (?, ?, ?, ?)",
+                           (kind, product_id, quantity, datetime.now().isoformat(' ')))
+
+    def _local_quantity(self, product_id):
+        row = self._conn.execute('SELECT quantity FROM catalog WHERE product_id = ?', (product_id,)).fetchone()
+        if row is None:
+            return None
+        return self._pending_quantities({product_id: row[0]}, product_id)[product_id]
+
+    def _project(self, rows):
+        quantities = self._pending_quantities({row[0]: row[4] for row in rows})
+        return [row[:4] + (quantities[row[0]],) for row in rows]
+
+    def _pending_quantities(self, quantities, product_id=None):
+        """Apply the pending journal (for one product, or all) to a {product_id: quantity} dict, in order."""
+        for kind, entry_product_id, quantity in self._conn.execute(
+                'SELECT kind, product_id, quantity FROM journal WHERE ? IS NULL OR product_id = ? '
+                'ORDER BY entry_id', (product_id, product_id)):
+            if entry_product_id not in quantities:
+                continue
+            if kind == JOURNAL_SALE:
+                quantities[entry_product_id] -= quantity
+            else:
+                quantities[entry_product_id] = quantity
+        return quantities
+
+    def _state(self, key):
+        row = self._conn.execute('SELECT value FROM replica_state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, key, value):
+        self._conn.execute('INSERT OR REPLACE INTO replica_state (key, value) VALUES (?, ?)', (key, value))
+
+
+class JournalReplayer(threading.Thread):
+    """Background thread replaying a LocalReplica's journal into the central database.
+
+    on_replayed(results) receives the (entry, result) pairs of every batch applied,
+    where result is a Sale or None for sales and True or False for stock changes;
+    on_connectivity(is_online) is called whenever replaying starts or stops failing.
+    Both are called from this thread.
+    """
+
+    def __init__(self, replica, service=None, batch_size=REPLAY_BATCH_SIZE, retry_delay=REPLAY_RETRY_DELAY,
+                 on_replayed=None, on_connectivity=None):
+        super().__init__(name='JournalReplayer', daemon=True)
+
+        self.replica = replica
+        self.service = service or get_inventory_service()
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.on_replayed = on_replayed
+        self.on_connectivity = on_connectivity
+        self.is_online = True
+
+        self._wake = threading.Event()
+        self._closing = threading.Event()
+
+    def wake(self):
+        """Replay now, e.g. after a new entry was journaled or the database came back."""
+        self._wake.set()
+
+    def close(self, timeout=10):
+        """Make a last attempt to replay the journal and stop; whatever is left waits for the next start."""
+        self._closing.set()
+        self._wake.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        while True:
+            replayed_all = self._replay_pending()
+            if self._closing.is_set():
+                return
+            self._wake.wait(None if replayed_all else self.retry_delay)
+            self._wake.clear()
+
+    def _replay_pending(self):
+        """Replay batches until the journal is empty, returning False if the database could not be reached."""
+        while True:
+            entries = self.replica.pending(self.batch_size)
+            if not entries:
+                return True
+
+            try:
+                results = self.service.run(self.service.replay_journal, self.replica.terminal_id,
+                                           [(entry.entry_id, entry.kind, entry.product_id, entry.quantity)
+                                            for entry in entries])
+            except Exception as e:
+                logging.warning(f'Could not replay {len(entries)} journaled changes, will retry: {e}')
+                self._set_online(False)
+                return False
+
+            self._set_online(True)
+            outcomes = {entry_id: result for entry_id, _, result in results}
+            confirmed = []
+            for entry in entries:
+                result = outcomes.get(entry.entry_id)
+                if entry.kind == JOURNAL_SALE and result is not None:
+                    confirmed.append((entry.product_id, result.new_quantity))
+                elif entry.kind == JOURNAL_STOCK and result:
+                    confirmed.append((entry.product_id, entry.quantity))
+            # Entries missing from results had been applied by an earlier attempt
+            self.replica.mark_replayed([entry.entry_id for entry in entries], confirmed)
+            logging.info(f'Replayed {len(results)} journaled changes ({len(entries) - len(results)} already applied)')
+
+            if self.on_replayed:
+                self.on_replayed([(entry, outcomes[entry.entry_id]) for entry in entries
+                                  if entry.entry_id in outcomes])
+
+    def _set_online(self, is_online):
+        if is_online == self.is_online:
+            return
+        self.is_online = is_online
+        if is_online:
+            logging.info('Central database reachable again, journal replay resumed')
+        else:
+            logging.warning('Central database unreachable, sales are journaled locally')
+        if self.on_connectivity:
+            self.on_connectivity(is_online)
+
+
+_replica = None
+_replayer = None
+_replica_lock = threading.Lock()
+
+
+def get_local_replica():
+    """Return the process-wide local replica, opening it on first use."""
+    global _replica
+
+    with _replica_lock:
+        if _replica is None:
+            _replica = LocalReplica()
+        return _replica
+
+
+def start_journal_replayer(on_replayed=None, on_connectivity=None):
+    """Start the process-wide journal replayer, or return the running one."""
+    global _replayer
+
+    replica = get_local_replica()
+    with _replica_lock:
+        if _replayer is None:
+            _replayer = JournalReplayer(replica, on_replayed=on_replayed, on_connectivity=on_connectivity)
+            _replayer.start()
+        return _replayer
+
+
+def close_local_replica():
+    """Stop the journal replayer after a last replay attempt and close the replica."""
+    global _replica, _replayer
+
+    with _replica_lock:
+        if _replayer is not None:
+            _replayer.close()
+            _replayer = None
+        if _replica is not None:
+            pending = _replica.pending_count
+            if pending:
+                logging.warning(f'{pending} journaled changes will be replayed on the next start')
+            _replica.close()
+            _replica = None
@@ -0,0 +1,186 @@
+"""Application-wide logging: JSON lines written by a background thread.
+
+configure_logging() replaces the root logger's handlers with a QueueHandler, so
+a logging call on the GUI thread only builds the record and puts it on an
+in-memory queue; a QueueListener thread formats it and appends it to the log
+file, which is rotated by size and by age.
+
+Records are one JSON object per line. Fields passed with extra= (for example
+operation and duration_ms) are written alongside the standard ones:
+
+    logging.info('Products loaded', extra={'operation': 'load_products', 'duration_ms': 12.5})
+
+Routine messages logged again and again from the same line, such as periodic
+refresh results, can opt in to rate limiting per call site before they are
+queued; the next record let through from that line carries a suppressed count.
+Other records, and warnings and errors, are never rate limited:
+
+    logging.info('Products refreshed', extra={'rate_limit': True})
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+LOG_FILE = os.environ.get('IMS_LOG_FILE', 'app.log')
+LOG_LEVEL = logging.INFO
+
+LOG_MAX_BYTES = 10 * 1024 * 1024  # Rotate when the file reaches 10 MB
+LOG_ROTATE_INTERVAL = 24 * 3600  # or when it is a day old
+LOG_BACKUP_COUNT = 7
+
+# Each opted-in call site may log this many INFO (or lower) records per interval; the rest are counted and dropped
+RATE_LIMIT_BURST = 5
+RATE_LIMIT_INTERVAL = 60.0  # Seconds
+
+# Attributes every LogRecord has; anything else was passed with extra=
+STANDARD_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+RATE_LIMIT_ATTRIBUTE = 'rate_limit'  # extra= flag opting a call site in to rate limiting
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object, including its extra= fields."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_RECORD_ATTRIBUTES and key != RATE_LIMIT_ATTRIBUTE and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most burst INFO (or lower) records per opted-in call site per interval."""
+
+    def __init__(self, burst=RATE_LIMIT_BURST, interval=RATE_LIMIT_INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = {}  # (pathname, lineno) -> [window start, records let through, records suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not getattr(record, RATE_LIMIT_ATTRIBUTE, False):
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get((record.pathname, record.lineno))
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[(record.pathname, record.lineno)] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed, window[2] = window[2], 0
+            else:
+                window[2] += 1
+                return False
+
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """Queues a copy of each record as is, leaving all formatting, tracebacks included, to the writer thread.
+
+    The stock QueueHandler formats the message and traceback on the calling thread and drops
+    exc_info, so JsonFormatter could never write the 'exception' field.
+    """
+
+    def prepare(self, record):
+        return copy.copy(record)
+
+
+class RotatingLogFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotates when the file reaches max_bytes or rotate_interval seconds after it was started."""
+
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, rotate_interval=LOG_ROTATE_INTERVAL,
+                 backup_count=LOG_BACKUP_COUNT):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.rotate_interval = rotate_interval
+        self.rollover_at = self._first_rollover()
+
+    def shouldRollover(self, record):
+        if self.rotate_interval and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.rotate_interval
+
+    def _first_rollover(self):
+        # A file left by an earlier run is rotated once it is old enough
+        try:
+            started = os.path.getmtime(self.baseFilename) if os.path.getsize(self.baseFilename) else time.time()
+        except OSError:
+            started = time.time()
+        return started + self.rotate_interval
+
+
+_listener = None
+_queue_handler = None
+_lock = threading.Lock()
+
+
+def configure_logging(filename=LOG_FILE, level=LOG_LEVEL):
+    """Send the root logger's records through a queue to a rotating JSON log file.
+
+    Safe to call more than once; only the first call has an effect. The writer thread
+    is stopped, after writing every queued record, by stop_logging() or at exit.
+    """
+    global _listener, _queue_handler
+
+    with _lock:
+        if _listener is not None:
+            return
+
+        file_handler = RotatingLogFileHandler(filename)
+        file_handler.setFormatter(JsonFormatter())
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = RecordQueueHandler(log_queue)
+        queue_handler.addFilter(RateLimitFilter())
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(level)
+
+        _queue_handler = queue_handler
+        _listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Detach the queue from the root logger, write every queued record and stop the writer thread."""
+    global _listener, _queue_handler
+
+    with _lock:
+        if _listener is None:
+            return
+        # Records logged after this point would otherwise queue up with nothing left to write them
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
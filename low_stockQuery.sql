@@ -0,0 +1,9 @@
+-- Per-product low stock thresholds and restock quantities.
+-- The partial index only holds products that are currently low, so finding them
+-- stays cheap no matter how large the catalog is.
+ALTER TABLE products
+ADD COLUMN low_stock_threshold INT NOT NULL DEFAULT 10,
+ADD COLUMN restock_quantity INT NOT NULL DEFAULT 10;
+
+CREATE INDEX products_low_stock_idx ON products (product_id)
+WHERE quantity < low_stock_threshold;
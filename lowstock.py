@@ -0,0 +1,77 @@
+"""Set-based low stock detection and restocking.
+
+Low stock products are found with one query served by the products_low_stock_idx
+partial index (see low_stockQuery.sql), and restocked with one statement that also
+writes their inventory_history rows.
+"""
+LOW_STOCK_CONDITION = "quantity < low_stock_threshold"
+
+FIND_LOW_STOCK = f"""
+    SELECT product_id, name, quantity, low_stock_threshold, restock_quantity
+    FROM products
+    WHERE {LOW_STOCK_CONDITION}
+    ORDER BY product_id
+"""
+
+# The condition is re-checked under the row lock, so products another terminal has
+# already restocked are skipped instead of being restocked twice
+RESTOCK_LOW_STOCK = f"""
+    WITH restocked AS (
+        UPDATE products
+        SET quantity = quantity + restock_quantity
+        WHERE {LOW_STOCK_CONDITION}
+          AND (%(product_ids)s IS NULL OR product_id = ANY(%(product_ids)s))
+        RETURNING product_id, name, quantity, restock_quantity, price
+    ), inventory_change AS (
+        INSERT INTO inventory_history (product_id, timestamp, new_quantity)
+        SELECT product_id, CURRENT_TIMESTAMP, quantity FROM restocked
+    )
+    SELECT product_id, name, quantity, restock_quantity, price * restock_quantity
+    FROM restocked
+    ORDER BY product_id
+"""
+
+
+class LowStockItem:
+    def __init__(self, product_id, name, quantity, low_stock_threshold, restock_quantity):
+        self.product_id = product_id
+        self.name = name
+        self.quantity = quantity
+        self.low_stock_threshold = low_stock_threshold
+        self.restock_quantity = restock_quantity
+
+
+class Restock:
+    def __init__(self, product_id, name, new_quantity, restock_quantity, total):
+        self.product_id = product_id
+        self.name = name
+        self.new_quantity = new_quantity
+        self.restock_quantity = restock_quantity
+        self.total = total
+
+
+def find_low_stock(conn):
+    """Return every product below its own low stock threshold."""
+    cursor = conn.cursor()
+    cursor.execute(FIND_LOW_STOCK)
+    return [LowStockItem(*row) for row in cursor.fetchall()]
+
+
+def restock_low_stock(conn, product_ids=None):
+    """Restock low products (all of them, or only the given IDs) in the caller's transaction.
+
+    Each product gets its own restock_quantity added. Returns the restocks applied.
+    """
+    cursor = conn.cursor()
+    cursor.execute(RESTOCK_LOW_STOCK, {'product_ids': list(product_ids) if product_ids is not None else None})
+    return [Restock(*row) for row in cursor.fetchall()]
+
+
+def set_thresholds(conn, thresholds):
+    """Set (product_id, low_stock_threshold, restock_quantity) for many products at once."""
+    from psycopg2.extras import execute_values
+    execute_values(conn.cursor(),
+                   "UPDATE products SET low_stock_threshold = t.threshold, restock_quantity = t.restock "
+                   "FROM (VALUES %s) AS t (product_id, threshold, restock) "
+                   "WHERE products.product_id = t.product_id",
+                   list(thresholds))
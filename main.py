@@ -1,45 +1,71 @@
 import sys
 
-import psycopg2
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QFormLayout, QLabel, QLineEdit, QPushButton, QMessageBox
+from PyQt5.QtWidgets import QApplication
 
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QTableWidget, QTableWidgetItem, QPushButton, QInputDialog, QMessageBox
+from logconfig import configure_logging, stop_logging
+from usermanagementapp import UserManagementApp
 
-from adminpanel import AdminPanel
-from product import Product
-from productmanagementapp import ProductManagementApp
-from salesmanagementapp import SalesManagementApp
-from usermanagementapp import UserManagementApp, StaffPanel
-from staffpanel import StaffPanel
 
+class PanelLauncher:
+    """Creates the admin and staff panels on first login, importing their screens only then."""
 
-def main():
-    app = QApplication([])
+    def __init__(self):
+        self.admin_panel = None
+        self.staff_panel = None
 
-    user_management_app = UserManagementApp()
+    def show_admin_panel(self):
+        if self.admin_panel is None:
+            from adminpanel import AdminPanel
+            self.admin_panel = AdminPanel()
+        self.admin_panel.show()
 
-    # Create instances of AdminPanel and UserManagementApp
-    admin_panel = AdminPanel()
+    def show_staff_panel(self):
+        if self.staff_panel is None:
+            from staffpanel import StaffPanel
+            self.staff_panel = StaffPanel()
+        self.staff_panel.show()
 
-    # Connect the signal to show the admin panel
-    user_management_app.showAdminPanelSignal.connect(admin_panel.show)
-    # Create instances of StaffPanel and UserManagementApp
-    staff_panel = StaffPanel()
 
-    # Connect the signal to show the staff panel
-    user_management_app.showStaffPanelSignal.connect(staff_panel.show)
+def shutdown():
+    # Stop listening for changes, flush queued history, make a last attempt to replay
+    # journaled sales and release pooled database connections; modules that were
+    # never imported have nothing to stop
+    if 'changenotifier' in sys.modules:
+        sys.modules['changenotifier'].stop_change_notifier()
+    if 'historywriter' in sys.modules:
+        sys.modules['historywriter'].close_history_writer()
+    if 'localreplica' in sys.modules:
+        sys.modules['localreplica'].close_local_replica()
+    if 'database' in sys.modules:
+        sys.modules['database'].close_pool()
+    # Last, so everything logged while shutting down is written
+    stop_logging()
+
+
+def create_application(argv):
+    """Create the application and its login window, without showing it."""
+    # Every window logs to one file, written by a background thread
+    configure_logging()
+    app = QApplication(argv)
 
-    user_management_app.show()
-    app.exec_()
-if __name__ == '__main__':
-   """ app = QApplication(sys.argv)
     user_management_app = UserManagementApp()
+
+    # Panels are created after login, when the user's role is known
+    launcher = PanelLauncher()
+    user_management_app.showAdminPanelSignal.connect(launcher.show_admin_panel)
+    user_management_app.showStaffPanelSignal.connect(launcher.show_staff_panel)
+    # Keep the launcher alive for as long as the window whose signals it handles
+    user_management_app.panel_launcher = launcher
+
+    app.aboutToQuit.connect(shutdown)
+    return app, user_management_app
+
+
+def main():
+    app, user_management_app = create_application(sys.argv)
     user_management_app.show()
+    return app.exec_()
 
-    product_management_app = ProductManagementApp()
-    product_management_app.show()
 
-    sales_app = SalesManagementApp()
-    sales_app.show()
-    sys.exit(app.exec_())"""
-   main()
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import logging
+
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import (
+    QDialog, QFileDialog, QHBoxLayout, QLabel, QMessageBox, QPlainTextEdit, QPushButton, QVBoxLayout
+)
+
+from querystats import get_query_stats
+from tablemodels import RecordTableModel, create_record_view
+
+REFRESH_INTERVAL = 2000  # 2 seconds
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+def _histogram_summary(title, histogram):
+    return (f"{title}: {histogram['count']} calls, mean "
+            f"{_ms(histogram['total_seconds'] / histogram['count']) if histogram['count'] else 0} ms, "
+            f"p95 {_ms(histogram['p95_seconds'])} ms, max {_ms(histogram['max_seconds'])} ms")
+
+
+class PerformanceView(QDialog):
+    """Query timings per statement, connection checkout and GUI-thread blocking times, and slow query plans."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.setWindowTitle('Performance')
+        self.setGeometry(100, 100, 1000, 700)
+        self.stats = get_query_stats()
+
+        self.statement_model = RecordTableModel([
+            ('Statement', lambda row: row['statement']),
+            ('Calls', lambda row: row['count']),
+            ('Errors', lambda row: row['errors']),
+            ('Rows', lambda row: row['rows']),
+            ('Total ms', lambda row: _ms(row['total_seconds'])),
+            ('Mean ms', lambda row: _ms(row['total_seconds'] / row['count']) if row['count'] else 0),
+            ('p95 ms', lambda row: _ms(row['p95_seconds'])),
+            ('Max ms', lambda row: _ms(row['max_seconds'])),
+            ('GUI thread ms', lambda row: _ms(row['gui_thread_seconds'])),
+        ], parent=self)
+        self.statement_table, self.statement_proxy = create_record_view(self.statement_model, self)
+        self.statement_table.sortByColumn(4, Qt.DescendingOrder)  # Most total time first
+
+        self.acquire_label = QLabel(self)
+        self.gui_thread_label = QLabel(self)
+        self.slow_queries_text = QPlainTextEdit(self)
+        self.slow_queries_text.setReadOnly(True)
+
+        refresh_button = QPushButton('Refresh', self)
+        refresh_button.clicked.connect(self.refresh)
+        reset_button = QPushButton('Reset', self)
+        reset_button.clicked.connect(self.reset)
+        export_prometheus_button = QPushButton('Export Prometheus...', self)
+        export_prometheus_button.clicked.connect(self.export_prometheus)
+        export_json_button = QPushButton('Export JSON...', self)
+        export_json_button.clicked.connect(self.export_json)
+
+        buttons = QHBoxLayout()
+        for button in (refresh_button, reset_button, export_prometheus_button, export_json_button):
+            buttons.addWidget(button)
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.acquire_label)
+        layout.addWidget(self.gui_thread_label)
+        layout.addWidget(self.statement_table, 3)
+        layout.addWidget(QLabel('Slow queries', self))
+        layout.addWidget(self.slow_queries_text, 1)
+        layout.addLayout(buttons)
+
+        # Only refreshed while the view is open
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start(REFRESH_INTERVAL)
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        snapshot = self.stats.snapshot()
+        self.statement_model.set_rows(snapshot['statements'])
+
+        acquire = snapshot['connection_acquire']
+        self.acquire_label.setText(_histogram_summary('Connection checkout', acquire)
+                                   + f", {acquire['failures']} failed")
+        self.gui_thread_label.setText(_histogram_summary('Queries on the GUI thread', snapshot['gui_thread_blocking']))
+
+        self.slow_queries_text.setPlainText('\n\n'.join(
+            f"{_ms(slow['seconds'])} ms: {slow['query']}" + (f"\n{slow['plan']}" if slow['plan'] else '')
+            for slow in reversed(snapshot['slow_queries'])))
+
+    def reset(self):
+        self.stats.reset()
+        self.refresh()
+
+    def export_prometheus(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Export Prometheus Metrics', 'ims_queries.prom',
+                                              'Prometheus text files (*.prom);;All files (*)')
+        if path:
+            self.export(self.stats.write_prometheus, path)
+
+    def export_json(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Export JSON Snapshot', 'ims_queries.json',
+                                              'JSON files (*.json);;All files (*)')
+        if path:
+            self.export(self.stats.write_json, path)
+
+    def export(self, write, path):
+        try:
+            write(path)
+            logging.info(f'Exported query statistics to {path}')
+        except OSError as e:
+            logging.error(f'Error exporting query statistics: {e}')
+            QMessageBox.warning(self, 'Export Failed', f'Could not write {path}: {e}', QMessageBox.Ok)
@@ -2,6 +2,9 @@
 from supplier import Supplier
 
 class Product:
+    # Slots keep per-product memory small for catalogs with many SKUs
+    __slots__ = ('product_id', 'name', 'description', 'price', 'quantity', 'supplier')
+
     def __init__(self, product_id, name, description, price, quantity, supplier=None):
         self.product_id = product_id
         self.name = name
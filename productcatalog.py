@@ -0,0 +1,95 @@
+from bisect import bisect_left, insort
+
+from recordstore import RecordStore
+
+
+class ProductCatalog(RecordStore):
+    """In-memory product store with constant-time lookups by ID and name.
+
+    Besides the product_id index inherited from RecordStore it keeps a name index
+    and a (quantity, product_id) list sorted by quantity, so low stock queries only
+    touch the products that are actually low. Products must be changed through
+    update() so the indexes stay in step.
+    """
+
+    def __init__(self):
+        super().__init__(key=lambda product: product.product_id)
+
+        self._by_name = {}  # name -> list of products with that name
+        self._by_quantity = []  # sorted (quantity, product_id) pairs
+
+    def replace(self, records):
+        super().replace(records)
+        self._by_name = {}
+        for product in self.records:
+            self._by_name.setdefault(product.name, []).append(product)
+        self._by_quantity = sorted((product.quantity, product.product_id) for product in self.records)
+
+    def extend(self, records):
+        super().extend(records)
+        for product in records:
+            self._by_name.setdefault(product.name, []).append(product)
+            insort(self._by_quantity, (product.quantity, product.product_id))
+
+    def pop(self, position):
+        product = super().pop(position)
+        self._unindex_name(product)
+        self._unindex_quantity(product)
+        return product
+
+    def update(self, product, name, description, price, quantity):
+        """Change a product in place, keeping the indexes current. Returns True if anything changed."""
+        if (product.name, product.description, product.price, product.quantity) == (name, description, price,
+                                                                                    quantity):
+            return False
+
+        if product.name != name:
+            self._unindex_name(product)
+            self._by_name.setdefault(name, []).append(product)
+        if product.quantity != quantity:
+            self._unindex_quantity(product)
+            insort(self._by_quantity, (quantity, product.product_id))
+
+        product.name, product.description, product.price, product.quantity = name, description, price, quantity
+        return True
+
+    def patch(self, rows):
+        """Apply (product_id, name, description, price, quantity) rows to known products.
+
+        Returns (changed_positions, new_rows): the positions of products that changed and
+        the rows for products not in the catalog yet, to be added with extend().
+        """
+        changed_positions = []
+        new_rows = []
+
+        for row in rows:
+            position = self.position(row[0])
+            if position is None:
+                new_rows.append(row)
+            elif self.update(self.records[position], *row[1:]):
+                changed_positions.append(position)
+
+        return changed_positions, new_rows
+
+    def find_by_name(self, name):
+        """Return the products with exactly this name."""
+        return list(self._by_name.get(name, ()))
+
+    def low_stock(self, threshold):
+        """Return the products whose quantity is below the threshold, lowest first."""
+        # (threshold,) sorts before every (threshold, product_id) pair
+        end = bisect_left(self._by_quantity, (threshold,))
+        return [self.get(product_id) for _, product_id in self._by_quantity[:end]]
+
+    def _unindex_name(self, product):
+        same_name = self._by_name.get(product.name)
+        if same_name:
+            same_name.remove(product)
+            if not same_name:
+                del self._by_name[product.name]
+
+    def _unindex_quantity(self, product):
+        entry = (product.quantity, product.product_id)
+        position = bisect_left(self._by_quantity, entry)
+        if position < len(self._by_quantity) and self._by_quantity[position] == entry:
+            del self._by_quantity[position]
@@ -0,0 +1,279 @@
+"""Streaming bulk product import and export.
+
+Imports read CSV or JSON-lines files in chunks, COPY each chunk into a staging
+table and upsert it into products, one transaction per chunk. Once a chunk is
+committed, the inventory changes of the products it changed are queued on the
+history writer, which appends them with COPY in large batches. The number of
+committed rows is checkpointed next to the file so an interrupted import
+resumes where it stopped. Exports stream products through a server-side cursor.
+On the embedded SQLite backend, which has no COPY, each chunk is upserted row by
+row with one prepared statement instead.
+
+Usage: python productimport.py import|export FILE
+"""
+import csv
+import io
+import json
+import logging
+import os
+import sys
+from contextlib import contextmanager
+from decimal import Decimal
+
+from database import get_backend, pooled_connection
+from historywriter import get_history_writer
+
+IMPORT_COLUMNS = ('product_id', 'name', 'description', 'price', 'quantity')
+IMPORT_CHUNK_SIZE = 10000
+EXPORT_BATCH_SIZE = 10000
+CHECKPOINT_SUFFIX = '.progress'
+
+CREATE_STAGING_TABLE = """
+    CREATE TEMP TABLE IF NOT EXISTS product_import_staging (
+        product_id INT,
+        name VARCHAR(255) NOT NULL,
+        description TEXT,
+        price DECIMAL(10, 2) NOT NULL,
+        quantity INT NOT NULL
+    ) ON COMMIT DELETE ROWS
+"""
+
+# Rows with an ID update that product (or create it with that ID); rows without one
+# get a new ID. Only products that actually changed are returned, for their inventory_history row.
+UPSERT_FROM_STAGING = """
+    INSERT INTO products (product_id, name, description, price, quantity)
+    SELECT COALESCE(product_id, nextval(pg_get_serial_sequence('products', 'product_id'))),
+           name, description, price, quantity
+    FROM product_import_staging
+    ON CONFLICT (product_id) DO UPDATE
+        SET name = EXCLUDED.name, description = EXCLUDED.description,
+            price = EXCLUDED.price, quantity = EXCLUDED.quantity
+        WHERE (products.name, products.description, products.price, products.quantity)
+            IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.description, EXCLUDED.price, EXCLUDED.quantity)
+    RETURNING product_id, quantity
+"""
+
+# SQLite: the same upsert one row at a time; RETURNING only yields rows that changed
+SQLITE_UPSERT_PRODUCT = """
+    INSERT INTO products (product_id, name, description, price, quantity)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (product_id) DO UPDATE
+        SET name = excluded.name, description = excluded.description,
+            price = excluded.price, quantity = excluded.quantity
+        WHERE products.name IS NOT excluded.name OR products.description IS NOT excluded.description
+           OR products.price IS NOT excluded.price OR products.quantity IS NOT excluded.quantity
+    RETURNING product_id, quantity
+"""
+
+# Keep the serial sequence ahead of IDs supplied by the file; it only ever moves forward,
+# so IDs it handed out before (including those of deleted products) are never reused
+SYNC_PRODUCT_ID_SEQUENCE = """
+    SELECT setval(sequence_name, max_id)
+    FROM (SELECT pg_get_serial_sequence('products', 'product_id') AS sequence_name, MAX(product_id) AS max_id
+          FROM products) AS ids
+    WHERE max_id > COALESCE(pg_sequence_last_value(sequence_name::regclass), 0)
+"""
+
+# A file may bring back the ID of a deleted product; its tombstone would otherwise make
+# clients drop the product again when both show up in the same refresh
+CLEAR_TOMBSTONES = "DELETE FROM product_tombstones WHERE product_id = ANY(%s)"
+SQLITE_CLEAR_TOMBSTONES = "DELETE FROM product_tombstones WHERE product_id IN (SELECT value FROM json_each(%s))"
+
+
+class ProductImportError(Exception):
+    pass
+
+
+def detect_format(path):
+    return 'jsonl' if path.lower().endswith(('.jsonl', '.json', '.ndjson')) else 'csv'
+
+
+def read_product_rows(path, file_format=None):
+    """Yield (product_id, name, description, price, quantity) tuples from a CSV or JSON-lines file."""
+    file_format = file_format or detect_format(path)
+
+    with open(path, newline='', encoding='utf-8') as file:
+        records = csv.DictReader(file) if file_format == 'csv' else (json.loads(line) for line in file
+                                                                       if line.strip())
+        for line_number, record in enumerate(records, 1):
+            try:
+                product_id = record.get('product_id')
+                yield (int(product_id) if product_id not in (None, '') else None,
+                       record['name'],
+                       record.get('description') or '',
+                       Decimal(str(record['price'])),
+                       int(record['quantity']))
+            except (KeyError, ValueError, ArithmeticError) as e:
+                raise ProductImportError(f'{path}: invalid product record {line_number}: {e}')
+
+
+@contextmanager
+def _connection(conn):
+    """Use the caller's connection, or check one out of the pool."""
+    if conn is not None:
+        yield conn
+        return
+
+    with pooled_connection() as conn:
+        if not conn:
+            raise ConnectionError('Error connecting to the database')
+        yield conn
+
+
+def read_checkpoint(path):
+    try:
+        with open(path + CHECKPOINT_SUFFIX) as file:
+            return int(file.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path, rows_done):
+    checkpoint = path + CHECKPOINT_SUFFIX
+    with open(checkpoint + '.tmp', 'w') as file:
+        file.write(str(rows_done))
+    os.replace(checkpoint + '.tmp', checkpoint)
+
+
+def import_products(path, file_format=None, chunk_size=IMPORT_CHUNK_SIZE, progress=None, resume=True,
+                    conn=None):
+    """Import products from a file, returning the number of rows imported by this call.
+
+    Each chunk is committed on its own. progress(rows_done) is called after every
+    committed chunk. With resume, rows already committed by an earlier, interrupted
+    run of the same file are skipped.
+    """
+    start = read_checkpoint(path) if resume else 0
+    if start:
+        logging.info(f'Resuming import of {path} after {start} rows')
+
+    rows_done = start
+    chunk = []
+    with _connection(conn) as conn:
+        for index, row in enumerate(read_product_rows(path, file_format)):
+            if index < start:
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                rows_done += _import_chunk(conn, chunk)
+                chunk = []
+                write_checkpoint(path, rows_done)
+                if progress:
+                    progress(rows_done)
+
+        if chunk:
+            rows_done += _import_chunk(conn, chunk)
+            if progress:
+                progress(rows_done)
+
+    # The whole file is in; a later import of it should start from scratch
+    try:
+        os.remove(path + CHECKPOINT_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+    logging.info(f'Imported {rows_done - start} products from {path}')
+    return rows_done - start
+
+
+def _import_chunk(conn, rows):
+    # An upsert may only touch each product once, so the last record for an ID wins
+    last_by_id = {row[0]: row for row in rows if row[0] is not None}
+    unique_rows = [row for row in rows if row[0] is None or last_by_id[row[0]] is row]
+
+    if not get_backend().supports_copy:
+        return _import_chunk_rows(conn, unique_rows, len(rows))
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in unique_rows:
+        writer.writerow(['' if value is None else value for value in row])
+    buffer.seek(0)
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute(CREATE_STAGING_TABLE)
+        cursor.copy_expert(f"COPY product_import_staging ({', '.join(IMPORT_COLUMNS)}) "
+                           f"FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(UPSERT_FROM_STAGING)
+        changed = cursor.fetchall()
+        cursor.execute(CLEAR_TOMBSTONES, ([product_id for product_id, _ in changed],))
+        cursor.execute(SYNC_PRODUCT_ID_SEQUENCE)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    get_history_writer().log_inventory_changes(changed)
+    return len(rows)
+
+
+def _import_chunk_rows(conn, rows, row_count):
+    try:
+        cursor = conn.cursor()
+        changed = []
+        for row in rows:
+            cursor.execute(SQLITE_UPSERT_PRODUCT, row)
+            changed.extend(cursor.fetchall())
+        cursor.execute(SQLITE_CLEAR_TOMBSTONES, (json.dumps([product_id for product_id, _ in changed]),))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    get_history_writer().log_inventory_changes(changed)
+    return row_count
+
+
+def export_products(path, file_format=None, batch_size=EXPORT_BATCH_SIZE, progress=None, conn=None):
+    """Stream every product to a CSV or JSON-lines file, returning the number of rows written."""
+    file_format = file_format or detect_format(path)
+    rows_done = 0
+
+    with _connection(conn) as conn:
+        # A named cursor keeps the result set on the server and fetches it batch by batch
+        cursor = conn.cursor(name='product_export')
+        cursor.itersize = batch_size
+        cursor.execute(f"SELECT {', '.join(IMPORT_COLUMNS)} FROM products ORDER BY product_id")
+
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file) if file_format == 'csv' else None
+            if writer:
+                writer.writerow(IMPORT_COLUMNS)
+
+            for row in cursor:
+                if writer:
+                    writer.writerow(row)
+                else:
+                    record = dict(zip(IMPORT_COLUMNS, row))
+                    record['price'] = str(record['price'])
+                    file.write(json.dumps(record) + '\n')
+
+                rows_done += 1
+                if progress and rows_done % batch_size == 0:
+                    progress(rows_done)
+
+        cursor.close()
+
+    if progress:
+        progress(rows_done)
+    logging.info(f'Exported {rows_done} products to {path}')
+    return rows_done
+
+
+def main(argv):
+    if len(argv) != 3 or argv[1] not in ('import', 'export'):
+        print(__doc__.strip().splitlines()[-1])
+        return 2
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    report = lambda rows_done: print(f'{rows_done} products', flush=True)
+    if argv[1] == 'import':
+        import_products(argv[2], progress=report)
+    else:
+        export_products(argv[2], progress=report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
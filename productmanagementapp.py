@@ -1,122 +1,249 @@
 import logging
-from datetime import datetime
 
 from PyQt5.QtCore import QTimer, pyqtSignal
 from PyQt5.QtWidgets import (
-    QWidget, QTableWidget, QPushButton, QVBoxLayout, QTableWidgetItem,
-    QInputDialog, QMessageBox
+    QWidget, QPushButton, QVBoxLayout, QLineEdit, QLabel,
+    QInputDialog, QMessageBox, QFileDialog
 )
 
-from database import create_connection, close_connection
+from changenotifier import get_change_notifier, get_journal_notifier
+from inventoryservice import JOURNAL_SALE, get_inventory_service
+from localreplica import get_local_replica
 from product import Product
+from productcatalog import ProductCatalog
+from productimport import import_products, export_products
+from tablemodels import RecordTableModel, create_record_view, selected_source_row
+from worker import DatabaseWorker
 
 
 # from supplier_management_dialog import SupplierManagementDialog
 
+# Do a full reload every this many incremental refreshes as a safety net
+FULL_RELOAD_INTERVAL = 12
+
+# Low stock checks run this long after the first change in a burst
+LOW_STOCK_DEBOUNCE_INTERVAL = 2000  # 2 seconds
+
+# At most this many products are listed in the low stock notification
+LOW_STOCK_NOTIFICATION_ITEMS = 20
+
+# Products are refreshed when the database reports a change; this slow poll only
+# covers notifications lost while the listener was reconnecting
+FALLBACK_REFRESH_INTERVAL = 300000  # 5 minutes
+
+
 class ProductManagementApp(QWidget):
+    product_deleted = pyqtSignal(int)
+    transfer_progress = pyqtSignal(str)  # Emitted from worker threads during import/export
+
     def __init__(self):
         super().__init__()
 
-        self.products = []
-        log_file_path = 'app.log'
-        logging.basicConfig(filename=log_file_path, level=logging.INFO,
-                            format='%(asctime)s - %(levelname)s - %(message)s')
-
-        # Create and set up the UI components
-        self.product_table = QTableWidget(self)
-        self.product_table.setColumnCount(5)
-        self.product_table.setHorizontalHeaderLabels(['ID', 'Name', 'Description', 'Price', 'Quantity'])
+        self.change_watermark = None  # Watermark of the last product_changes applied, None before the first load
+        self.refreshes_since_full_reload = 0
+        self.worker = DatabaseWorker(self)
+        self.service = get_inventory_service()
+        self.replica = get_local_replica()
+
+        # Create and set up the UI components; the view only renders the visible rows
+        self.catalog = ProductCatalog()
+        self.product_model = RecordTableModel([
+            ('ID', lambda product: product.product_id),
+            ('Name', lambda product: product.name),
+            ('Description', lambda product: product.description),
+            ('Price', lambda product: product.price),
+            ('Quantity', lambda product: product.quantity),
+        ], store=self.catalog, parent=self)
+        self.product_table, self.product_proxy = create_record_view(self.product_model, self)
+
+        self.filter_input = QLineEdit(self)
+        self.filter_input.setPlaceholderText('Filter products...')
+        self.filter_input.textChanged.connect(self.product_proxy.setFilterFixedString)
 
         self.add_button = QPushButton('Add Product', self)
         self.edit_button = QPushButton('Edit Product', self)
         self.delete_button = QPushButton('Delete Product', self)
         self.sell_button = QPushButton('Sell Product', self)
+        self.import_button = QPushButton('Import Products...', self)
+        self.export_button = QPushButton('Export Products...', self)
+        self.transfer_status_label = QLabel(self)
+        self.transfer_status_label.hide()
+        self.offline_label = QLabel('Offline: sales are saved on this terminal and sent once the database is back.',
+                                    self)
+        self.offline_label.hide()
 
         # Connect buttons to their respective functions
         self.add_button.clicked.connect(self.add_product_dialog)
         self.edit_button.clicked.connect(self.edit_product)
         self.delete_button.clicked.connect(self.delete_product_dialog)
         self.sell_button.clicked.connect(self.sell_product_dialog)
+        self.import_button.clicked.connect(self.import_products_dialog)
+        self.export_button.clicked.connect(self.export_products_dialog)
+        self.transfer_progress.connect(self.transfer_status_label.setText)
 
         # Set up the layout
         layout = QVBoxLayout(self)
+        layout.addWidget(self.filter_input)
         layout.addWidget(self.product_table)
         layout.addWidget(self.add_button)
         layout.addWidget(self.edit_button)
         layout.addWidget(self.delete_button)
         layout.addWidget(self.sell_button)
-
-        # Load initial products from the database
+        layout.addWidget(self.import_button)
+        layout.addWidget(self.export_button)
+        layout.addWidget(self.transfer_status_label)
+        layout.addWidget(self.offline_label)
+
+        # Low stock checks are batched and debounced
+        self.low_stock_message = None
+        self.low_stock_timer = QTimer(self)
+        self.low_stock_timer.setSingleShot(True)
+        self.low_stock_timer.timeout.connect(self.restock_low_stock_products)
+
+        # Show the last catalog snapshot straight away, then load what changed since it was taken
+        self.show_local_catalog()
         self.load_products()
 
-        # Set up a timer for real-time updates (adjust interval as needed)
+        # Sales and stock changes are journaled locally and replayed to the database in the background
+        self.journal_notifier = get_journal_notifier()
+        self.journal_notifier.journal_replayed.connect(self.on_journal_replayed)
+        self.journal_notifier.connectivity_changed.connect(self.on_connectivity_changed)
+
+        # Refresh whenever products change on any terminal
+        get_change_notifier().products_changed.connect(self.load_products)
+
+        # Fallback timer in case change notifications are missed
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.load_products)
-        self.timer.start(10000)  # Update every 10 seconds (for example)
-        product_deleted = pyqtSignal(int)
+        self.timer.start(FALLBACK_REFRESH_INTERVAL)
+
+    @property
+    def products(self):
+        """The loaded products, in model order."""
+        return self.product_model.rows
 
     def get_product_by_id(self, product_id):
         """Get product information by product ID."""
-        for product in self.products:
-            if product.product_id == product_id:
-                return product
-        return None
-    def load_products(self):
-        """Load products from the database and populate the table."""
-        try:
-            conn = create_connection()
-            if not conn:
-                logging.error('Error connecting to the database')
-                return
+        return self.catalog.get(product_id)
 
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM products")
-                rows = cursor.fetchall()
-
-                self.products = [Product(*row) for row in rows]
-                self.update_product_table()
-
-                self.check_low_stock_levels()
-                logging.info('Products loaded successfully')
-
-            except Exception as e:
-                logging.error(f"Error executing query to load products: {e}")
+    def selected_product(self):
+        """Return the product selected in the table, or None."""
+        row = selected_source_row(self.product_table, self.product_proxy)
+        return self.products[row] if 0 <= row < len(self.products) else None
 
+    def show_local_catalog(self):
+        """Show the products saved by the last load, with this terminal's unreplayed sales applied."""
+        try:
+            rows, watermark = self.replica.load_catalog()
         except Exception as er:
-            logging.error(f'Error loading products: {er}')
-
-        finally:
-            close_connection(conn)
+            logging.error(f'Error reading the local catalog snapshot: {er}')
+            return
 
-    def check_low_stock_levels(self):
-        """Check for low stock levels and display alerts."""
-        low_stock_threshold = 10
+        if rows:
+            self.product_model.set_rows([Product(*row) for row in rows])
+            self.change_watermark = watermark
 
+    def load_products(self):
+        """Fetch products changed since the last refresh in the background and patch them in."""
+        if self.refreshes_since_full_reload >= FULL_RELOAD_INTERVAL:
+            self.change_watermark = None
+
+        # Change notifications that arrive while a load is still running are coalesced into one reload
+        self.worker.submit('load_products', self.fetch_product_changes, self.change_watermark,
+                           on_result=self.on_products_loaded, on_error=self.on_products_load_failed)
+
+    def fetch_product_changes(self, conn, watermark):
+        # Runs on a worker thread: save the changes to the local snapshot and show the
+        # quantities this terminal's unreplayed sales leave
+        generation = self.replica.replay_generation
+        changes = self.service.product_changes(conn, watermark)
+        changes.rows = self.replica.save_changes(changes, generation)
+        return changes
+
+    def on_products_loaded(self, changes):
         try:
-            for product in self.products:
-                if product.quantity < low_stock_threshold:
-                    QMessageBox.warning(self, 'Low Stock Alert',
-                                        f"Low stock level for {product.name}. Current quantity: {product.quantity}",
-                                        QMessageBox.Ok)
-                    self.create_order(product)
-
-            logging.info('Low stock levels checked successfully')
-        except Exception as e:
-            logging.error(f'Error checking low stock levels: {e}')
+            if changes.is_full_load:
+                self.product_model.set_rows([Product(*row) for row in changes.rows])
+                changed_products = self.products
+                self.refreshes_since_full_reload = 0
+            else:
+                changed_products = self.apply_product_changes(changes.rows, changes.deleted_ids)
+                self.refreshes_since_full_reload += 1
 
+            self.change_watermark = max(changes.watermark, self.change_watermark or 0)
 
+            # Only products that changed can have newly dropped below the threshold
+            self.check_low_stock_levels(None if changes.is_full_load else changed_products)
+            if changes.is_full_load or changed_products or changes.deleted_ids:
+                logging.info(f'Products loaded successfully ({len(changed_products)} changed, '
+                             f'{len(changes.deleted_ids)} deleted)', extra={'rate_limit': True})
 
-    def update_product_table(self):
-        """Update the product table with the current products."""
-        self.product_table.setRowCount(len(self.products))
+        except Exception as er:
+            logging.error(f'Error loading products: {er}')
 
-        for row, product in enumerate(self.products):
-            self.product_table.setItem(row, 0, QTableWidgetItem(str(product.product_id)))
-            self.product_table.setItem(row, 1, QTableWidgetItem(product.name))
-            self.product_table.setItem(row, 2, QTableWidgetItem(product.description))
-            self.product_table.setItem(row, 3, QTableWidgetItem(str(product.price)))
-            self.product_table.setItem(row, 4, QTableWidgetItem(str(product.quantity)))
+    def apply_product_changes(self, rows, deleted_ids):
+        """Patch changed and deleted products into the catalog and table in place."""
+        # Deletions first: rows come from the current products table, so a product that was
+        # deleted and then added again under the same ID must end up present
+        self.product_model.remove_keys(deleted_ids)
+        changed_positions, new_rows = self.catalog.patch(rows)
+
+        # Repaints just the changed rows, and only if they are visible
+        for position in changed_positions:
+            self.product_model.row_changed(position)
+
+        changed_products = [self.products[position] for position in changed_positions]
+
+        new_products = [Product(*row) for row in new_rows]
+        self.product_model.append_rows(new_products)
+
+        return changed_products + new_products
+
+    def on_products_load_failed(self, error):
+        logging.error(f"Error executing query to load products: {error}")
+
+    def check_low_stock_levels(self, products=None):
+        """Schedule a low stock check after products changed.
+
+        Checks are debounced so a burst of changes leads to one indexed query and one
+        batched restock for every low product, followed by a single notification.
+        """
+        if products is not None and not products:
+            return
+        if not self.low_stock_timer.isActive():
+            self.low_stock_timer.start(LOW_STOCK_DEBOUNCE_INTERVAL)
+
+    def restock_low_stock_products(self):
+        self.worker.submit('restock_low_stock', self.service.restock_low_stock,
+                           on_result=self.on_low_stock_restocked,
+                           on_error=lambda error: logging.error(f'Error checking low stock levels: {error}'))
+
+    def on_low_stock_restocked(self, restocks):
+        if not restocks:
+            return
+
+        for restock in restocks:
+            product = self.get_product_by_id(restock.product_id)
+            if product and self.catalog.update(product, product.name, product.description, product.price,
+                                               restock.new_quantity):
+                self.product_model.row_changed(self.catalog.position(restock.product_id))
+
+            logging.info(f'Sales order created for "{restock.name}" - Quantity: {restock.restock_quantity}, '
+                         f'Total: {restock.total}')
+
+        lines = [f'{restock.name}: +{restock.restock_quantity} (now {restock.new_quantity})'
+                 for restock in restocks[:LOW_STOCK_NOTIFICATION_ITEMS]]
+        if len(restocks) > LOW_STOCK_NOTIFICATION_ITEMS:
+            lines.append(f'... and {len(restocks) - LOW_STOCK_NOTIFICATION_ITEMS} more')
+        self.show_low_stock_notification(f'Restocked {len(restocks)} low stock products:\n' + '\n'.join(lines))
+
+    def show_low_stock_notification(self, text):
+        """Show one non-blocking low stock message, replacing the previous one if it is still open."""
+        if self.low_stock_message is None:
+            self.low_stock_message = QMessageBox(QMessageBox.Warning, 'Low Stock Alert', '', QMessageBox.Ok, self)
+            self.low_stock_message.setModal(False)
+        self.low_stock_message.setText(text)
+        self.low_stock_message.show()
 
     def add_product_dialog(self):
         """Show a dialog to add a new product."""
@@ -130,295 +257,205 @@ class ProductManagementApp(QWidget):
 
     def add_product(self, name, description, price, quantity):
         """Add a new product to the database."""
-        try:
-            conn = create_connection()
-            if not conn:
-                logging.error('Error connecting to the database')
-                return
-
-            try:
-                cursor = conn.cursor()
-                cursor.execute("INSERT INTO products (name, description, price, quantity) VALUES (%s, %s, %s, %s)",
-                               (name, description, price, quantity))
-                conn.commit()
-                logging.info('Product added successfully')
-
-                # Reload products after adding a new one
-                self.load_products()
-
-            except Exception as e:
-                logging.error(f"Error adding product: {e}")
-
-            finally:
-                close_connection(conn)
-                # Log inventory changes
-                product_id = self.get_last_product_id()
-                self.log_inventory_change(product_id, quantity)
+        self.worker.submit(None, self.service.add_product, name, description, price, quantity,
+                           on_result=lambda _: self.on_product_saved('Product added successfully'),
+                           on_error=lambda error: logging.error(f"Error adding product: {error}"))
 
-        except Exception as er:
-            logging.error(f'Error adding product: {er}')
+    def on_product_saved(self, message):
+        logging.info(message)
+
+        # Reload products after the change
+        self.load_products()
 
     def edit_product(self):
         """Edit the selected product."""
-        selected_row = self.product_table.currentRow()
-
-        if 0 <= selected_row < len(self.products):
-            selected_product = self.products[selected_row]
-
-            name, ok_name = QInputDialog.getText(self, 'Edit Product', 'Edit product name:', text=selected_product.name)
-            description, ok_desc = QInputDialog.getText(self, 'Edit Product', 'Edit product description:',
-                                                        text=selected_product.description)
-            price, ok_price = QInputDialog.getDouble(self, 'Edit Product', 'Edit product price:',
-                                                     value=selected_product.price)
-            quantity, ok_quantity = QInputDialog.getInt(self, 'Edit Product', 'Edit product quantity:',
-                                                        value=selected_product.quantity)
+        selected_product = self.selected_product()
+        if not selected_product:
+            return
+
+        name, ok_name = QInputDialog.getText(self, 'Edit Product', 'Edit product name:', text=selected_product.name)
+        description, ok_desc = QInputDialog.getText(self, 'Edit Product', 'Edit product description:',
+                                                    text=selected_product.description)
+        price, ok_price = QInputDialog.getDouble(self, 'Edit Product', 'Edit product price:',
+                                                 value=selected_product.price)
+        quantity, ok_quantity = QInputDialog.getInt(self, 'Edit Product', 'Edit product quantity:',
+                                                    value=selected_product.quantity)
 
-            if ok_name and ok_desc and ok_price and ok_quantity:
-                self.update_product(selected_product.product_id, name, description, price, quantity)
+        if ok_name and ok_desc and ok_price and ok_quantity:
+            self.update_product(selected_product.product_id, name, description, price, quantity)
 
     def update_product(self, product_id, name, description, price, quantity):
         """Update an existing product in the database."""
+        product = self.get_product_by_id(product_id)
+        if product and (name, description, round(price, 2)) == (product.name, product.description,
+                                                                round(float(product.price), 2)):
+            # Only the stock level changed; journal it like a sale so it also works offline
+            self.set_local_stock(product, quantity)
+            return
+
+        self.worker.submit(None, self.service.update_product, product_id, name, description, price, quantity,
+                           on_result=lambda _: self.on_product_saved('Product updated successfully'),
+                           on_error=lambda error: self.on_product_update_failed(product, quantity, error))
+
+    def on_product_update_failed(self, product, quantity, error):
+        logging.error(f"Error updating product: {error}")
+        if product and quantity != product.quantity:
+            # The database is likely unreachable; keep the stock level on this terminal until it is back
+            self.set_local_stock(product, quantity)
+            QMessageBox.warning(self, 'Product Not Updated',
+                                f'The name, description and price of {product.name} could not be saved. '
+                                f'The new stock level was kept on this terminal and will be sent to the database '
+                                f'once it is reachable.', QMessageBox.Ok)
+
+    def set_local_stock(self, product, quantity):
+        """Set a product's stock on this terminal, journaling the change for the database."""
         try:
-            conn = create_connection()
-            if not conn:
-                logging.error('Error connecting to the database')
-                return
-
-            try:
-                cursor = conn.cursor()
-                cursor.execute("UPDATE products SET name=%s, description=%s, price=%s, quantity=%s WHERE product_id=%s",
-                               (name, description, price, quantity, product_id))
-                conn.commit()
-                logging.info('Product updated successfully')
-
-                # Reload products after updating
-                self.load_products()
-
-            except Exception as e:
-                logging.error(f"Error updating product: {e}")
-
-            finally:
-                close_connection(conn)
-                # Log inventory changes
-                self.log_inventory_change(product_id, quantity)
-
+            self.replica.record_stock_change(product.product_id, quantity)
         except Exception as er:
-            logging.error(f'Error updating product: {er}')
+            logging.error(f"Error updating stock quantity: {er}")
+            return
+
+        self.journal_notifier.wake()
+        logging.info(f'Stock quantity for "{product.name}" set to {quantity} on this terminal')
+        self.show_local_quantity(product, quantity)
 
     def delete_product_dialog(self):
         """Show a dialog to confirm product deletion."""
-        selected_row = self.product_table.currentRow()
+        selected_product = self.selected_product()
+        if not selected_product:
+            return
 
-        if 0 <= selected_row < len(self.products):
-            selected_product = self.products[selected_row]
+        # Create a confirmation dialog
+        reply = QMessageBox.question(self, 'Delete Product',
+                                     f"Do you want to delete the product:\n{selected_product.name}?",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
 
-            # Create a confirmation dialog
-            reply = QMessageBox.question(self, 'Delete Product',
-                                         f"Do you want to delete the product:\n{selected_product.name}?",
-                                         QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
-
-            if reply == QMessageBox.Yes:
-                self.delete_product(selected_product.product_id)
+        if reply == QMessageBox.Yes:
+            self.delete_product(selected_product.product_id)
 
     def delete_product(self, product_id):
         """Delete a product from the database."""
-        try:
-            conn = create_connection()
-            if not conn:
-                logging.error('Error connecting to the database')
-                return
+        # Retrieve product information before deletion for logging purposes
+        product = self.get_product_by_id(product_id)
+        if not product:
+            logging.error(f'Cannot delete unknown product ID {product_id}')
+            return
 
-            # Retrieve product information before deletion for logging purposes
-            product = self.get_product_by_id(product_id)
+        self.worker.submit(None, self.service.delete_product, product_id,
+                           on_result=lambda _: self.on_product_deleted(product),
+                           on_error=lambda error: logging.error(f"Error deleting product: {error}"))
 
-            try:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM products WHERE product_id=%s", (product_id,))
-                cursor.execute("DELETE FROM inventory_history WHERE product_id=%s", (product_id,))
-                conn.commit()
-                logging.info(f'Product "{product.name}" (ID: {product_id}) deleted successfully')
+    def on_product_deleted(self, product):
+        logging.info(f'Product "{product.name}" (ID: {product.product_id}) deleted successfully')
 
-                # Emit signal for product deletion
-                self.product_deleted.emit(product_id)
+        # Emit signal for product deletion
+        self.product_deleted.emit(product.product_id)
 
-            except Exception as e:
-                logging.error(f"Error deleting product: {e}")
-
-            finally:
-                close_connection(conn)
-
-                # Log inventory changes only if the product existed before deletion
-                if product:
-                    self.log_inventory_change(product_id, 0)
-
-        except Exception as er:
-            logging.error(f'Error deleting product: {er}')
+        self.load_products()
 
     def sell_product_dialog(self):
         """Show a dialog to sell a product."""
-        selected_row = self.product_table.currentRow()
-
-        if 0 <= selected_row < len(self.products):
-            selected_product = self.products[selected_row]
+        selected_product = self.selected_product()
+        if not selected_product:
+            return
 
-            quantity, ok_quantity = QInputDialog.getInt(self, 'Sell Product', 'Enter quantity to sell:',
-                                                        value=1, min=1, max=selected_product.quantity)
+        quantity, ok_quantity = QInputDialog.getInt(self, 'Sell Product', 'Enter quantity to sell:',
+                                                    value=1, min=1, max=selected_product.quantity)
 
-            if ok_quantity:
-                self.sell_product(selected_product.product_id, selected_product.name, quantity)
+        if ok_quantity:
+            self.sell_product(selected_product.product_id, selected_product.name, quantity)
 
     def sell_product(self, product_id, product_name, quantity):
-        """Sell a product and update the stock."""
+        """Sell a product from this terminal's stock, journaling the sale for the database."""
+        product = self.get_product_by_id(product_id)
+        if not product:
+            logging.error(f'Cannot sell unknown product ID {product_id}')
+            return
+
+        # The sale is on disk once this returns, whether or not the database is reachable;
+        # the database still decides when it is replayed, so terminals never oversell
         try:
-            conn = create_connection()
-            if not conn:
-                logging.error('Error connecting to the database')
-                return
-
-            try:
-                cursor = conn.cursor()
-
-                # Check if the available stock is sufficient
-                selected_product = next((p for p in self.products if p.product_id == product_id), None)
-                if selected_product and selected_product.quantity >= quantity:
-                    # Update the stock in the database
-                    new_quantity = selected_product.quantity - quantity
-                    cursor.execute("UPDATE products SET quantity=%s WHERE product_id=%s",
-                                   (new_quantity, product_id))
-
-                    # Commit the transaction to the database
-                    conn.commit()
-
-                    # Log inventory changes
-                    self.log_inventory_change(product_id, new_quantity)
-
-                    # Log the sale in the sales history
-                    total = selected_product.price * quantity
-                    self.log_sales_order(product_name, quantity, total, 'sold')
-
-                    logging.info(f'Product "{product_name}" sold successfully. Quantity: {quantity}')
-
-                    # Check if the stock is low and create a sales order if needed
-                    if new_quantity < 10:  # Adjust as needed
-                        self.create_sales_order(selected_product, 10)  # You can adjust the quantity as needed
-
-                    # Reload products after selling
-                    self.load_products()
-
-                else:
-                    QMessageBox.warning(self, 'Insufficient Stock',
-                                        f"Insufficient stock for {product_name}. Available quantity: {selected_product.quantity}",
-                                        QMessageBox.Ok)
-
-            except Exception as e:
-                logging.error(f"Error selling product: {e}")
-
-            finally:
-                close_connection(conn)
-
+            new_quantity = self.replica.record_sale(product_id, quantity)
         except Exception as er:
-            logging.error(f'Error selling product: {er}')
-
-
-
-
-    def log_inventory_change(self, product_id, new_quantity):
-        """Log inventory changes."""
-        conn = create_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-
-                # Get the current date and time
-                timestamp = datetime.now()
-
-                # Insert a record into the inventory_history table
-                cursor.execute(
-                    "INSERT INTO inventory_history (product_id, timestamp, new_quantity) VALUES (%s, %s, %s)",
-                    (product_id, timestamp, new_quantity))
-
-                conn.commit()
-                print("Inventory change logged successfully.")
-            except Exception as e:
-                print(f"Error logging inventory change: {e}")
-            finally:
-                close_connection(conn)
-
-    def get_last_product_id(self):
-        """Get the last product_id from the products table."""
-        conn = create_connection()
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT MAX(product_id) FROM products")
-                last_product_id = cursor.fetchone()[0]
-                return last_product_id if last_product_id is not None else 0
-            except Exception as e:
-                print(f"Error getting last product_id: {e}")
-            finally:
-                close_connection(conn)
-        return 0
-
-    def create_order(self, product):
-        """Create a sales order for a product if the stock level is low."""
-        low_stock_threshold = 10  # Adjust as needed
-
-        if product.quantity < low_stock_threshold:
-            # Calculate the quantity needed to reach the threshold
-            quantity_needed = 10
-
-            # Suggested quantity to order is the quantity needed
-            quantity_to_order = quantity_needed
-
-            if quantity_to_order > 0:
-                # Create a sales order and update the stock
-                total = product.price * quantity_to_order
-                #self.log_sales_order(product.name, quantity_to_order, total, 'ordered')
-
-                # Update stock in the database
-                new_quantity = product.quantity + quantity_to_order
-                self.update_stock_in_database(product.product_id, new_quantity)
-
-                logging.info(f'Sales order created for "{product.name}" - Quantity: {quantity_to_order}, Total: {total}')
-
-                # Reload products after creating the sales order
-                self.load_products()
-
-                QMessageBox.information(self, 'Sales Order Created',
-                                        f'Sales order created for {product.name}. Quantity: {quantity_to_order}, Total: {total}',
-                                        QMessageBox.Ok)
+            logging.error(f"Error selling product: {er}")
+            return
+
+        if new_quantity is None:
+            QMessageBox.warning(self, 'Insufficient Stock',
+                                f"Insufficient stock for {product_name}. Available quantity: {product.quantity}",
+                                QMessageBox.Ok)
+            return
+
+        self.journal_notifier.wake()
+        logging.info(f'Product "{product_name}" sold on this terminal. Quantity: {quantity}')
+        self.show_local_quantity(product, new_quantity)
+
+    def show_local_quantity(self, product, quantity):
+        if self.catalog.update(product, product.name, product.description, product.price, quantity):
+            self.product_model.row_changed(self.catalog.position(product.product_id))
+            self.check_low_stock_levels([product])
+
+    def on_journal_replayed(self, results):
+        """Report the outcome of journaled sales and stock changes once the database applied them."""
+        rejected = []
+        for entry, result in results:
+            product = self.get_product_by_id(entry.product_id)
+            name = product.name if product else f'product ID {entry.product_id}'
+            if entry.kind != JOURNAL_SALE:
+                if result:
+                    logging.info(f'Stock quantity for product ID {entry.product_id} updated to {entry.quantity}')
+                else:
+                    logging.error(f'Stock change for unknown product ID {entry.product_id} was not applied')
+            elif result is None:
+                logging.warning(f'Sale of {entry.quantity} "{name}" from {entry.created_at} rejected: '
+                                f'insufficient stock')
+                rejected.append(f'{name}: {entry.quantity} (sold {entry.created_at})')
             else:
-                QMessageBox.warning(self, 'Insufficient Stock',
-                                    f"Insufficient stock for {product.name}. Suggested quantity is 0.",
-                                    QMessageBox.Ok)
-        else:
-            QMessageBox.information(self, 'No Sales Order Needed',
-                                    f"No sales order needed for {product.name}. Stock level is sufficient.",
-                                    QMessageBox.Ok)
-
-    def update_stock_in_database(self, product_id, new_quantity):
-        """Update stock quantity in the database."""
-        try:
-            conn = create_connection()
-            if not conn:
-                logging.error('Error connecting to the database')
-                return
-
-            try:
-                cursor = conn.cursor()
-                cursor.execute("UPDATE products SET quantity=%s WHERE product_id=%s",
-                               (new_quantity, product_id))
-                conn.commit()
-                logging.info(f'Stock quantity for product ID {product_id} updated to {new_quantity}')
-
-            except Exception as e:
-                logging.error(f"Error updating stock quantity in the database: {e}")
-
-            finally:
-                close_connection(conn)
-
-        except Exception as er:
-            logging.error(f'Error updating stock quantity in the database: {er}')
-
-
-
+                logging.info(f'Product "{name}" sold successfully. Quantity: {entry.quantity}, Total: {result.total}')
+
+        if rejected:
+            # Another terminal sold the stock first; show the quantities that are really left
+            QMessageBox.warning(self, 'Sales Rejected',
+                                'These sales could not be completed because the stock had already been sold:\n'
+                                + '\n'.join(rejected[:LOW_STOCK_NOTIFICATION_ITEMS]), QMessageBox.Ok)
+            self.load_products()
+
+    def on_connectivity_changed(self, is_online):
+        self.offline_label.setVisible(not is_online)
+        if is_online:
+            self.load_products()
+
+    def import_products_dialog(self):
+        """Import products from a CSV or JSON-lines file in the background."""
+        path, _ = QFileDialog.getOpenFileName(self, 'Import Products', '',
+                                              'Product files (*.csv *.jsonl *.json);;All files (*)')
+        if path:
+            self.start_transfer('import', import_products, path, 'Imported')
+
+    def export_products_dialog(self):
+        """Export every product to a CSV or JSON-lines file in the background."""
+        path, _ = QFileDialog.getSaveFileName(self, 'Export Products', 'products.csv',
+                                              'CSV files (*.csv);;JSON lines (*.jsonl)')
+        if path:
+            self.start_transfer('export', export_products, path, 'Exported')
+
+    def start_transfer(self, key, transfer, path, verb):
+        self.import_button.setEnabled(False)
+        self.export_button.setEnabled(False)
+        self.transfer_status_label.setText(f'{verb} 0 products...')
+        self.transfer_status_label.show()
+
+        def run(conn):
+            progress = lambda rows_done: self.transfer_progress.emit(f'{verb} {rows_done} products...')
+            return transfer(path, progress=progress, conn=conn)
+
+        self.worker.submit(key, run,
+                           on_result=lambda rows_done: self.on_transfer_finished(f'{verb} {rows_done} products.'),
+                           on_error=lambda error: self.on_transfer_finished(f'{key.capitalize()} failed: {error}'))
+
+    def on_transfer_finished(self, message):
+        logging.info(message)
+        self.import_button.setEnabled(True)
+        self.export_button.setEnabled(True)
+        self.transfer_status_label.hide()
+        QMessageBox.information(self, 'Products', message, QMessageBox.Ok)
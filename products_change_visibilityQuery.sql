@@ -0,0 +1,35 @@
+-- Visibility-bounded incremental product refresh (PostgreSQL 13 or later).
+-- change_seq values are taken before their transaction commits, so a transaction that
+-- commits late can stamp rows below a watermark a client has already read past. Rows
+-- and tombstones are also stamped with the ID of the transaction that changed them;
+-- a client remembers the oldest transaction still running when it read (the xmin of
+-- its snapshot) and next time reads every row stamped at or above it, which covers
+-- every change its earlier read could not see, however long the writer ran.
+ALTER TABLE products
+ADD COLUMN change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+
+CREATE INDEX products_change_xid_idx ON products (change_xid);
+
+ALTER TABLE product_tombstones
+ADD COLUMN change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+
+CREATE INDEX product_tombstones_change_xid_idx ON product_tombstones (change_xid);
+
+CREATE OR REPLACE FUNCTION products_stamp_change() RETURNS trigger AS $$
+BEGIN
+    NEW.change_seq := nextval('products_change_seq');
+    NEW.change_xid := pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION products_record_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO product_tombstones (product_id)
+    VALUES (OLD.product_id)
+    ON CONFLICT (product_id) DO UPDATE
+        SET change_seq = nextval('products_change_seq'), change_xid = pg_current_xact_id(),
+            deleted_at = CURRENT_TIMESTAMP;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,49 @@
+-- Change tracking for incremental product refresh.
+-- Every insert or update stamps the row with the next value of products_change_seq,
+-- and every delete leaves a tombstone stamped from the same sequence, so clients can
+-- fetch everything that changed since the highest change_seq they have seen.
+CREATE SEQUENCE products_change_seq;
+
+ALTER TABLE products
+ADD COLUMN change_seq BIGINT NOT NULL DEFAULT nextval('products_change_seq');
+
+CREATE INDEX products_change_seq_idx ON products (change_seq);
+
+CREATE TABLE product_tombstones (
+    product_id INT PRIMARY KEY,
+    change_seq BIGINT NOT NULL DEFAULT nextval('products_change_seq'),
+    deleted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX product_tombstones_change_seq_idx ON product_tombstones (change_seq);
+
+CREATE OR REPLACE FUNCTION products_stamp_change() RETURNS trigger AS $$
+BEGIN
+    NEW.change_seq := nextval('products_change_seq');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_stamp_change
+BEFORE UPDATE ON products
+FOR EACH ROW
+WHEN (OLD.* IS DISTINCT FROM NEW.*)
+EXECUTE FUNCTION products_stamp_change();
+
+CREATE OR REPLACE FUNCTION products_record_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO product_tombstones (product_id)
+    VALUES (OLD.product_id)
+    ON CONFLICT (product_id) DO UPDATE
+        SET change_seq = nextval('products_change_seq'), deleted_at = CURRENT_TIMESTAMP;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_record_tombstone
+AFTER DELETE ON products
+FOR EACH ROW
+EXECUTE FUNCTION products_record_tombstone();
+
+-- Tombstones only need to outlive the clients' refresh interval and may be pruned after
+-- that; clients periodically do a full reload, which also catches pruned deletions.
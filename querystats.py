@@ -0,0 +1,276 @@
+"""Per-statement query timings, kept in memory and exported for monitoring.
+
+database.py wraps every connection it opens so each statement reports its
+latency, row count and outcome here, keyed by its normalized SQL: literals and
+placeholders become ?, and multi-row VALUES lists and IN / ARRAY lists collapse
+to one entry, so the same statement with different parameters (or batch sizes)
+is counted once. Connection pool checkouts and database time spent on the GUI
+thread are tracked the same way.
+
+Latencies go into fixed histogram buckets, so recording is O(1) and the
+snapshot can be exported as a Prometheus text file without keeping samples.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+# Upper bounds of the latency histogram buckets, in seconds; the last bucket is unbounded
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SLOW_QUERY_LOG_SIZE = 50  # Most recent slow queries kept with their plans
+SLOW_QUERY_TEXT_LIMIT = 4000  # Characters of each slow query's text kept
+
+# Longer statements (e.g. multi-row VALUES with inline literals) are normalized without caching
+NORMALIZE_CACHE_MAX_LENGTH = 2000
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"(?<![\w$.:])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+LIST_NULL = re.compile(r"(?<=[(,])\s*NULL\b", re.IGNORECASE)
+PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|(?<!:):[A-Za-z_]\w*|\?")  # Not :: casts
+REPEATED_TUPLE = re.compile(r"(\([^()]*\))(?:\s*,\s*\1)+")
+VALUE_LIST = re.compile(r"(\bIN\s*\(|\[)\s*\?(?:\s*,\s*\?)*\s*(?=[)\]])", re.IGNORECASE)
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(query):
+    """Return the statement shape of a query, with its literals and parameters replaced by ?."""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    if len(query) <= NORMALIZE_CACHE_MAX_LENGTH:
+        return _normalize_cached(query)
+    return _normalize(query)
+
+
+@lru_cache(maxsize=1024)
+def _normalize_cached(query):
+    return _normalize(query)
+
+
+def _normalize(query):
+    query = STRING_LITERAL.sub('?', query)
+    query = NUMBER_LITERAL.sub('?', query)
+    query = LIST_NULL.sub('?', query)
+    query = PLACEHOLDER.sub('?', query)
+    query = WHITESPACE.sub(' ', query).strip()
+    query = REPEATED_TUPLE.sub(r'\1, ...', query)
+    return VALUE_LIST.sub(r'\1...', query)
+
+
+class LatencyHistogram:
+    __slots__ = ('bucket_counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        index = 0
+        while index < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[index]:
+            index += 1
+        self.bucket_counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (the maximum for the last bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(LATENCY_BUCKETS[index], self.max) if index < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'total_seconds': self.total, 'max_seconds': self.max,
+                'p50_seconds': self.quantile(0.5), 'p95_seconds': self.quantile(0.95),
+                'p99_seconds': self.quantile(0.99),
+                'buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                                    _cumulative(self.bucket_counts)))}
+
+
+class StatementStats:
+    __slots__ = ('statement', 'latency', 'rows', 'errors', 'gui_thread_seconds')
+
+    def __init__(self, statement):
+        self.statement = statement
+        self.latency = LatencyHistogram()
+        self.rows = 0
+        self.errors = 0
+        self.gui_thread_seconds = 0.0
+
+
+class SlowQuery:
+    __slots__ = ('statement', 'query', 'seconds', 'recorded_at', 'plan')
+
+    def __init__(self, statement, query, seconds, recorded_at, plan):
+        self.statement = statement
+        self.query = query
+        self.seconds = seconds
+        self.recorded_at = recorded_at
+        self.plan = plan
+
+
+class QueryStats:
+    """Thread-safe registry of statement, connection checkout and GUI-thread timings."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.statements = {}
+            self.acquire = LatencyHistogram()
+            self.acquire_failures = 0
+            self.gui_thread = LatencyHistogram()
+            self.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+            self.started_at = time.time()
+
+    def record_statement(self, statement, seconds, rows=0, failed=False, on_gui_thread=False):
+        with self._lock:
+            stats = self.statements.get(statement)
+            if stats is None:
+                stats = self.statements[statement] = StatementStats(statement)
+            stats.latency.observe(seconds)
+            stats.rows += rows
+            if failed:
+                stats.errors += 1
+            if on_gui_thread:
+                stats.gui_thread_seconds += seconds
+                self.gui_thread.observe(seconds)
+
+    def add_rows(self, statement, rows):
+        """Count rows fetched after the statement that produced them was recorded."""
+        with self._lock:
+            stats = self.statements.get(statement)
+            if stats is not None:
+                stats.rows += rows
+
+    def record_acquire(self, seconds, failed=False):
+        with self._lock:
+            self.acquire.observe(seconds)
+            if failed:
+                self.acquire_failures += 1
+
+    def record_slow_query(self, statement, query, seconds, plan):
+        with self._lock:
+            self.slow_queries.append(SlowQuery(statement, query[:SLOW_QUERY_TEXT_LIMIT], seconds, time.time(),
+                                               plan))
+
+    def snapshot(self):
+        """Return every statistic as plain JSON-serializable data."""
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'captured_at': time.time(),
+                'statements': [dict(statement=stats.statement, rows=stats.rows, errors=stats.errors,
+                                    gui_thread_seconds=stats.gui_thread_seconds, **stats.latency.to_dict())
+                               for stats in sorted(self.statements.values(), key=lambda stats: -stats.latency.total)],
+                'connection_acquire': dict(failures=self.acquire_failures, **self.acquire.to_dict()),
+                'gui_thread_blocking': self.gui_thread.to_dict(),
+                'slow_queries': [{'statement': slow.statement, 'query': slow.query, 'seconds': slow.seconds,
+                                  'recorded_at': slow.recorded_at, 'plan': slow.plan}
+                                 for slow in self.slow_queries],
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Render the statistics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = []
+            _histogram_lines(lines, 'ims_query_duration_seconds', 'Query latency per normalized statement.',
+                             [({'statement': stats.statement}, stats.latency) for stats in self.statements.values()])
+            _counter_lines(lines, 'ims_query_rows_total', 'Rows returned or affected per normalized statement.',
+                           [({'statement': stats.statement}, stats.rows) for stats in self.statements.values()])
+            _counter_lines(lines, 'ims_query_errors_total', 'Failed executions per normalized statement.',
+                           [({'statement': stats.statement}, stats.errors) for stats in self.statements.values()])
+            _histogram_lines(lines, 'ims_connection_acquire_seconds', 'Time to check out a pooled connection.',
+                             [({}, self.acquire)])
+            _counter_lines(lines, 'ims_connection_acquire_failures_total',
+                           'Connection checkouts that failed.', [({}, self.acquire_failures)])
+            _histogram_lines(lines, 'ims_gui_thread_query_seconds',
+                             'Database time spent on the GUI thread, blocking the event loop.',
+                             [({}, self.gui_thread)])
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path):
+        _write_atomically(path, self.to_json())
+
+    def write_prometheus(self, path):
+        """Write the Prometheus text file, e.g. for node_exporter's textfile collector."""
+        _write_atomically(path, self.to_prometheus())
+
+
+def _cumulative(counts):
+    total = 0
+    result = []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+def _labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _histogram_lines(lines, name, help_text, series):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for labels, histogram in series:
+        for bound, count in zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                                _cumulative(histogram.bucket_counts)):
+            lines.append(f'{name}_bucket{_labels(labels, le=bound)} {count}')
+        lines.append(f'{name}_sum{_labels(labels)} {histogram.total}')
+        lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+
+
+def _counter_lines(lines, name, help_text, series):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} counter')
+    for labels, value in series:
+        lines.append(f'{name}{_labels(labels)} {value}')
+
+
+def _write_atomically(path, text):
+    # Readers (e.g. a metrics collector) never see a half-written file
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.querystats-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(text)
+        os.replace(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+_stats = QueryStats()
+
+
+def get_query_stats():
+    """Return the process-wide query statistics."""
+    return _stats
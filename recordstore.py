@@ -0,0 +1,40 @@
+class RecordStore:
+    """List of records with an optional key -> position index.
+
+    RecordTableModel reads and mutates its records only through this interface,
+    so richer stores such as ProductCatalog can back a table directly.
+    """
+
+    def __init__(self, key=None):
+        self.key = key
+        self.records = []
+        self._positions = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def replace(self, records):
+        self.records = list(records)
+        self.reindex()
+
+    def extend(self, records):
+        first = len(self.records)
+        self.records.extend(records)
+        if self.key:
+            for position, record in enumerate(records, first):
+                self._positions[self.key(record)] = position
+
+    def pop(self, position):
+        """Remove a record; call reindex() once after a batch of pops."""
+        return self.records.pop(position)
+
+    def reindex(self):
+        if self.key:
+            self._positions = {self.key(record): position for position, record in enumerate(self.records)}
+
+    def position(self, key):
+        return self._positions.get(key)
+
+    def get(self, key):
+        position = self._positions.get(key)
+        return self.records[position] if position is not None else None
@@ -0,0 +1,28 @@
+-- Version counter for cached reports (see reportcache.py).
+-- Every statement that changes products or sales_history bumps the one row in the
+-- same transaction, so the new version becomes visible exactly when the change
+-- commits. Concurrent writers queue on the row lock, so versions advance in commit
+-- order and a report cached under one version never misses a change committed later.
+CREATE TABLE report_watermark (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL
+);
+
+INSERT INTO report_watermark (version) VALUES (0);
+
+CREATE OR REPLACE FUNCTION report_watermark_bump() RETURNS trigger AS $$
+BEGIN
+    UPDATE report_watermark SET version = version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_report_watermark
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON products
+FOR EACH STATEMENT
+EXECUTE FUNCTION report_watermark_bump();
+
+CREATE TRIGGER sales_history_report_watermark
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON sales_history
+FOR EACH STATEMENT
+EXECUTE FUNCTION report_watermark_bump();
@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from database import get_backend
+
+REPORT_CACHE_MAX_ENTRIES = 64
+REPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Reports are also kept here so they survive a restart, keyed by the database they were
+# computed from; None keeps them in memory only
+REPORT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ims', 'reports')
+
+# Every change to products or sales history bumps this counter in the same transaction
+# (see report_watermarkQuery.sql), so it moves exactly when a committed change could
+# alter a report, in commit order
+REPORT_WATERMARK_QUERY = "SELECT version FROM report_watermark"
+
+
+def report_watermark(conn):
+    cursor = conn.cursor()
+    cursor.execute(REPORT_WATERMARK_QUERY)
+    return cursor.fetchone()[0]
+
+
+def _size(value):
+    """Rough memory footprint of a report result."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes if value.dtype != object else value.size * 64
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class ReportCache:
+    """LRU cache of report results that stay valid until the report watermark moves.
+
+    Entries are keyed by database, report type and parameters and bounded by count and size.
+    With a cache directory, results are also pickled to disk and reused after a
+    restart as long as the watermark has not moved in the meantime.
+    """
+
+    def __init__(self, max_entries=REPORT_CACHE_MAX_ENTRIES, max_bytes=REPORT_CACHE_MAX_BYTES,
+                 cache_dir=REPORT_CACHE_DIR):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, conn, report_type, fn, *params):
+        """Return fn(conn, *params), reusing the cached result while the watermark is unchanged.
+
+        Meant to be run on a worker thread, e.g. worker.submit(key, cache.get, type, fn, ...).
+        """
+        key = (get_backend().identity, report_type, params)
+        watermark = report_watermark(conn)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == watermark:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        value = self._load(key, watermark)
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            value = fn(conn, *params)
+            self._save(key, watermark, value)
+
+        self._store(key, watermark, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _store(self, key, watermark, value):
+        size = _size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+
+            self._entries[key] = (watermark, value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.pickle')
+
+    def _load(self, key, watermark):
+        if not self.cache_dir:
+            return None
+
+        try:
+            with open(self._path(key), 'rb') as file:
+                cached_key, cached_watermark, value = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f'Error reading cached report {key[1]}: {e}')
+            return None
+
+        return value if cached_key == key and cached_watermark == watermark else None
+
+    def _save(self, key, watermark, value):
+        if not self.cache_dir:
+            return
+
+        path = self._path(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(path + '.tmp', 'wb') as file:
+                pickle.dump((key, watermark, value), file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+        except Exception as e:
+            logging.warning(f'Error writing cached report {key[1]}: {e}')
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_report_cache():
+    """Return the process-wide report cache."""
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = ReportCache()
+        return _cache
@@ -0,0 +1,55 @@
+-- Per-product, per-day sales totals maintained as sales are recorded.
+-- A statement-level trigger folds each batch of new sales_history rows into the
+-- rollup inside the same transaction, so reports read a few rows per product and
+-- day instead of scanning the whole history.
+CREATE TABLE sales_daily_rollup (
+    sales_date DATE NOT NULL,
+    product_name VARCHAR(255) NOT NULL,
+    quantity BIGINT NOT NULL DEFAULT 0,
+    total DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    order_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (sales_date, product_name)
+);
+
+CREATE INDEX sales_daily_rollup_product_idx ON sales_daily_rollup (product_name, sales_date);
+
+CREATE OR REPLACE FUNCTION sales_rollup_add() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO sales_daily_rollup AS rollup (sales_date, product_name, quantity, total, order_count)
+    SELECT timestamp::date, product_name, SUM(quantity), SUM(total), COUNT(*)
+    FROM new_sales
+    WHERE product_name IS NOT NULL
+    GROUP BY timestamp::date, product_name
+    ON CONFLICT (sales_date, product_name) DO UPDATE
+        SET quantity = rollup.quantity + EXCLUDED.quantity,
+            total = rollup.total + EXCLUDED.total,
+            order_count = rollup.order_count + EXCLUDED.order_count;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER sales_history_rollup
+AFTER INSERT ON sales_history
+REFERENCING NEW TABLE AS new_sales
+FOR EACH STATEMENT
+EXECUTE FUNCTION sales_rollup_add();
+
+-- Rebuilds the rollup from sales_history from a given day on (everything when NULL),
+-- to backfill existing history or repair the rollup after history was edited.
+CREATE OR REPLACE FUNCTION rebuild_sales_rollup(p_since DATE DEFAULT NULL) RETURNS void AS $$
+BEGIN
+    LOCK TABLE sales_daily_rollup IN EXCLUSIVE MODE;
+
+    DELETE FROM sales_daily_rollup
+    WHERE p_since IS NULL OR sales_date >= p_since;
+
+    INSERT INTO sales_daily_rollup (sales_date, product_name, quantity, total, order_count)
+    SELECT timestamp::date, product_name, SUM(quantity), SUM(total), COUNT(*)
+    FROM sales_history
+    WHERE product_name IS NOT NULL
+      AND (p_since IS NULL OR timestamp >= p_since)
+    GROUP BY timestamp::date, product_name;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT rebuild_sales_rollup();
@@ -1,7 +1,9 @@
 CREATE TABLE sales_history (
     order_id SERIAL PRIMARY KEY,
-    product VARCHAR(255) NOT NULL,
+    product_id INT,
+    product_name VARCHAR(255),
     quantity INT NOT NULL,
     total DECIMAL(10, 2) NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    status VARCHAR(50)
 );
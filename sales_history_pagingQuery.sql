@@ -0,0 +1,7 @@
+-- Indexes for the paged sales history view (see InventoryService.sales_history_page).
+-- Pages are read newest first by (timestamp, order_id), optionally for one product, and
+-- start right after the last row of the previous page, so each page is a short backward
+-- range scan of one of these indexes however deep the user has scrolled.
+CREATE INDEX sales_history_time_order_idx ON sales_history (timestamp, order_id);
+
+CREATE INDEX sales_history_product_time_order_idx ON sales_history (product_id, timestamp, order_id);
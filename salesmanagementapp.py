@@ -1,39 +1,77 @@
 import logging
-from datetime import datetime
+from datetime import date
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QIntValidator
+from PyQt5.QtWidgets import QWidget, QPushButton, QVBoxLayout, QHBoxLayout, QLineEdit, QMessageBox
+from changenotifier import get_change_notifier
+from inventoryservice import SALES_HISTORY_PAGE_SIZE, get_inventory_service
+from reportcache import get_report_cache
+from tablemodels import RecordTableModel, create_record_view
+from worker import DatabaseWorker
+
+MOVING_AVERAGE_DAYS = 7
+RESTOCK_SUGGESTION_ITEMS = 30
+
+# The next page of sales history is shown when the view is scrolled to within this many rows of the end
+SALES_HISTORY_SCROLL_MARGIN = 20
 
-import matplotlib.pyplot as plt
-import numpy as np
-from PyQt5.QtWidgets import QWidget, QTableWidget, QPushButton, QVBoxLayout, QTableWidgetItem, QMessageBox
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from database import create_connection, close_connection
-from product import Product
 
 class SalesManagementApp(QWidget):
     def __init__(self):
         super().__init__()
 
-        self.sales_orders = []
-
-        # Create and set up the UI components
-        self.sales_table = QTableWidget(self)
-        self.sales_table.setColumnCount(5)
-        self.sales_table.setHorizontalHeaderLabels(['Order ID', 'Product', 'Quantity', 'Total', 'Price'])
+        self.worker = DatabaseWorker(self)
+        self.service = get_inventory_service()
+
+        # Report results are reused until a sale or product change moves the watermark
+        self.report_cache = get_report_cache()
+
+        # Create and set up the UI components; sales rows are kept as the fetched tuples
+        # (order_id, timestamp, product_id, product_name, quantity, total) and rendered on demand
+        self.sales_model = RecordTableModel([
+            ('Order ID', lambda order: order[0]),
+            ('Time', lambda order: order[1]),
+            ('Product', lambda order: order[3]),
+            ('Quantity', lambda order: order[4]),
+            ('Total', lambda order: order[5]),
+            ('Price', lambda order: order[5] / order[4] if order[4] else None),
+        ], key=lambda order: order[0], parent=self)
+        self.sales_table, self.sales_proxy = create_record_view(self.sales_model, self)
+        # Newest first, like the pages, so each page is added at the bottom
+        self.sales_table.sortByColumn(1, Qt.DescendingOrder)
+        self.sales_table.verticalScrollBar().valueChanged.connect(self.show_more_sales_history)
+
+        self.filter_input = QLineEdit(self)
+        self.filter_input.setPlaceholderText('Filter sales...')
+        self.filter_input.textChanged.connect(self.sales_proxy.setFilterFixedString)
+
+        # Filters applied by the database, so they cover the whole history rather than the loaded pages
+        self.start_date_input = QLineEdit(self)
+        self.start_date_input.setPlaceholderText('From (YYYY-MM-DD)')
+        self.end_date_input = QLineEdit(self)
+        self.end_date_input.setPlaceholderText('To (YYYY-MM-DD)')
+        self.product_id_input = QLineEdit(self)
+        self.product_id_input.setPlaceholderText('Product ID')
+        self.product_id_input.setValidator(QIntValidator(1, 2147483647, self))
+        for filter_input in (self.start_date_input, self.end_date_input, self.product_id_input):
+            filter_input.returnPressed.connect(self.view_sales_history)
 
         self.view_sales_button = QPushButton('View Sales History', self)
         self.generate_report_button = QPushButton('Generate Sales Report', self)
 
         # Connect buttons to their respective functions
         self.view_sales_button.clicked.connect(self.view_sales_history)
-        self.generate_report_button.clicked.connect(self.generate_sales_report)
+        self.generate_report_button.clicked.connect(lambda: self.generate_sales_report())
         self.generate_sales_report_button = QPushButton('Generate Sales Report', self)
         self.generate_stock_report_button = QPushButton('Generate Stock Report', self)
         self.generate_profitability_report_button = QPushButton('Generate Profitability Report', self)
         self.visualize_data_button = QPushButton('Visualize Data with Charts', self)
 
         # Connect buttons to their respective functions
-        self.generate_sales_report_button.clicked.connect(self.generate_sales_report)
+        self.generate_sales_report_button.clicked.connect(lambda: self.generate_sales_report())
         self.generate_stock_report_button.clicked.connect(self.generate_stock_report)
-        self.generate_profitability_report_button.clicked.connect(self.generate_profitability_report)
+        self.generate_profitability_report_button.clicked.connect(lambda: self.generate_profitability_report())
         self.visualize_data_button.clicked.connect(self.visualize_data_with_charts)
         self.restock_suggestions_button = QPushButton('Restock Suggestions', self)
         self.restock_suggestions_button.clicked.connect(self.generate_restock_suggestions)
@@ -42,6 +80,12 @@ class SalesManagementApp(QWidget):
 
         # Set up the layout
         layout = QVBoxLayout(self)
+        layout.addWidget(self.filter_input)
+        history_filters = QHBoxLayout()
+        history_filters.addWidget(self.start_date_input)
+        history_filters.addWidget(self.end_date_input)
+        history_filters.addWidget(self.product_id_input)
+        layout.addLayout(history_filters)
         layout.addWidget(self.sales_table)
         layout.addWidget(self.view_sales_button)
         layout.addWidget(self.generate_report_button)
@@ -51,288 +95,216 @@ class SalesManagementApp(QWidget):
         layout.addWidget(self.visualize_data_button)
         layout.addWidget(self.restock_suggestions_button)
 
-        # For data visualization
-        self.figure, self.ax = plt.subplots()
-        self.canvas = FigureCanvas(self.figure)
-        layout.addWidget(self.canvas)
-
-        # Set up logging
-        logging.basicConfig(filename='sales_management.log', level=logging.INFO)
+        # For data visualization; every report draws into one embedded chart, created
+        # (and matplotlib loaded) when the first report is shown
+        self.chart = None
+        self.figure = self.ax = self.canvas = None
+
+        # Sales history is loaded a page at a time as the view is scrolled, with the next page
+        # fetched in the background while the current one is read
+        self.sales_history_loaded = False
+        self.history_generation = 0  # Results of loads started before the latest reset are dropped
+        self.history_filters = (None, None, None)  # (start_date, end_date, product_id)
+        self.history_next_key = None  # (timestamp, order_id) of the oldest row loaded
+        self.history_newest_key = None
+        self.history_next_page = None  # Prefetched (rows, is_last_page), not shown yet
+        self.history_complete = False
+        self.history_waiting = False  # The next page is shown as soon as it arrives
+
+        # Keep a displayed sales history current as sales happen on any terminal
+        get_change_notifier().sales_history_changed.connect(self.on_sales_history_changed)
+
+    @property
+    def sales_orders(self):
+        """The loaded sales history rows."""
+        return self.sales_model.rows
 
     def view_sales_history(self):
-        logging.info("Viewing sales history.")
-
-        # Clear the existing sales orders before loading new data
-        self.sales_orders = []
-
-        # Load sales history from the database
-        conn = create_connection()
-
-        if conn:
-            try:
-                cursor = conn.cursor()
-
-                # Execute SQL query to fetch sales history
-                cursor.execute(
-                    "SELECT sales_history.order_id, sales_history.quantity, sales_history.total, "
-                    "products.product_id, products.name, products.price "
-                    "FROM sales_history "
-                    "JOIN products ON sales_history.product_id = products.product_id"
-                )
-
-                # Fetch all rows
-                rows = cursor.fetchall()
-
-                # Populate the sales orders list
-                self.sales_orders = [{'order_id': row[0], 'quantity': row[1], 'total': row[2],
-                                      'product_id': row[3], 'product_name': row[4], 'price': row[5]} for row in rows]
-
-                # Update the sales table in the UI
-                self.update_sales_table()
-
-                print("Sales history loaded successfully.")
-
-            except Exception as e:
-                logging.error(f"Error loading sales history: {e}")
-
-            finally:
-                close_connection(conn)
-        else:
-            logging.error("Error connecting to the database")
-
-    def update_sales_table(self):
-        self.sales_table.setRowCount(len(self.sales_orders))
-
-        for row, order in enumerate(self.sales_orders):
-            self.sales_table.setItem(row, 0, QTableWidgetItem(str(order['order_id'])))
-            self.sales_table.setItem(row, 1, QTableWidgetItem(order['product_name']))
-            self.sales_table.setItem(row, 2, QTableWidgetItem(str(order['quantity'])))
-            self.sales_table.setItem(row, 3, QTableWidgetItem(str(order['total'])))
-            self.sales_table.setItem(row, 4, QTableWidgetItem(str(order['price'])))
-
-    """def generate_sales_report(self):
-        labels = [order['product_name'] for order in self.sales_orders]
-        quantities = [order['quantity'] for order in self.sales_orders]
-
-        self.ax.clear()
-        self.ax.bar(labels, quantities, color='blue')
-        self.ax.set_xlabel('Product')
-        self.ax.set_ylabel('Quantity')
-        self.ax.set_title('Sales Report')
-
-        self.canvas.draw()"""
-
-    def log_sales_order(self, product_name, quantity, total, status):
-        """Log a sales order in the sales history table."""
+        """Show the newest page of sales matching the date and product filters."""
         try:
-            conn = create_connection()
-            if not conn:
-                logging.error('Error connecting to the database')
-                return
-
-            try:
-                cursor = conn.cursor()
-
-                # Get the current date and time
-                timestamp = datetime.now()
+            start_date = date.fromisoformat(self.start_date_input.text()) if self.start_date_input.text() else None
+            end_date = date.fromisoformat(self.end_date_input.text()) if self.end_date_input.text() else None
+        except ValueError:
+            QMessageBox.warning(self, 'Sales History', 'Enter dates as YYYY-MM-DD.', QMessageBox.Ok)
+            return
+        product_id = int(self.product_id_input.text()) if self.product_id_input.text() else None
 
-                # Insert a record into the sales_history table
-                cursor.execute(
-                    "INSERT INTO sales_history (product_name, quantity, total, timestamp, status) VALUES (%s, %s, %s, %s, %s)",
-                    (product_name, quantity, total, timestamp, status))
-
-                conn.commit()
-                logging.info(
-                    f"Sales order logged successfully: Product '{product_name}', Quantity: {quantity}, Total: {total}")
-
-            except Exception as e:
-                logging.error(f"Error logging sales order: {e}")
-
-            finally:
-                close_connection(conn)
-
-        except Exception as er:
-            logging.error(f'Error logging sales order: {er}')
-
-    def generate_sales_report(self):
+        logging.info("Viewing sales history.")
+        self.history_generation += 1
+        self.history_filters = (start_date, end_date, product_id)
+        self.history_next_key = self.history_newest_key = None
+        self.history_next_page = None
+        self.history_complete = False
+        self.history_waiting = True
+        self.sales_model.set_rows([])
+        self.fetch_sales_history_page()
+
+    def fetch_sales_history_page(self):
+        """Load the page after the oldest row loaded in the background."""
+        generation = self.history_generation
+        start_date, end_date, product_id = self.history_filters
+        self.worker.submit('sales_history', self.service.sales_history_page, self.history_next_key,
+                           SALES_HISTORY_PAGE_SIZE, start_date, end_date, product_id,
+                           on_result=lambda rows: self.on_sales_history_page_loaded(generation, rows),
+                           on_error=lambda error: logging.error(f"Error loading sales history: {error}"))
+
+    def on_sales_history_page_loaded(self, generation, rows):
+        if generation != self.history_generation:
+            return
+
+        if rows:
+            self.history_next_key = (rows[-1][1], rows[-1][0])
+        page = (rows, len(rows) < SALES_HISTORY_PAGE_SIZE)
+        if self.history_waiting:
+            self.history_waiting = False
+            self.show_sales_history_page(*page)
+        else:
+            self.history_next_page = page
+
+    def show_sales_history_page(self, rows, is_last_page):
+        if self.history_newest_key is None and rows:
+            self.history_newest_key = (rows[0][1], rows[0][0])
+        self.sales_model.append_rows(rows)
+        self.sales_history_loaded = True
+        self.history_complete = is_last_page
+
+        if not is_last_page:
+            # Prefetch the next page, and show it at once if this one does not fill the view
+            self.fetch_sales_history_page()
+            self.show_more_sales_history()
+
+    def show_more_sales_history(self):
+        """Show the next page once the view is scrolled close to the end of the loaded rows."""
+        scroll_bar = self.sales_table.verticalScrollBar()
+        if (self.history_complete or self.history_waiting or not self.sales_history_loaded
+                or scroll_bar.value() < scroll_bar.maximum() - SALES_HISTORY_SCROLL_MARGIN):
+            return
+
+        if self.history_next_page is None:
+            # The prefetch is still running; show its page when it arrives
+            self.history_waiting = True
+            return
+
+        page, self.history_next_page = self.history_next_page, None
+        self.show_sales_history_page(*page)
+
+    def on_sales_history_changed(self):
+        if not self.sales_history_loaded or not self.isVisible():
+            return
+        if self.history_newest_key is None:
+            self.view_sales_history()
+            return
+
+        # Add only the sales made since the newest row shown; the sorted view puts them on top
+        generation = self.history_generation
+        start_date, end_date, product_id = self.history_filters
+        self.worker.submit('sales_history_new', self.service.sales_history_page, None, SALES_HISTORY_PAGE_SIZE,
+                           start_date, end_date, product_id, self.history_newest_key,
+                           on_result=lambda rows: self.on_new_sales_loaded(generation, rows),
+                           on_error=lambda error: logging.error(f"Error loading new sales: {error}"))
+
+    def on_new_sales_loaded(self, generation, rows):
+        if generation != self.history_generation or not rows:
+            return
+        if len(rows) == SALES_HISTORY_PAGE_SIZE:
+            # Too many to patch in; start again from the newest page
+            self.view_sales_history()
+            return
+
+        self.history_newest_key = (rows[0][1], rows[0][0])
+        self.sales_model.append_rows([row for row in rows if self.sales_model.record_for_key(row[0]) is None])
+
+    def generate_sales_report(self, start_date=None, end_date=None):
         # Placeholder for sales report logic
         logging.info("Generating sales report.")
 
-        # Implement logic to query sales data from the database
-        sales_data = self.query_sales_data_from_database()
+        # Query sales data in the background; repeated clicks share one query
+        self.worker.submit('sales_report', self.report_cache.get, 'sales', self.service.sales_report,
+                           start_date, end_date,
+                           on_result=self.show_sales_report, on_error=self.show_report_error)
 
+    def show_sales_report(self, sales_data):
         # Generate a bar chart for sales data
-        products = [item['product'] for item in sales_data]
-        quantities = [item['quantity'] for item in sales_data]
-
-        plt.bar(products, quantities, color='green')
-        plt.xlabel('Product')
-        plt.ylabel('Quantity')
-        plt.title('Sales Report')
-        plt.show()
+        products, quantities = sales_data
+        self.chart_view().show_bars(products, quantities, 'Sales Report', 'Product', 'Quantity', 'green')
 
     def generate_stock_report(self):
         # Placeholder for stock report logic
         logging.info("Generating stock report.")
 
-        # Implement logic to query stock data from the database
-        stock_data = self.query_stock_data_from_database()
+        # Query stock data in the background
+        self.worker.submit('stock_report', self.report_cache.get, 'stock', self.service.stock_report,
+                           on_result=self.show_stock_report, on_error=self.show_report_error)
 
+    def show_stock_report(self, stock_data):
         # Generate a bar chart for stock data
-        products = [item['product'] for item in stock_data]
-        quantities = [item['quantity'] for item in stock_data]
+        products, quantities = stock_data
+        self.chart_view().show_bars(products, quantities, 'Stock Report', 'Product', 'Quantity', 'blue')
 
-        plt.bar(products, quantities, color='blue')
-        plt.xlabel('Product')
-        plt.ylabel('Quantity')
-        plt.title('Stock Report')
-        plt.show()
-
-    def generate_profitability_report(self):
+    def generate_profitability_report(self, start_date=None, end_date=None):
         # Placeholder for profitability report logic
         logging.info("Generating profitability report.")
 
-        # Implement logic to query profitability data from the database
-        profitability_data = self.query_profitability_data_from_database()
+        # Query profitability data in the background
+        self.worker.submit('profitability_report', self.report_cache.get, 'profitability',
+                           self.service.profitability_report, start_date, end_date,
+                           on_result=self.show_profitability_report, on_error=self.show_report_error)
 
+    def show_profitability_report(self, profitability_data):
         # Generate a bar chart for profitability data
-        products = [item['product'] for item in profitability_data]
-        profits = [item['profit'] for item in profitability_data]
-
-        plt.bar(products, profits, color='orange')
-        plt.xlabel('Product')
-        plt.ylabel('Profit')
-        plt.title('Profitability Report')
-        plt.show()
+        products, profits = profitability_data
+        self.chart_view().show_bars(products, profits, 'Profitability Report', 'Product', 'Profit', 'orange')
 
     def visualize_data_with_charts(self):
         # Placeholder for data visualization logic
         logging.info("Visualizing data with charts.")
 
-        # Implement logic to query data for visualization from the database
-        data_for_visualization = self.query_data_for_visualization_from_database()
-
-        # Generate a scatter plot for visualization
-        plt.scatter(data_for_visualization[:, 0], data_for_visualization[:, 1], color='red')
-        plt.xlabel('X-axis')
-        plt.ylabel('Y-axis')
-        plt.title('Data Visualization with Charts')
-        plt.show()
-
-    def query_sales_data_from_database(self):
-        conn = create_connection()
-        sales_data = []
-
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT product_name, SUM(quantity) AS quantity FROM sales_orders GROUP BY product_name"
-                )
-                rows = cursor.fetchall()
-
-                sales_data = [{'product': row[0], 'quantity': row[1]} for row in rows]
-
-            except Exception as e:
-                logging.error(f"Error querying sales data: {e}")
-
-            finally:
-                close_connection(conn)
-
-        return sales_data
-
-    def query_stock_data_from_database(self):
-        conn = create_connection()
-        stock_data = []
-
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT product_name, quantity FROM products"
-                )
-                rows = cursor.fetchall()
-
-                stock_data = [{'product': row[0], 'quantity': row[1]} for row in rows]
-
-            except Exception as e:
-                logging.error(f"Error querying stock data: {e}")
-
-            finally:
-                close_connection(conn)
-
-        return stock_data
-
-    def query_profitability_data_from_database(self):
-        conn = create_connection()
-        profitability_data = []
-
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT product_name, SUM(total) AS profit FROM sales_history GROUP BY product_name"
-                )
-                rows = cursor.fetchall()
-
-                profitability_data = [{'product': row[0], 'profit': row[1]} for row in rows]
-
-            except Exception as e:
-                logging.error(f"Error querying profitability data: {e}")
-
-            finally:
-                close_connection(conn)
-
-        return profitability_data
-
-    def query_data_for_visualization_from_database(self):
-        conn = create_connection()
-        data_for_visualization = np.array([])
-
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT column1, column2 FROM reports"
-                )
-                rows = cursor.fetchall()
-
-                data_for_visualization = np.array(rows)
-
-            except Exception as e:
-                logging.error(f"Error querying data for visualization: {e}")
-
-            finally:
-                close_connection(conn)
-
-        return data_for_visualization
+        # Query data for visualization in the background
+        self.worker.submit('visualization', self.report_cache.get, 'visualization',
+                           self.service.daily_sales_report, None, None, MOVING_AVERAGE_DAYS,
+                           on_result=self.show_data_visualization, on_error=self.show_report_error)
+
+    def show_data_visualization(self, data_for_visualization):
+        # Plot daily sales with their moving average
+        dates, totals, average = data_for_visualization
+        self.chart_view().show_series(dates, totals, average, 'Data Visualization with Charts', 'Date', 'Sales',
+                                      'Daily sales', f'{MOVING_AVERAGE_DAYS}-day average')
+
+    def chart_view(self):
+        if self.chart is None:
+            from charts import ChartView
+            self.chart = ChartView(self)
+            self.figure, self.ax, self.canvas = self.chart.figure, self.chart.ax, self.chart.canvas
+            self.layout().addWidget(self.canvas)
+        return self.chart
+
+    def show_report_error(self, error):
+        logging.error(f"Error querying report data: {error}")
+        QMessageBox.warning(self, 'Error', f'Error querying report data: {error}', QMessageBox.Ok)
 
     def generate_restock_suggestions(self):
-        # Adjusted logic to generate restocking suggestions based on inventory levels
-        low_stock_threshold = 10  # Threshold to trigger the restocking suggestion
-        critical_stock_threshold = 15  # Threshold to display the suggestion
-
-        conn = create_connection()
-
-        if conn:
-            try:
-                cursor = conn.cursor()
-                cursor.execute("SELECT name, quantity FROM products WHERE quantity < %s AND quantity < %s",
-                               (low_stock_threshold, critical_stock_threshold))
-                rows = cursor.fetchall()
-
-                if rows:
-                    suggestions = [f"{row[0]}: {critical_stock_threshold - row[1]} units needed" for row in rows]
-                    QMessageBox.information(self, 'Restocking Suggestions', '\n'.join(suggestions), QMessageBox.Ok)
-                else:
-                    QMessageBox.information(self, 'Restocking Suggestions', 'No restocking suggestions at the moment.',
-                                            QMessageBox.Ok)
-
-            except Exception as e:
-                logging.error(f"Error generating restocking suggestions: {e}")
-                QMessageBox.warning(self, 'Error', f'Error generating restocking suggestions: {e}', QMessageBox.Ok)
-
-            finally:
-                close_connection(conn)
+        # Forecast demand for the whole catalog from recent sales and suggest what to reorder
+        self.worker.submit('restock_suggestions', self.service.restock_forecast,
+                           on_result=self.show_restock_suggestions,
+                           on_error=self.show_restock_suggestions_error)
+
+    def show_restock_suggestions(self, restock_forecast):
+        rows = restock_forecast.suggestions(RESTOCK_SUGGESTION_ITEMS + 1)
+        if rows:
+            suggestions = [f"{name}: {order_quantity} units needed ({quantity} in stock, "
+                           f"selling {velocity:.1f}/day)" for name, quantity, velocity, order_quantity in rows]
+            if len(suggestions) > RESTOCK_SUGGESTION_ITEMS:
+                suggestions[RESTOCK_SUGGESTION_ITEMS:] = ['...']
+            QMessageBox.information(self, 'Restocking Suggestions', '\n'.join(suggestions), QMessageBox.Ok)
+        else:
+            QMessageBox.information(self, 'Restocking Suggestions', 'No restocking suggestions at the moment.',
+                                    QMessageBox.Ok)
 
+    def show_restock_suggestions_error(self, error):
+        logging.error(f"Error generating restocking suggestions: {error}")
+        QMessageBox.warning(self, 'Error', f'Error generating restocking suggestions: {error}', QMessageBox.Ok)
 
+    def closeEvent(self, event):
+        # Drop any report queries still running for this window
+        self.worker.cancel_all()
+        super().closeEvent(event)
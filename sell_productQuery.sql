@@ -0,0 +1,42 @@
+-- Atomic sale in a single statement.
+-- The stock decrement only succeeds while enough stock is left, so concurrent sales from
+-- different terminals can never oversell; the inventory and sales history rows are written
+-- by the same statement. Returns no row when the product is missing, stock is insufficient
+-- or the quantity is not positive.
+ALTER TABLE sales_history
+ADD COLUMN IF NOT EXISTS product_id INT,
+ADD COLUMN IF NOT EXISTS product_name VARCHAR(255),
+ADD COLUMN IF NOT EXISTS status VARCHAR(50);
+
+-- Tables created from the original DDL have a required product column that sales no longer
+-- write; keep its values as the product name and stop requiring it.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'sales_history' AND column_name = 'product') THEN
+        UPDATE sales_history SET product_name = product WHERE product_name IS NULL;
+        ALTER TABLE sales_history ALTER COLUMN product DROP NOT NULL;
+    END IF;
+END $$;
+
+CREATE OR REPLACE FUNCTION sell_product(p_product_id INT, p_quantity INT, p_status VARCHAR DEFAULT 'sold')
+RETURNS TABLE (product_id INT, new_quantity INT, total DECIMAL(10, 2)) AS $$
+    WITH sold AS (
+        UPDATE products
+        SET quantity = products.quantity - p_quantity
+        WHERE products.product_id = p_product_id
+          AND p_quantity > 0
+          AND products.quantity >= p_quantity
+        RETURNING products.product_id, products.name, products.price, products.quantity
+    ), inventory_change AS (
+        INSERT INTO inventory_history (product_id, timestamp, new_quantity)
+        SELECT sold.product_id, CURRENT_TIMESTAMP, sold.quantity
+        FROM sold
+    ), sale AS (
+        INSERT INTO sales_history (product_id, product_name, quantity, total, timestamp, status)
+        SELECT sold.product_id, sold.name, p_quantity, sold.price * p_quantity, CURRENT_TIMESTAMP, p_status
+        FROM sold
+    )
+    SELECT sold.product_id, sold.quantity, sold.price * p_quantity
+    FROM sold;
+$$ LANGUAGE sql;
@@ -0,0 +1,159 @@
+-- Schema for the embedded SQLite backend (see storage.py).
+-- Mirrors the PostgreSQL tables the application uses, with triggers standing in for
+-- products_change_seq, the product tombstones and the daily sales rollup. Applied
+-- automatically when the database file is first opened.
+CREATE TABLE products (
+    product_id INTEGER PRIMARY KEY AUTOINCREMENT,  -- IDs are never reused, so tombstones stay unambiguous
+    name VARCHAR(255) NOT NULL,
+    description TEXT,
+    price DECIMAL(10, 2) NOT NULL,
+    quantity INT NOT NULL,
+    low_stock_threshold INT NOT NULL DEFAULT 10,
+    restock_quantity INT NOT NULL DEFAULT 10,
+    change_seq INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX products_change_seq_idx ON products (change_seq);
+
+CREATE INDEX products_low_stock_idx ON products (product_id)
+WHERE quantity < low_stock_threshold;
+
+-- One row holding the last change sequence value handed out, like a PostgreSQL sequence
+CREATE TABLE products_change_seq (
+    last_value INTEGER NOT NULL
+);
+
+INSERT INTO products_change_seq (last_value) VALUES (0);
+
+CREATE TABLE product_tombstones (
+    product_id INTEGER PRIMARY KEY,
+    change_seq INTEGER NOT NULL,
+    deleted_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX product_tombstones_change_seq_idx ON product_tombstones (change_seq);
+
+CREATE TRIGGER products_stamp_insert AFTER INSERT ON products
+BEGIN
+    UPDATE products_change_seq SET last_value = last_value + 1;
+    UPDATE products SET change_seq = (SELECT last_value FROM products_change_seq)
+    WHERE product_id = NEW.product_id;
+END;
+
+-- Triggers do not fire recursively, so stamping the row does not trigger this again
+CREATE TRIGGER products_stamp_change AFTER UPDATE ON products
+WHEN OLD.name IS NOT NEW.name OR OLD.description IS NOT NEW.description OR OLD.price IS NOT NEW.price
+     OR OLD.quantity IS NOT NEW.quantity OR OLD.low_stock_threshold IS NOT NEW.low_stock_threshold
+     OR OLD.restock_quantity IS NOT NEW.restock_quantity
+BEGIN
+    UPDATE products_change_seq SET last_value = last_value + 1;
+    UPDATE products SET change_seq = (SELECT last_value FROM products_change_seq)
+    WHERE product_id = NEW.product_id;
+END;
+
+CREATE TRIGGER products_record_tombstone AFTER DELETE ON products
+BEGIN
+    UPDATE products_change_seq SET last_value = last_value + 1;
+    INSERT INTO product_tombstones (product_id, change_seq, deleted_at)
+    VALUES (OLD.product_id, (SELECT last_value FROM products_change_seq), datetime('now', 'localtime'))
+    ON CONFLICT (product_id) DO UPDATE
+        SET change_seq = excluded.change_seq, deleted_at = excluded.deleted_at;
+END;
+
+CREATE TABLE inventory_history (
+    id INTEGER PRIMARY KEY,
+    product_id INT REFERENCES products(product_id),
+    timestamp TIMESTAMP NOT NULL,
+    new_quantity INT NOT NULL
+);
+
+CREATE INDEX inventory_history_product_time_idx ON inventory_history (product_id, timestamp);
+
+CREATE TABLE sales_history (
+    order_id INTEGER PRIMARY KEY,
+    product_id INT,
+    product_name VARCHAR(255),
+    quantity INT NOT NULL,
+    total DECIMAL(10, 2) NOT NULL,
+    timestamp TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')),
+    status VARCHAR(50)
+);
+
+-- Every index ends with the rowid, so these also serve keyset paging on (timestamp, order_id)
+CREATE INDEX sales_history_timestamp_idx ON sales_history (timestamp);
+
+CREATE INDEX sales_history_product_time_idx ON sales_history (product_id, timestamp);
+
+CREATE TABLE sales_daily_rollup (
+    sales_date DATE NOT NULL,
+    product_name VARCHAR(255) NOT NULL,
+    quantity INTEGER NOT NULL DEFAULT 0,
+    total DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    order_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (sales_date, product_name)
+) WITHOUT ROWID;
+
+CREATE INDEX sales_daily_rollup_product_idx ON sales_daily_rollup (product_name, sales_date);
+
+CREATE TRIGGER sales_history_rollup AFTER INSERT ON sales_history
+WHEN NEW.product_name IS NOT NULL
+BEGIN
+    INSERT INTO sales_daily_rollup (sales_date, product_name, quantity, total, order_count)
+    VALUES (date(NEW.timestamp), NEW.product_name, NEW.quantity, NEW.total, 1)
+    ON CONFLICT (sales_date, product_name) DO UPDATE
+        SET quantity = quantity + excluded.quantity,
+            total = ROUND(total + excluded.total, 2),
+            order_count = order_count + 1;
+END;
+
+CREATE TABLE users (
+    user_id INTEGER PRIMARY KEY,
+    username VARCHAR(50) UNIQUE NOT NULL,
+    password_hash VARCHAR(100) NOT NULL,
+    role VARCHAR(20) NOT NULL
+);
+
+CREATE TABLE replayed_journal_entries (
+    terminal_id VARCHAR(36) NOT NULL,
+    entry_id INTEGER NOT NULL,
+    replayed_at TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')),
+    PRIMARY KEY (terminal_id, entry_id)
+) WITHOUT ROWID;
+
+-- Version counter for cached reports, bumped with every change to products or sales
+-- history in the same transaction (see report_watermarkQuery.sql)
+CREATE TABLE report_watermark (
+    version INTEGER NOT NULL
+);
+
+INSERT INTO report_watermark (version) VALUES (0);
+
+CREATE TRIGGER products_report_watermark_insert AFTER INSERT ON products
+BEGIN
+    UPDATE report_watermark SET version = version + 1;
+END;
+
+CREATE TRIGGER products_report_watermark_update AFTER UPDATE ON products
+BEGIN
+    UPDATE report_watermark SET version = version + 1;
+END;
+
+CREATE TRIGGER products_report_watermark_delete AFTER DELETE ON products
+BEGIN
+    UPDATE report_watermark SET version = version + 1;
+END;
+
+CREATE TRIGGER sales_history_report_watermark_insert AFTER INSERT ON sales_history
+BEGIN
+    UPDATE report_watermark SET version = version + 1;
+END;
+
+CREATE TRIGGER sales_history_report_watermark_update AFTER UPDATE ON sales_history
+BEGIN
+    UPDATE report_watermark SET version = version + 1;
+END;
+
+CREATE TRIGGER sales_history_report_watermark_delete AFTER DELETE ON sales_history
+BEGIN
+    UPDATE report_watermark SET version = version + 1;
+END;
@@ -0,0 +1,265 @@
+"""InventoryService for the embedded SQLite backend (see storage.py).
+
+Statements that are plain SQL are inherited from InventoryService and run
+unchanged; this subclass replaces the ones that rely on PostgreSQL features:
+multi-row VALUES via execute_values, data-modifying CTEs, arrays, server
+functions and COPY. Batches run as one statement per item inside a single
+transaction, which costs little in an embedded database since every statement
+is prepared once per connection and there is no network round trip. Lists of
+IDs are passed as one JSON array parameter.
+"""
+import json
+from datetime import date, timedelta
+from decimal import Decimal
+
+from historywriter import get_history_writer
+from inventoryservice import InventoryService, PRODUCT_COLUMNS, DEFAULT_SALE_STATUS, ProductChanges, Sale
+from lowstock import LOW_STOCK_CONDITION, Restock
+from product import Product
+from storage import CENT
+
+NOW = "datetime('now', 'localtime')"
+
+# Day number counted from 1970-01-01, as used by analytics
+UNIX_DAY = "CAST(julianday({}) - 2440587.5 AS INTEGER)"
+
+
+def to_decimal(value):
+    """Money computed by SQLite expressions comes back as a float."""
+    return value if isinstance(value, Decimal) else Decimal(str(value)).quantize(CENT)
+
+
+def _date_range_condition(column, start_date, end_date):
+    conditions = ['1']
+    params = []
+    if start_date is not None:
+        conditions.append(f"{column} >= %s")
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append(f"{column} <= %s")
+        params.append(end_date)
+    return ' AND '.join(conditions), params
+
+
+def _columns(rows, count, dtype=None):
+    """Turn result rows into one NumPy array per column (integers unless dtype is given)."""
+    import numpy as np
+    if not rows:
+        return [np.zeros(0, dtype=dtype or np.int64) for _ in range(count)]
+    return [np.array(column, dtype=dtype or np.int64) for column in zip(*rows)]
+
+
+class SQLiteInventoryService(InventoryService):
+    # Products
+
+    def product_changes(self, conn, watermark=None):
+        # Write transactions are serialized and stamp change_seq inside them, so sequence values
+        # become visible in order and the highest one read is a watermark no later commit falls below
+        if watermark is None:
+            rows = conn.execute(f"SELECT {PRODUCT_COLUMNS}, change_seq FROM products ORDER BY product_id").fetchall()
+            deleted_ids = []
+            new_watermark = conn.execute("SELECT COALESCE(MAX(change_seq), 0) FROM product_tombstones").fetchone()[0]
+        else:
+            rows = conn.execute(f"SELECT {PRODUCT_COLUMNS}, change_seq FROM products WHERE change_seq > %s "
+                                "ORDER BY product_id", (watermark,)).fetchall()
+            tombstones = conn.execute("SELECT product_id, change_seq FROM product_tombstones WHERE change_seq > %s",
+                                      (watermark,)).fetchall()
+            deleted_ids = [product_id for product_id, _ in tombstones]
+            new_watermark = max([watermark] + [change_seq for _, change_seq in tombstones])
+
+        new_watermark = max([new_watermark] + [row[-1] for row in rows])
+        return ProductChanges([row[:-1] for row in rows], deleted_ids, new_watermark, watermark is None)
+
+    def get_products(self, conn, product_ids):
+        cursor = conn.execute(f"SELECT {PRODUCT_COLUMNS} FROM products "
+                              "WHERE product_id IN (SELECT value FROM json_each(%s)) ORDER BY product_id",
+                              (json.dumps(list(product_ids)),))
+        return [Product(*row) for row in cursor.fetchall()]
+
+    def add_products(self, conn, products):
+        product_ids = []
+        for name, description, price, quantity in products:
+            row = conn.execute("INSERT INTO products (name, description, price, quantity) VALUES (%s, %s, %s, %s) "
+                               "RETURNING product_id", (name, description, price, quantity)).fetchall()[0]
+            product_ids.append(row[0])
+            self._log_inventory_change(conn, row[0], quantity)
+        return product_ids
+
+    def update_products(self, conn, products):
+        updated = []
+        for product_id, name, description, price, quantity in products:
+            row = conn.execute("UPDATE products SET name = %s, description = %s, price = %s, quantity = %s "
+                               "WHERE product_id = %s RETURNING product_id",
+                               (name, description, price, quantity, product_id)).fetchall()
+            if row:
+                updated.append((product_id, quantity))
+        get_history_writer().log_inventory_changes(updated)
+        return [product_id for product_id, _ in updated]
+
+    def delete_products(self, conn, product_ids):
+        ids = json.dumps(list(product_ids))
+        conn.execute("DELETE FROM inventory_history WHERE product_id IN (SELECT value FROM json_each(%s))", (ids,))
+        cursor = conn.execute("DELETE FROM products WHERE product_id IN (SELECT value FROM json_each(%s)) "
+                              "RETURNING product_id", (ids,))
+        return sorted(row[0] for row in cursor.fetchall())
+
+    # Sales
+
+    def sell_many(self, conn, sales, status=DEFAULT_SALE_STATUS):
+        results = []
+        for product_id, quantity in sales:
+            # Guarded decrement: no row comes back when stock is insufficient or the product is unknown
+            if quantity <= 0:
+                results.append(None)
+                continue
+            rows = conn.execute("UPDATE products SET quantity = quantity - %s "
+                                "WHERE product_id = %s AND quantity >= %s "
+                                "RETURNING name, price, quantity",
+                                (quantity, product_id, quantity)).fetchall()
+            if not rows:
+                results.append(None)
+                continue
+
+            name, price, new_quantity = rows[0]
+            total = to_decimal(price) * quantity
+            self._log_inventory_change(conn, product_id, new_quantity)
+            conn.execute("INSERT INTO sales_history (product_id, product_name, quantity, total, timestamp, status) "
+                         f"VALUES (%s, %s, %s, %s, {NOW}, %s)", (product_id, name, quantity, total, status))
+            results.append(Sale(product_id, quantity, new_quantity, total))
+        return results
+
+    # Inventory
+
+    def set_stock_many(self, conn, changes):
+        updated = []
+        for product_id, quantity in changes:
+            if quantity < 0:
+                continue
+            if conn.execute("UPDATE products SET quantity = %s WHERE product_id = %s RETURNING product_id",
+                            (quantity, product_id)).fetchall():
+                updated.append((product_id, quantity))
+        get_history_writer().log_inventory_changes(updated)
+        return [product_id for product_id, _ in updated]
+
+    def restock_low_stock(self, conn, product_ids=None):
+        ids = json.dumps(list(product_ids)) if product_ids is not None else None
+        rows = conn.execute("UPDATE products SET quantity = quantity + restock_quantity "
+                            f"WHERE {LOW_STOCK_CONDITION} "
+                            "  AND (%s IS NULL OR product_id IN (SELECT value FROM json_each(%s))) "
+                            "RETURNING product_id, name, quantity, restock_quantity, price",
+                            (ids, ids)).fetchall()
+        conn.executemany("INSERT INTO inventory_history (product_id, timestamp, new_quantity) "
+                         f"VALUES (%s, {NOW}, %s)", [(product_id, quantity) for product_id, _, quantity, _, _ in rows])
+        return [Restock(product_id, name, quantity, restock_quantity, to_decimal(price) * restock_quantity)
+                for product_id, name, quantity, restock_quantity, price in sorted(rows)]
+
+    def set_low_stock_thresholds(self, conn, thresholds):
+        conn.executemany("UPDATE products SET low_stock_threshold = %s, restock_quantity = %s "
+                         "WHERE product_id = %s", [(threshold, restock, product_id) for product_id, threshold, restock in thresholds])
+
+    def stock_as_of(self, conn, product_id, at):
+        row = conn.execute("SELECT new_quantity FROM inventory_history "
+                           "WHERE product_id = %s AND timestamp <= %s ORDER BY timestamp DESC, id DESC LIMIT 1",
+                           (product_id, at)).fetchone()
+        return row[0] if row else None
+
+    def catalog_as_of(self, conn, at):
+        rows = conn.execute("SELECT product_id, new_quantity FROM ("
+                            "    SELECT product_id, new_quantity, ROW_NUMBER() OVER ("
+                            "        PARTITION BY product_id ORDER BY timestamp DESC, id DESC) AS position"
+                            "    FROM inventory_history WHERE timestamp <= %s"
+                            ") WHERE position = 1 ORDER BY product_id", (at,)).fetchall()
+        return _columns(rows, 2)
+
+    def _log_inventory_change(self, conn, product_id, quantity):
+        conn.execute(f"INSERT INTO inventory_history (product_id, timestamp, new_quantity) VALUES (%s, {NOW}, %s)",
+                     (product_id, quantity))
+
+    # Terminal journals
+
+    def claim_journal_entries(self, conn, terminal_id, entry_ids):
+        # WHERE true tells SQLite's parser that ON CONFLICT belongs to the INSERT, not a join
+        cursor = conn.execute("INSERT INTO replayed_journal_entries (terminal_id, entry_id) "
+                              "SELECT %s, value FROM json_each(%s) WHERE true "
+                              "ON CONFLICT DO NOTHING RETURNING entry_id",
+                              (terminal_id, json.dumps(list(entry_ids))))
+        return {row[0] for row in cursor.fetchall()}
+
+    # Reports
+
+    def sales_report(self, conn, start_date=None, end_date=None):
+        labels, quantities, _ = self._sales_by_product(conn, start_date, end_date)
+        return labels, quantities
+
+    def stock_report(self, conn):
+        import numpy as np
+        rows = conn.execute("SELECT name, quantity FROM products ORDER BY product_id").fetchall()
+        return (np.array([name for name, _ in rows], dtype=object),
+                np.array([quantity for _, quantity in rows], dtype=np.int64))
+
+    def profitability_report(self, conn, start_date=None, end_date=None):
+        import analytics
+        labels, _, total_cents = self._sales_by_product(conn, start_date, end_date)
+        return labels, analytics.cents_to_amount(total_cents)
+
+    def daily_sales_report(self, conn, start_date=None, end_date=None, window=7):
+        import numpy as np
+        import analytics
+        condition, params = _date_range_condition('sales_date', start_date, end_date)
+        days, total_cents = _columns(conn.execute(
+            f"SELECT {UNIX_DAY.format('sales_date')}, SUM(CAST(ROUND(total * 100) AS INTEGER)) "
+            f"FROM sales_daily_rollup WHERE {condition} GROUP BY sales_date ORDER BY sales_date", params).fetchall(), 2)
+
+        sales = analytics.SalesColumns(np.zeros(0, dtype=object), np.zeros(len(days), dtype=np.int64), days,
+                                       np.zeros(len(days), dtype=np.int64), total_cents)
+        days, total_cents = analytics.daily_series(sales, sales.total_cents)
+        totals = analytics.cents_to_amount(total_cents)
+        return analytics.days_to_dates(days), totals, analytics.moving_average(totals, window)
+
+    def restock_forecast(self, conn):
+        import numpy as np
+        import forecast
+        today = date.today()
+        first_day = today - timedelta(days=forecast.LOOKBACK_DAYS)
+
+        products = conn.execute("SELECT product_id, quantity, name FROM products ORDER BY product_id").fetchall()
+        product_ids, quantities = _columns([row[:2] for row in products], 2)
+        labels = np.array([row[2] for row in products], dtype=object)
+        sale_product_ids, sale_days, sale_quantities = _columns(conn.execute(
+            f"SELECT product_id, {UNIX_DAY.format('date(timestamp)')} - {UNIX_DAY.format('%s')}, SUM(quantity) "
+            "FROM sales_history WHERE product_id IS NOT NULL AND timestamp >= %s AND timestamp < %s "
+            "GROUP BY 1, 2", (first_day, first_day, today)).fetchall(), 3)
+
+        velocity, std, reorder_point, order_up_to, order_quantity = forecast.compute_forecast(
+            product_ids, quantities, sale_product_ids, sale_days, sale_quantities, forecast.LOOKBACK_DAYS,
+            forecast.LEAD_TIME_DAYS, forecast.REVIEW_PERIOD_DAYS, forecast.SERVICE_LEVEL_Z)
+        return forecast.RestockForecast(product_ids, labels, quantities, velocity, std, reorder_point,
+                                        order_up_to, order_quantity)
+
+    def rebuild_sales_rollup(self, conn, since=None):
+        conn.execute("DELETE FROM sales_daily_rollup WHERE %s IS NULL OR sales_date >= %s", (since, since))
+        conn.execute("INSERT INTO sales_daily_rollup (sales_date, product_name, quantity, total, order_count) "
+                     "SELECT date(timestamp), product_name, SUM(quantity), ROUND(SUM(total), 2), COUNT(*) "
+                     "FROM sales_history WHERE product_name IS NOT NULL AND (%s IS NULL OR timestamp >= %s) "
+                     "GROUP BY date(timestamp), product_name", (since, since))
+
+    def _sales_by_product(self, conn, start_date, end_date):
+        import numpy as np
+        condition, params = _date_range_condition('sales_date', start_date, end_date)
+        rows = conn.execute("SELECT product_name, SUM(quantity), SUM(CAST(ROUND(total * 100) AS INTEGER)) "
+                            f"FROM sales_daily_rollup WHERE {condition} "
+                            "GROUP BY product_name ORDER BY product_name", params).fetchall()
+        quantities, total_cents = _columns([row[1:] for row in rows], 2)
+        return np.array([row[0] for row in rows], dtype=object), quantities, total_cents
+
+    # Users
+
+    def register_users(self, conn, users):
+        registered = []
+        for username, password, role in users:
+            row = conn.execute("INSERT INTO users (username, password_hash, role) VALUES (%s, %s, %s) "
+                               "ON CONFLICT (username) DO NOTHING RETURNING username",
+                               (username, password, role)).fetchall()
+            if row:
+                registered.append(username)
+        return registered
@@ -1,7 +1,5 @@
 from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel, QPushButton
 
-from productmanagementapp import ProductManagementApp
-
 
 
 class StaffPanel(QDialog):
@@ -25,6 +23,7 @@ class StaffPanel(QDialog):
     def open_product_management(self):
         # Create ProductManagementApp if it doesn't exist
         if not self.product_management_app:
+            from productmanagementapp import ProductManagementApp
             self.product_management_app = ProductManagementApp()
 
         # Show ProductManagementApp
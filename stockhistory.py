@@ -0,0 +1,81 @@
+"""Point-in-time stock queries and inventory history maintenance.
+
+See inventory_snapshotsQuery.sql for the partitioning, snapshot and compaction
+functions these wrap. Run maintain() (python stockhistory.py) periodically,
+e.g. daily, to keep partitions ahead of time, snapshot and compact.
+
+Usage: python stockhistory.py [KEEP_MONTHS]
+"""
+import logging
+import sys
+from datetime import datetime
+
+import analytics
+from database import pooled_connection
+
+HISTORY_KEEP_MONTHS = 12
+PARTITION_MONTHS_AHEAD = 2
+
+
+def stock_as_of(conn, product_id, at):
+    """Return a product's stock at the given time, or None if nothing was recorded before it."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT stock_as_of(%s, %s)", (product_id, at))
+    return cursor.fetchone()[0]
+
+
+def catalog_as_of(conn, at):
+    """Return (product_ids, quantities) arrays with every product's stock at the given time."""
+    return analytics.fetch_columns(conn, "SELECT product_id, quantity FROM inventory_as_of(%s) ORDER BY product_id",
+                                   (at,), count=2)
+
+
+def take_snapshot(conn, at=None):
+    """Snapshot every product's stock at the given time (now by default), returning the number of products."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT take_inventory_snapshot(%s)", (at or datetime.now(),))
+    return cursor.fetchone()[0]
+
+
+def compact_history(conn, keep_months=HISTORY_KEEP_MONTHS):
+    """Fold monthly partitions older than keep_months into snapshots, returning the number dropped."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT compact_inventory_history(%s)", (keep_months,))
+    return cursor.fetchone()[0]
+
+
+def ensure_partitions(conn, months_ahead=PARTITION_MONTHS_AHEAD):
+    cursor = conn.cursor()
+    cursor.execute("SELECT ensure_inventory_history_partitions(%s)", (months_ahead,))
+
+
+def maintain(keep_months=HISTORY_KEEP_MONTHS):
+    """Create upcoming partitions, take a snapshot and compact old history, each in its own transaction."""
+    with pooled_connection() as conn:
+        if not conn:
+            raise ConnectionError('Error connecting to the database')
+
+        try:
+            ensure_partitions(conn)
+            conn.commit()
+            products = take_snapshot(conn)
+            conn.commit()
+            dropped = compact_history(conn, keep_months)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    logging.info(f'Inventory history maintenance: snapshot of {products} products, '
+                 f'{dropped} monthly partitions compacted')
+    return products, dropped
+
+
+def main(argv):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    maintain(int(argv[1]) if len(argv) > 1 else HISTORY_KEEP_MONTHS)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
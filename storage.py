@@ -0,0 +1,186 @@
+"""Storage backends: PostgreSQL, or an embedded SQLite database in WAL mode.
+
+database.py picks the backend from its configuration; everything else talks to
+the connections it hands out. Both backends accept the same %s / %(name)s
+parameter style: SQLite connections translate it to SQLite's own placeholders
+once per distinct statement, and reuse the compiled statement from the
+connection's statement cache on every later execution.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+
+SQLITE_SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sqlite_schemaQuery.sql')
+
+PYFORMAT_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+CENT = Decimal('0.01')  # Every DECIMAL column holds money with two decimal places
+
+
+@lru_cache(maxsize=1024)
+def to_sqlite_paramstyle(query):
+    """Translate %s and %(name)s placeholders (and %% escapes) to SQLite's ? and :name."""
+    def replace(match):
+        if match.group(0) == '%%':
+            return '%'
+        return f':{match.group(1)}' if match.group(1) else '?'
+
+    return PYFORMAT_PLACEHOLDER.sub(replace, query)
+
+
+class StorageBackend(ABC):
+    name = None
+    identity = None  # Names the database itself, e.g. to keep caches of different databases apart
+    Error = Exception
+    supports_copy = False  # COPY ... FROM STDIN / TO STDOUT
+    supports_notifications = False  # LISTEN / NOTIFY
+
+    @abstractmethod
+    def connect(self):
+        pass
+
+    @abstractmethod
+    def is_closed(self, conn):
+        pass
+
+    @abstractmethod
+    def reset(self, conn):
+        """Roll back an open or failed transaction before the connection is reused."""
+
+    @abstractmethod
+    def cancel(self, conn):
+        """Abort the statement running on conn; safe to call from another thread."""
+
+    def ping(self, conn):
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+        conn.rollback()
+
+
+class PostgresBackend(StorageBackend):
+    name = 'postgres'
+    supports_copy = True
+    supports_notifications = True
+
+    def __init__(self, config):
+        import psycopg2
+        from psycopg2 import extensions
+
+        self.config = config
+        self.identity = (f"postgresql://{config.get('host', '')}:{config.get('port', '')}/"
+                         f"{config.get('dbname', '')}")
+        self._psycopg2 = psycopg2
+        self._transaction_idle = extensions.TRANSACTION_STATUS_IDLE
+        self.Error = psycopg2.Error
+
+    def connect(self):
+        return self._psycopg2.connect(**self.config)
+
+    def is_closed(self, conn):
+        return bool(conn.closed)
+
+    def reset(self, conn):
+        if conn.get_transaction_status() != self._transaction_idle:
+            conn.rollback()
+
+    def cancel(self, conn):
+        conn.cancel()
+
+
+class SQLiteCursor(sqlite3.Cursor):
+    """Cursor accepting the %s / %(name)s parameter style used throughout the application."""
+
+    itersize = None  # Accepted for compatibility with named PostgreSQL cursors; SQLite always streams
+
+    def execute(self, query, params=()):
+        return super().execute(to_sqlite_paramstyle(query), params)
+
+    def executemany(self, query, params_seq):
+        return super().executemany(to_sqlite_paramstyle(query), params_seq)
+
+
+class SQLiteConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.closed = False
+
+    def cursor(self, name=None, factory=SQLiteCursor):
+        # name is accepted so server-side cursor code runs unchanged; results are read lazily anyway
+        return super().cursor(factory)
+
+    def execute(self, query, params=()):
+        return self.cursor().execute(query, params)
+
+    def executemany(self, query, params_seq):
+        return self.cursor().executemany(query, params_seq)
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+def _register_sqlite_types():
+    # Money round-trips through its decimal text form; timestamps are stored as ISO 8601 text
+    sqlite3.register_adapter(Decimal, str)
+    sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+    sqlite3.register_adapter(date, lambda value: value.isoformat())
+    sqlite3.register_converter('DECIMAL', lambda value: Decimal(value.decode()).quantize(CENT))
+    sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+    sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+
+
+class SQLiteBackend(StorageBackend):
+    """Embedded database in one file, in WAL mode so readers never block the writer.
+
+    Write transactions start with BEGIN IMMEDIATE, so two connections never both read
+    and then fail to upgrade to a write lock; they wait for each other instead, for up
+    to busy_timeout milliseconds. The schema is created on first use.
+    """
+
+    name = 'sqlite'
+    Error = sqlite3.Error
+
+    def __init__(self, path, pragmas, statement_cache_size):
+        self.path = path
+        self.identity = 'sqlite:' + os.path.abspath(path)
+        self.pragmas = pragmas
+        self.statement_cache_size = statement_cache_size
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        _register_sqlite_types()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, factory=SQLiteConnection, isolation_level='IMMEDIATE',
+                               detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+                               cached_statements=self.statement_cache_size)
+        for pragma, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        self._ensure_schema(conn)
+        return conn
+
+    def is_closed(self, conn):
+        return conn.closed
+
+    def reset(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+
+    def cancel(self, conn):
+        conn.interrupt()
+
+    def _ensure_schema(self, conn):
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'products'").fetchone():
+                with open(SQLITE_SCHEMA_FILE, encoding='utf-8') as file:
+                    conn.executescript(file.read())
+                logging.info(f'Created the IMS schema in {self.path}')
+            self._schema_ready = True
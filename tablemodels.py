@@ -0,0 +1,145 @@
+from decimal import Decimal
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QSortFilterProxyModel, Qt
+from PyQt5.QtWidgets import QAbstractItemView, QHeaderView, QTableView
+
+from recordstore import RecordStore
+
+# Role returning the raw (unformatted) cell value, used for sorting
+SORT_ROLE = Qt.UserRole
+
+ROW_HEIGHT = 22
+
+
+class RecordTableModel(QAbstractTableModel):
+    """Table model over a record store that formats cells only when the view asks for them.
+
+    columns is a list of (header, getter) pairs where getter(record) returns the raw
+    cell value. Either pass a store, or a key(record) function to get a plain RecordStore.
+    """
+
+    def __init__(self, columns, key=None, store=None, parent=None):
+        super().__init__(parent)
+
+        self.columns = columns
+        self.store = store if store is not None else RecordStore(key)
+
+    @property
+    def rows(self):
+        return self.store.records
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.store)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        value = self.columns[index.column()][1](self.store.records[index.row()])
+        if role == Qt.DisplayRole:
+            return '' if value is None else str(value)
+        if role == SORT_ROLE:
+            return value
+        if role == Qt.TextAlignmentRole and isinstance(value, (int, float, Decimal)):
+            return Qt.AlignRight | Qt.AlignVCenter
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.columns[section][0]
+        return super().headerData(section, orientation, role)
+
+    def set_rows(self, rows):
+        """Replace every record."""
+        self.beginResetModel()
+        self.store.replace(rows)
+        self.endResetModel()
+
+    def append_rows(self, rows):
+        if not rows:
+            return
+
+        first = len(self.store)
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        self.store.extend(rows)
+        self.endInsertRows()
+
+    def row_changed(self, row):
+        """Repaint only the cells of a record that was updated in place."""
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.columns) - 1))
+
+    def remove_keys(self, keys):
+        """Remove the records with the given keys, returning how many were removed."""
+        positions = [self.store.position(key) for key in keys]
+        positions = sorted((position for position in positions if position is not None), reverse=True)
+
+        # Removing from the bottom up keeps the remaining positions valid until the reindex
+        for position in positions:
+            self.beginRemoveRows(QModelIndex(), position, position)
+            self.store.pop(position)
+            self.endRemoveRows()
+        if positions:
+            self.store.reindex()
+        return len(positions)
+
+    def row_for_key(self, key):
+        return self.store.position(key)
+
+    def record_for_key(self, key):
+        return self.store.get(key)
+
+
+class RecordSortFilterProxyModel(QSortFilterProxyModel):
+    """Sorts on raw cell values and filters on displayed text across all columns."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self.setSortRole(SORT_ROLE)
+        self.setFilterKeyColumn(-1)
+        self.setFilterCaseSensitivity(Qt.CaseInsensitive)
+
+    def lessThan(self, left, right):
+        left_value = left.data(SORT_ROLE)
+        right_value = right.data(SORT_ROLE)
+        if left_value is None or right_value is None:
+            return left_value is None and right_value is not None
+        try:
+            return left_value < right_value
+        except TypeError:
+            return str(left_value) < str(right_value)
+
+
+def create_record_view(model, parent=None):
+    """Create a sortable, filterable table view over a RecordTableModel.
+
+    Returns (view, proxy); the view only requests data for the rows it shows.
+    """
+    proxy = RecordSortFilterProxyModel(parent)
+    proxy.setSourceModel(model)
+
+    view = QTableView(parent)
+    view.setModel(proxy)
+    view.setSortingEnabled(True)
+    view.sortByColumn(0, Qt.AscendingOrder)
+    view.setSelectionBehavior(QAbstractItemView.SelectRows)
+    view.setSelectionMode(QAbstractItemView.SingleSelection)
+    view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+
+    # Fixed row heights keep scrolling independent of the number of rows
+    view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+    view.verticalHeader().setDefaultSectionSize(ROW_HEIGHT)
+    view.verticalHeader().hide()
+    view.horizontalHeader().setStretchLastSection(True)
+    return view, proxy
+
+
+def selected_source_row(view, proxy):
+    """Return the model row of the view's current selection, or -1."""
+    index = view.currentIndex()
+    if not index.isValid():
+        return -1
+    return proxy.mapToSource(index).row()
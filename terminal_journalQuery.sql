@@ -0,0 +1,9 @@
+-- Journal entries replayed from terminals' local journals (see localreplica.py).
+-- A terminal that lost its connection after the commit but before hearing about it
+-- replays the same entries again; the primary key makes every entry apply only once.
+CREATE TABLE replayed_journal_entries (
+    terminal_id VARCHAR(36) NOT NULL,
+    entry_id BIGINT NOT NULL,
+    replayed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (terminal_id, entry_id)
+);
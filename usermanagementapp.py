@@ -1,18 +1,10 @@
-import psycopg2
+import logging
+
 from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtWidgets import QWidget, QPushButton, QVBoxLayout, QMessageBox, QFormLayout, QLabel, QLineEdit
 
-# from adminpanel import AdminPanel
-from database import create_connection, close_connection
-from staffpanel import StaffPanel
-
-
-class User:
-    def __init__(self, user_id, username, password_hash, role):
-        self.user_id = user_id
-        self.username = username
-        self.password_hash = password_hash
-        self.role = role
+from inventoryservice import get_inventory_service
+from worker import DatabaseWorker
 
 
 class UserManagementApp(QWidget):
@@ -23,6 +15,8 @@ class UserManagementApp(QWidget):
         super().__init__()
 
         self.current_user = None  # To store the currently logged-in user
+        self.worker = DatabaseWorker(self)
+        self.service = get_inventory_service()
 
         self.setWindowTitle('User Management App')
         self.setGeometry(100, 100, 400, 200)
@@ -84,58 +78,31 @@ class UserManagementApp(QWidget):
         password = self.register_password_input.text()
         role = self.register_role_input.text()
 
-        conn = create_connection()
-
-        if conn:
-            try:
-                cursor = conn.cursor()
-
-                # Example: Check if the username is already taken
-                cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
-                existing_user = cursor.fetchone()
-
-                if existing_user:
-                    self.show_message_box('Registration Failed', 'Username already exists.')
-                else:
-                    # Example: Insert new user into the database
-                    cursor.execute("INSERT INTO users (username, password_hash, role) VALUES (%s, %s, %s)",
-                                   (username, password, role))
-                    conn.commit()
-
-                    self.show_message_box('Registration Successful', 'User registered successfully.')
+        self.worker.submit(None, self.service.register_user, username, password, role,
+                           on_result=self.on_user_registered,
+                           on_error=lambda error: logging.error(f"Error executing query: {error}"))
 
-            except (Exception, psycopg2.Error) as error:
-                print(f"Error executing query: {error}")
-
-            finally:
-                close_connection(conn)
+    def on_user_registered(self, registered):
+        if registered:
+            self.show_message_box('Registration Successful', 'User registered successfully.')
+        else:
+            self.show_message_box('Registration Failed', 'Username already exists.')
 
     def login(self):
         username = self.login_username_input.text()
         password = self.login_password_input.text()
 
-        conn = create_connection()
-
-        if conn:
-            try:
-                cursor = conn.cursor()
-
-                # Example: Check if the user exists in the database
-                cursor.execute("SELECT * FROM users WHERE username = %s AND password_hash = %s", (username, password))
-                result = cursor.fetchone()
-
-                if result:
-                    user = User(result[0], result[1], result[2], result[3])
-                    self.current_user = user
-                    self.show_dashboard()
-                else:
-                    self.show_message_box('Login Failed', 'Invalid username or password.')
-
-            except (Exception, psycopg2.Error) as error:
-                print(f"Error executing query: {error}")
-
-            finally:
-                close_connection(conn)
+        # Repeated clicks while a login is being checked share one query
+        self.worker.submit('login', self.service.authenticate, username, password,
+                           on_result=self.on_login_checked,
+                           on_error=lambda error: logging.error(f"Error executing query: {error}"))
+
+    def on_login_checked(self, user):
+        if user:
+            self.current_user = user
+            self.show_dashboard()
+        else:
+            self.show_message_box('Login Failed', 'Invalid username or password.')
 
     def show_dashboard(self):
         # Emit the showAdminPanelSignal signal when the user role is admin
@@ -0,0 +1,229 @@
+import logging
+import threading
+import time
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+
+from database import POOL_MAX_SIZE, get_backend, pooled_connection
+
+# Tasks taking longer than this are logged with their timings
+SLOW_TASK_THRESHOLD = 0.5  # Seconds
+
+_thread_pool = None
+
+
+def database_thread_pool():
+    """Return the shared thread pool used for database work, sized to the connection pool."""
+    global _thread_pool
+
+    if _thread_pool is None:
+        _thread_pool = QThreadPool()
+        _thread_pool.setMaxThreadCount(POOL_MAX_SIZE)
+    return _thread_pool
+
+
+class TaskSignals(QObject):
+    done = pyqtSignal(object)
+
+
+class DatabaseTask(QRunnable):
+    """Runs fn(conn, *args) on a pooled connection in a background thread and commits on success."""
+
+    def __init__(self, key, fn, args):
+        super().__init__()
+        # The worker keeps the task alive until its result has been delivered
+        self.setAutoDelete(False)
+
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.signals = TaskSignals()
+
+        self.result_callbacks = []
+        self.error_callbacks = []
+        self.result = None
+        self.error = None
+
+        self.started = False
+        self.cancelled = False
+        self.queued_at = time.perf_counter()
+        self.wait_time = self.run_time = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        with self._lock:
+            if self.cancelled:
+                self.signals.done.emit(self)
+                return
+            self.started = True
+
+        started_at = time.perf_counter()
+        self.wait_time = started_at - self.queued_at
+        try:
+            with pooled_connection() as conn:
+                if not conn:
+                    raise ConnectionError('Error connecting to the database')
+
+                with self._lock:
+                    self._conn = conn
+                try:
+                    self.result = self.fn(conn, *self.args)
+                    conn.commit()
+                finally:
+                    with self._lock:
+                        self._conn = None
+
+        except Exception as e:
+            self.error = e
+
+        self.run_time = time.perf_counter() - started_at
+        if self.error is not None:
+            if not self.cancelled:
+                logging.error(f'Background database task {self.name} failed: {self.error}', extra=self.timings())
+        elif self.run_time >= SLOW_TASK_THRESHOLD:
+            logging.info(f'Background database task {self.name} took {self.run_time * 1000:.0f} ms',
+                         extra=self.timings())
+        self.signals.done.emit(self)
+
+    @property
+    def name(self):
+        return self.key or self.fn.__name__
+
+    def timings(self):
+        """Fields for structured log records about this task."""
+        return {'operation': self.name,
+                'wait_ms': round(self.wait_time * 1000, 1) if self.wait_time is not None else None,
+                'duration_ms': round(self.run_time * 1000, 1) if self.run_time is not None else None}
+
+    def cancel(self):
+        """Drop the task's result and abort its query if it is already running."""
+        with self._lock:
+            self.cancelled = True
+            if self._conn is not None:
+                try:
+                    get_backend().cancel(self._conn)
+                except Exception as e:
+                    logging.warning(f'Error cancelling database query: {e}')
+
+
+class DatabaseWorker(QObject):
+    """Runs database work off the GUI thread and delivers results back on it.
+
+    Tasks submitted with the same key are coalesced: a request for a key that is
+    still queued shares the queued task, and a request for a key that is already
+    running is re-run once after it finishes so callers never see stale data.
+    Only the latest request's arguments are run: a request with different ones
+    supersedes the earlier requests, whose callbacks are dropped, so no caller
+    receives a result computed for someone else's arguments. Tasks with a key of
+    None are never coalesced.
+    """
+
+    def __init__(self, parent=None, thread_pool=None):
+        super().__init__(parent)
+
+        self.thread_pool = thread_pool or database_thread_pool()
+        self._in_flight = {}
+        self._pending = {}
+        self._tasks = set()
+
+    def submit(self, key, fn, *args, on_result=None, on_error=None):
+        """Schedule fn(conn, *args) and call on_result(result) or on_error(message) on the GUI thread."""
+        if key is not None and key in self._in_flight:
+            task = self._in_flight[key]
+            with task._lock:
+                if not task.started and not task.cancelled:
+                    # The queued task has not run yet, so it can simply take the latest arguments
+                    self._coalesce(task, fn, args, on_result, on_error)
+                    return task
+
+            # A running task for other arguments has been superseded; its result is not delivered
+            if not self._same_call(task, fn, args):
+                self._drop_callbacks(task)
+
+            # Coalesce every request made while the task runs into a single re-run
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = DatabaseTask(key, fn, args)
+                self._add_callbacks(pending, on_result, on_error)
+            else:
+                self._coalesce(pending, fn, args, on_result, on_error)
+            return pending
+
+        task = DatabaseTask(key, fn, args)
+        self._add_callbacks(task, on_result, on_error)
+        self._start(task)
+        return task
+
+    def cancel(self, key):
+        """Cancel the queued, running and pending tasks for a key."""
+        self._pending.pop(key, None)
+        task = self._in_flight.get(key)
+        if task:
+            task.cancel()
+
+    def cancel_all(self):
+        """Cancel every task this worker has started."""
+        self._pending.clear()
+        for task in list(self._tasks):
+            task.cancel()
+
+    def is_busy(self, key):
+        return key in self._in_flight
+
+    def _start(self, task):
+        if task.key is not None:
+            self._in_flight[task.key] = task
+        self._tasks.add(task)
+        task.signals.done.connect(self._on_task_done)
+        self.thread_pool.start(task)
+
+    @pyqtSlot(object)
+    def _on_task_done(self, task):
+        self._tasks.discard(task)
+        if task.key is not None and self._in_flight.get(task.key) is task:
+            del self._in_flight[task.key]
+
+        if not task.cancelled:
+            if task.error is None:
+                callbacks, value = task.result_callbacks, task.result
+            else:
+                callbacks, value = task.error_callbacks, str(task.error)
+
+            for callback in callbacks:
+                try:
+                    callback(value)
+                except Exception as e:
+                    # An exception escaping a Qt slot would abort the application
+                    logging.error(f'Error handling result of {task.name}: {e}', extra=task.timings())
+
+        pending = self._pending.pop(task.key, None) if task.key is not None else None
+        if pending is not None:
+            self._start(pending)
+
+    @classmethod
+    def _coalesce(cls, task, fn, args, on_result, on_error):
+        if not cls._same_call(task, fn, args):
+            task.fn, task.args = fn, args
+            cls._drop_callbacks(task)
+        cls._add_callbacks(task, on_result, on_error)
+
+    @staticmethod
+    def _same_call(task, fn, args):
+        try:
+            return bool(task.fn == fn and task.args == args)
+        except Exception:
+            # Arguments such as NumPy arrays have no single truth value; treat them as different
+            return False
+
+    @staticmethod
+    def _drop_callbacks(task):
+        task.result_callbacks = []
+        task.error_callbacks = []
+
+    @staticmethod
+    def _add_callbacks(task, on_result, on_error):
+        if on_result is not None and on_result not in task.result_callbacks:
+            task.result_callbacks.append(on_result)
+        if on_error is not None and on_error not in task.error_callbacks:
+            task.error_callbacks.append(on_error)